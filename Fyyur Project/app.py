@@ -2,25 +2,56 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import csv
+import io
 import json
+import hashlib
+import hmac
+import random
+import zlib
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
+import babel.dates
+import pytz
+from flask import Flask, Blueprint, has_app_context, has_request_context, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context, session, g
 
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from flask_wtf import FlaskForm
 
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from routing import RoutingSQLAlchemy, ReplicaSet
 import logging
 from flask_migrate import Migrate
 from forms import *
 
+import os
+import re
 import sys
-from datetime import datetime
-from sqlalchemy import MetaData
+import time
+import click
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from sqlalchemy import MetaData, DDL, Computed, event
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import TSVECTOR, TSTZRANGE, ExcludeConstraint
+from werkzeug.datastructures import MultiDict
+from jinja2 import FileSystemBytecodeCache
 from forms import VenueForm, ArtistForm, ShowForm
+from cache import LRUCache, make_cache
+from dbpool import instrument, pool_stats
+from importer import run_import
+from debounce import Debouncer
+from sqltrace import RequestTrace, QueryBudgetExceeded, query_budget, trace_engine
+from jobs import make_queue
+from metrics import Registry
+from profiler import Sampler
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
 
 
 #----------------------------------------------------------------------------#
@@ -30,9 +61,252 @@ from forms import VenueForm, ArtistForm, ShowForm
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 
+# Flask-SQLAlchemy gives every request its own session and removes it (rolling
+# back anything uncommitted and returning the connection to the pool) when
+# the app context tears down, so handlers only commit or roll back.
+with app.app_context():
+  replicas = ReplicaSet([db.get_engine(app, bind) for bind in sorted(app.config['SQLALCHEMY_BINDS'])],
+                        app.config['REPLICA_RETRY_AFTER'])
+  for engine in [db.engine] + replicas.engines:
+    instrument(engine, app.config['DB_STATEMENT_TIMEOUT_MS'] if app.config['DB_PGBOUNCER'] else None)
+    trace_engine(engine, lambda: g.get('sql_trace') if has_app_context() else None)
+
+# Routes that never write; these may read from a replica.
+READ_ONLY_ENDPOINTS = {
+  'venues', 'artists', 'show_venue', 'show_artist', 'shows',
+  'search_venues', 'search_artists', 'search_all', 'search_suggest', 'export',
+}
+
+
+@app.before_request
+def choose_database():
+  # Clients that just wrote read from the primary for a while, so they see
+  # their own changes despite replication lag.
+  if (request.endpoint in READ_ONLY_ENDPOINTS or request.blueprint == 'api') and replicas.engines and \
+      session.get('primary_until', 0) < time.time():
+    g.db_replica = replicas.choose()
+
+
+@app.errorhandler(DBAPIError)
+def read_from_primary(error):
+  # A read whose replica just went down runs again on the primary, instead
+  # of failing. Any other database error goes on to the 500 handler.
+  replica = g.pop('db_replica', None)
+  if replica is None or not replicas.is_down(replica):
+    raise error
+  app.logger.warning('replica %s failed, reading from the primary: %s', replica.url, error.orig)
+  db.session.rollback()
+  try:
+    return app.dispatch_request()
+  except Exception as retry_error:
+    return app.handle_user_exception(retry_error)
+
+
+@app.after_request
+def remember_write(response):
+  if request.method not in ('GET', 'HEAD') and request.endpoint not in READ_ONLY_ENDPOINTS:
+    session['primary_until'] = time.time() + app.config['REPLICA_LAG_WINDOW']
+  return response
+
+
+sql_log = logging.getLogger('fyyur.sql')
+
+
+@app.before_request
+def start_sql_trace():
+  # Metrics take their per-request DB time from the trace too.
+  if app.config['SQL_TRACE'] or app.config['METRICS']:
+    g.sql_trace = RequestTrace(app.config['SQL_TRACE_N_PLUS_ONE'])
+
+
+@app.after_request
+def finish_sql_trace(response):
+  # Statements of a streamed body run after this and are not counted.
+  trace = g.get('sql_trace')
+  if trace is None or not app.config['SQL_TRACE']:
+    return response
+  response.headers.add('Server-Timing', trace.server_timing())
+  summary = trace.summary()
+  summary.update(method=request.method, path=request.full_path.rstrip('?'),
+                 endpoint=request.endpoint, status=response.status_code)
+  budget = getattr(app.view_functions.get(request.endpoint), 'query_budget', None)
+  over_budget = budget is not None and trace.count > budget
+  if over_budget:
+    summary['query_budget'] = budget
+  slow = trace.db_time * 1000 > app.config['SQL_TRACE_SLOW_MS']
+  sql_log.log(logging.WARNING if slow or over_budget or summary['n_plus_one'] else logging.INFO,
+              json.dumps(summary))
+  if over_budget and app.config['SQL_QUERY_BUDGETS'] == 'raise':
+    trace.check_budget(budget, request.endpoint)
+  return response
+
+
+@app.context_processor
+def sql_overlay():
+  # The statements behind the page, listed at its foot in debug mode.
+  if app.config['SQL_TRACE_OVERLAY']:
+    return {'sql_trace': g.get('sql_trace')}
+  return {}
+
+
+# Prometheus metrics, served at /metrics. Each gunicorn worker counts in
+# memory and, with METRICS_DIR, writes its counts there once a second, so
+# whichever worker answers a scrape reports the sum over all of them.
+metrics = Registry(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+REQUESTS = metrics.counter('fyyur_requests_total', 'Requests by endpoint, method and status.',
+                           ('endpoint', 'method', 'status'))
+REQUEST_TIME = metrics.histogram('fyyur_request_duration_seconds', 'Time to build a response.',
+                                 ('endpoint', 'method'))
+REQUEST_DB_TIME = metrics.histogram('fyyur_request_db_seconds', 'Time a request spent in the database.',
+                                    ('endpoint',))
+REQUEST_QUERIES = metrics.histogram('fyyur_request_queries', 'Statements a request ran.', ('endpoint',),
+                                    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+RENDER_TIME = metrics.histogram('fyyur_template_render_seconds', 'Time to render a template.',
+                                ('template',))
+DB_IN_USE = metrics.gauge('fyyur_db_connections_in_use', 'Pool connections checked out.')
+DB_IDLE = metrics.gauge('fyyur_db_connections_idle', 'Pool connections open and idle.')
+DB_OVERFLOW = metrics.gauge('fyyur_db_pool_overflow', 'Connections opened beyond the pool size.')
+DB_CHECKOUTS = metrics.counter('fyyur_db_checkouts_total', 'Pool checkouts.')
+DB_WAIT = metrics.counter('fyyur_db_checkout_wait_seconds_total', 'Time spent waiting for a pool connection.')
+DB_TIMEOUTS = metrics.counter('fyyur_db_checkout_timeouts_total', 'Checkouts that gave up waiting.')
+DB_CONNECT_ERRORS = metrics.counter('fyyur_db_connect_errors_total', 'Checkouts whose new connection failed.')
+CACHE_HITS = metrics.counter('fyyur_cache_hits_total', 'Cache lookups that found an entry.', ('cache',))
+CACHE_MISSES = metrics.counter('fyyur_cache_misses_total', 'Cache lookups that found nothing.', ('cache',))
+metrics.ratio('fyyur_cache_hit_ratio', 'Share of cache lookups that hit.',
+              'fyyur_cache_hits_total', 'fyyur_cache_misses_total')
+JOBS = metrics.counter('fyyur_jobs_total', 'Background jobs by outcome.', ('outcome',))
+
+
+@metrics.collector
+def collect_process_metrics():
+  # Totals that the pool, the caches and the job queue already keep.
+  pool = pool_stats.snapshot(db.engine.pool)
+  DB_IN_USE.set(pool['in_use'])
+  DB_IDLE.set(pool.get('idle', 0))
+  DB_OVERFLOW.set(max(pool.get('overflow', 0), 0))
+  DB_CHECKOUTS.set(pool['checkouts'])
+  DB_WAIT.set(pool['wait_seconds_total'])
+  DB_TIMEOUTS.set(pool['timeouts'])
+  DB_CONNECT_ERRORS.set(pool['connect_errors'])
+  caches = [('page', page_cache), ('suggest', suggest_cache)]
+  if hasattr(render_datetime, 'cache_info'):
+    caches.append(('datetime', render_datetime.cache_info()))
+  for name, cache in caches:
+    CACHE_HITS.set(cache.hits, name)
+    CACHE_MISSES.set(cache.misses, name)
+  for outcome, count in jobs.counts.items():
+    JOBS.set(count, outcome)
+
+
+@app.before_request
+def start_request_timer():
+  g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+  if not app.config['METRICS'] or 'request_started' not in g:
+    return response
+  # Unrouted paths share one label, so scanners cannot add series.
+  endpoint = request.endpoint or 'none'
+  REQUESTS.inc(endpoint, request.method, response.status_code)
+  REQUEST_TIME.observe(time.perf_counter() - g.request_started, endpoint, request.method)
+  trace = g.get('sql_trace')
+  if trace is not None:
+    REQUEST_DB_TIME.observe(trace.db_time, endpoint)
+    REQUEST_QUERIES.observe(trace.count, endpoint)
+  metrics.flush()
+  return response
+
+
+# Opt-in sampling profiler: a request is profiled when it sends
+# X-Fyyur-Profile with PROFILE_TOKEN, or at random, PROFILE_SAMPLE_RATE of
+# the time. Its stacks go to PROFILE_DIR as a flamegraph's .folded input.
+profiler = Sampler(app.config['PROFILE_DIR'], app.config['PROFILE_INTERVAL_MS'] / 1000.0,
+                   app.config['PROFILE_MAX_SAMPLES'], app.config['PROFILE_MAX_ACTIVE'],
+                   app.config['PROFILE_KEEP'])
+
+
+@app.before_request
+def start_profile():
+  token = app.config['PROFILE_TOKEN']
+  # compare_digest refuses non-ASCII str; headers arrive as latin-1 text.
+  asked = bool(token) and hmac.compare_digest(request.headers.get('X-Fyyur-Profile', '').encode('utf-8'),
+                                              token.encode('utf-8'))
+  rate = app.config['PROFILE_SAMPLE_RATE']
+  if asked or (rate and random.random() < rate):
+    g.profile = profiler.start('%s-%s' % (request.endpoint or 'none', os.urandom(4).hex()))
+
+
+@app.after_request
+def name_profile(response):
+  if g.get('profile') is not None:
+    response.headers['X-Fyyur-Profile'] = g.profile.name
+  return response
+
+
+@app.teardown_request
+def finish_profile(error):
+  # After a streamed body has been sent, too.
+  profile = g.pop('profile', None)
+  if profile is not None:
+    profiler.stop(profile)
+
+
+def current_time():
+  # Show times are stored as timestamptz; compare them with an aware "now",
+  # never the server's local wall clock.
+  return datetime.now(timezone.utc)
+
+
+def request_locale():
+  # The best of the supported locales for this request's Accept-Language,
+  # worked out once per request. Outside a request, the default.
+  if not has_request_context():
+    return app.config['DEFAULT_LOCALE']
+  if 'locale' not in g:
+    g.locale = request.accept_languages.best_match(app.config['LOCALES']) or \
+      app.config['DEFAULT_LOCALE']
+  return g.locale
+
+
+def venue_zone(zone):
+  # A venue's pytz zone. Unknown names, which the forms refuse but older rows
+  # may hold, read as UTC rather than failing every page that shows them.
+  try:
+    return pytz.timezone(zone or 'UTC')
+  except pytz.UnknownTimeZoneError:
+    return pytz.utc
+
+
+def localize(naive, zone):
+  # A wall-clock time entered for a venue, as an aware time. Ambiguous and
+  # skipped times around DST changes resolve to standard time.
+  zone = venue_zone(zone)
+  return zone.normalize(zone.localize(naive, is_dst=False))
+
+CURSOR_TIME_FORMAT = '%Y%m%dT%H%M%S.%f'
+SEARCH_WORD = re.compile(r'\w+')
+
+# Typeahead results by normalized term; cleared whenever a venue or artist
+# is created, edited or deleted.
+suggest_cache = LRUCache(app.config['SUGGEST_CACHE_SIZE'], app.config['SUGGEST_CACHE_TTL'])
+
+# Rendered venue and artist pages, keyed on entity version counters that the
+# write handlers bump; see page_cache_key() and bump_versions().
+page_cache = make_cache(app.config['PAGE_CACHE_URL'], app.config['PAGE_CACHE_SIZE'],
+                        app.config['PAGE_CACHE_TTL'])
+
+# Follow-up work of writes, queued once they have committed; see the Jobs
+# section.
+jobs = make_queue(app.config['JOB_QUEUE_URL'], workers=app.config['JOB_WORKERS'],
+                  retries=app.config['JOB_RETRIES'], backoff=app.config['JOB_RETRY_BACKOFF'],
+                  dead_size=app.config['JOB_DEAD_LETTER_SIZE'], key_ttl=app.config['JOB_KEY_TTL'],
+                  context=app.app_context)
+
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -53,7 +327,23 @@ class Venue(db.Model):
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, nullable=False)
     seeking_description =  db.Column(db.String(120))
+    # IANA zone the venue's show times are entered and displayed in.
+    timezone = db.Column(db.String(64), nullable=False, default='UTC', server_default='UTC')
     shows = db.relationship('Show', backref='venue', lazy=True)
+    # Show counters, kept by the Show insert/delete events and rolled forward
+    # by `flask roll-shows`; stale once next_show_at has passed.
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime(timezone=True), index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+
+    # Maintained by the Venue_search_vector trigger, see SEARCH_VECTOR_DDL.
+    search_vector = db.Column(TSVECTOR)
+
+    __table_args__ = (
+        db.Index('ix_Venue_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     def __repr__(self):
         return f'<Venue {self.id}, {self.name}, {self.city},\
@@ -78,7 +368,20 @@ class Artist(db.Model):
     seeking_description =  db.Column(db.String(120))
    
     shows = db.relationship('Show', backref='artist', lazy=True)
-
+    # Show counters, kept by the Show insert/delete events and rolled forward
+    # by `flask roll-shows`; stale once next_show_at has passed.
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime(timezone=True), index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+
+    # Maintained by the Artist_search_vector trigger, see SEARCH_VECTOR_DDL.
+    search_vector = db.Column(TSVECTOR)
+
+    __table_args__ = (
+        db.Index('ix_Artist_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     def __repr__(self):
       return f'<Artist {self.id}, {self.name}, {self.city}, {self.state},\
@@ -87,37 +390,753 @@ class Artist(db.Model):
                        {self.seeking_venue}, { self.seeking_description}>'
 
 
+def default_end_time(context):
+    return context.get_current_parameters()['start_time'] + \
+        timedelta(minutes=app.config['SHOW_DEFAULT_MINUTES'])
+
+
 class Show(db.Model):
     __tablename__ = 'Show'
 
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime, nullable=False)
+    start_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    end_time = db.Column(db.DateTime(timezone=True), nullable=False, default=default_end_time)
+    # The booked period [start_time, end_time), computed by Postgres. The
+    # exclusion constraints below refuse a second booking of a venue or an
+    # artist that overlaps it, using the GiST index each one builds.
+    booked = db.Column(TSTZRANGE, Computed('tstzrange(start_time, end_time)'))
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False )
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time', 'start_time'),
+        db.CheckConstraint('end_time > start_time', name='Show_end_after_start'),
+        ExcludeConstraint(('venue_id', '='), ('booked', '&&'),
+                          name='Show_venue_booking_excl', using='gist'),
+        ExcludeConstraint(('artist_id', '='), ('booked', '&&'),
+                          name='Show_artist_booking_excl', using='gist'),
+    )
 
     def __repr__(self):
         return f'<Show artist_id : {self.venue_id} venue_id: {self.artist_id},\
                  start_time: {self.start_time} venue: {self.venue.name}>'
 
+# Name, city/state and genres, weighted in that order, for full-text search.
+# Kept in step with the search vector migration.
+SEARCH_VECTOR_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION fyyur_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql''')
+
+# DDL's own %(table)s comes quoted already, so the bare table name is filled
+# in here, once per table.
+SEARCH_VECTOR_TRIGGER = '''
+CREATE TRIGGER "%(table)s_search_vector" BEFORE INSERT OR UPDATE OF name, city, state, genres
+ON "%(table)s" FOR EACH ROW EXECUTE PROCEDURE fyyur_search_vector_update()'''
+
+for model in (Venue, Artist):
+    event.listen(model.__table__, 'after_create', SEARCH_VECTOR_FUNCTION.execute_if(dialect='postgresql'))
+    event.listen(model.__table__, 'after_create',
+                 DDL(SEARCH_VECTOR_TRIGGER % {'table': model.__tablename__}).execute_if(dialect='postgresql'))
+
+# The /venues directory, one row per area, refreshed by refresh_directory()
+# after venue and show writes. Kept in step with the directory migration.
+VenueDirectory = db.Table(
+  'VenueDirectory', MetaData(),
+  db.Column('city', db.String(120)),
+  db.Column('state', db.String(120)),
+  db.Column('venues', postgresql.JSON),
+  db.Column('venue_count', db.Integer),
+  db.Column('updated_at', db.DateTime))
+
+VENUE_DIRECTORY_DDL = DDL('''
+CREATE MATERIALIZED VIEW "VenueDirectory" AS
+SELECT city, state,
+       json_agg(json_build_object('id', id, 'name', name,
+                                  'upcoming_show_count', upcoming_show_count,
+                                  'next_show_at', next_show_at) ORDER BY id) AS venues,
+       count(*) AS venue_count,
+       max(updated_at) AS updated_at
+FROM "Venue" GROUP BY city, state;
+CREATE UNIQUE INDEX "ix_VenueDirectory_area" ON "VenueDirectory" (city, state)''')
+
+event.listen(Venue.__table__, 'after_create', VENUE_DIRECTORY_DDL.execute_if(dialect='postgresql'))
+event.listen(Venue.__table__, 'before_drop',
+             DDL('DROP MATERIALIZED VIEW IF EXISTS "VenueDirectory"').execute_if(dialect='postgresql'))
+
+# How many DELETE and TRUNCATE statements each table has seen, bumped by a
+# statement-level trigger. With max(updated_at), which moves on every insert
+# and update, it tells validators() that a table changed without counting
+# its rows. Kept in step with the deletions migration.
+Deletions = db.Table(
+  'Deletions',
+  db.Column('table_name', db.String(64), primary_key=True),
+  db.Column('count', db.BigInteger, nullable=False, default=0))
+
+DELETIONS_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION fyyur_count_deletions() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO "Deletions" (table_name, count) VALUES (TG_TABLE_NAME, 1)
+  ON CONFLICT (table_name) DO UPDATE SET count = "Deletions".count + 1;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql''')
+
+DELETIONS_TRIGGER = '''
+CREATE TRIGGER "%(table)s_deletions" AFTER DELETE OR TRUNCATE
+ON "%(table)s" FOR EACH STATEMENT EXECUTE PROCEDURE fyyur_count_deletions()'''
+
+for model in (Venue, Artist, Show):
+    event.listen(model.__table__, 'after_create', DELETIONS_FUNCTION.execute_if(dialect='postgresql'))
+    event.listen(model.__table__, 'after_create',
+                 DDL(DELETIONS_TRIGGER % {'table': model.__tablename__}).execute_if(dialect='postgresql'))
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+def show_column(model):
+  return Show.venue_id if model is Venue else Show.artist_id
+
+
+def counters_current(model, now):
+  # The stored counters are exact until the next upcoming show starts.
+  return db.or_(model.next_show_at == None, model.next_show_at > now)
+
+
+def recount_statement(model, now, ids=None, stale=False):
+  # One UPDATE recomputing the counters of `ids`, of the rows whose counters
+  # went stale, or of every row, from the Show table.
+  column = show_column(model)
+
+  def shows(value, *criteria):
+    return db.select([value]).where(db.and_(column == model.id, *criteria)).as_scalar()
+
+  statement = model.__table__.update().values(
+    upcoming_show_count=shows(db.func.count(Show.id), Show.start_time >= now),
+    past_show_count=shows(db.func.count(Show.id), Show.start_time < now),
+    next_show_at=shows(db.func.min(Show.start_time), Show.start_time >= now))
+  if ids is not None:
+    statement = statement.where(model.id.in_(ids))
+  if stale:
+    statement = statement.where(model.next_show_at <= now)
+  return statement
+
+
+@event.listens_for(Show, 'after_insert')
+def count_new_show(mapper, connection, show):
+  now = current_time()
+  for model, entity_id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+    if show.start_time >= now:
+      values = {'upcoming_show_count': model.upcoming_show_count + 1,
+                'next_show_at': db.func.least(model.next_show_at, show.start_time)}
+    else:
+      values = {'past_show_count': model.past_show_count + 1}
+    connection.execute(model.__table__.update().where(model.id == entity_id).values(**values))
+
+
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+  now = current_time()
+  connection.execute(recount_statement(Venue, now, ids=[show.venue_id]))
+  connection.execute(recount_statement(Artist, now, ids=[show.artist_id]))
+
+
+def roll_shows(now=None):
+  # Move shows that have started from upcoming to past. Only venues and
+  # artists whose next show has passed are touched.
+  now = now or current_time()
+  for model in (Venue, Artist):
+    db.session.execute(recount_statement(model, now, stale=True))
+
+
+def show_count_mismatches(model, now):
+  column = show_column(model)
+  actual = db.session.query(
+      column.label('id'),
+      db.func.count(Show.id).filter(Show.start_time >= now).label('upcoming'),
+      db.func.count(Show.id).filter(Show.start_time < now).label('past'),
+      db.func.min(Show.start_time).filter(Show.start_time >= now).label('next_show_at')).\
+    group_by(column).subquery()
+  return db.session.query(model.id).outerjoin(actual, actual.c.id == model.id).filter(db.or_(
+    model.upcoming_show_count != db.func.coalesce(actual.c.upcoming, 0),
+    model.past_show_count != db.func.coalesce(actual.c.past, 0),
+    model.next_show_at.is_distinct_from(actual.c.next_show_at))).all()
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def venue_directory():
+  # The whole directory from the materialized view in one indexed scan, a
+  # row per area. Stored counters are used unless they went stale, in which
+  # case those venues' upcoming shows are counted in one extra query.
+  now = current_time()
+  areas = directory_query().all()
+  stale = stale_venues(areas, now)
+  recounted = dict(upcoming_counts_query(stale, now)) if stale else {}
+  return directory(areas, stale, recounted)
+
+
+def directory_query():
+  return db.session.query(VenueDirectory.c.city, VenueDirectory.c.state, VenueDirectory.c.venues).\
+    order_by(VenueDirectory.c.city, VenueDirectory.c.state)
+
+
+def stale_venues(areas, now):
+  # The view's JSON carries next_show_at as text with the session's offset,
+  # so compare parsed times, not strings.
+  return set(venue['id'] for area in areas for venue in area.venues
+             if venue['next_show_at'] is not None and parse_datetime(venue['next_show_at']) <= now)
+
+
+def upcoming_counts_query(venue_ids, now):
+  return db.session.query(Show.venue_id, db.func.count(Show.id)).\
+    filter(Show.venue_id.in_(venue_ids), Show.start_time >= now).group_by(Show.venue_id)
+
+
+def directory(areas, stale, recounted):
+  return [{
+    'city': area.city,
+    'state': area.state,
+    'venues': [{
+      'id': venue['id'],
+      'name': venue['name'],
+      'num_upcoming_shows': recounted.get(venue['id'], 0) if venue['id'] in stale
+                            else venue['upcoming_show_count'],
+    } for venue in area.venues],
+  } for area in areas]
+
+
+def refresh_directory():
+  with app.app_context():
+    db.session.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY "VenueDirectory"')
+    db.session.commit()
+
+
+# Bursts of venue and show writes share one refresh.
+directory_refresh = Debouncer(app.config['DIRECTORY_REFRESH_DELAY'], refresh_directory)
+
+
+def encode_cursor(start_time, show_id):
+  # Cursors carry UTC, whatever offset the connection returned.
+  return '%s_%d' % (start_time.astimezone(timezone.utc).strftime(CURSOR_TIME_FORMAT), show_id)
+
+
+def decode_cursor(cursor):
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return datetime.strptime(start_time, CURSOR_TIME_FORMAT).replace(tzinfo=timezone.utc), int(show_id)
+  except ValueError:
+    abort(400)
+
+
+def page_limit(default='SHOWS_PAGE_SIZE', maximum='SHOWS_PAGE_MAX'):
+  limit = request.args.get('limit', app.config[default], type=int)
+  return max(1, min(limit, app.config[maximum]))
+
+
+def show_counts(entity_column, entity_id, now):
+  return show_counts_query(entity_column, entity_id, now).one()
+
+
+def show_counts_query(entity_column, entity_id, now):
+  # Past and upcoming totals for one venue or artist, counted by the database.
+  return db.session.query(
+      db.func.count(Show.id).filter(Show.start_time < now).label('past'),
+      db.func.count(Show.id).filter(Show.start_time >= now).label('upcoming'),
+      db.func.min(Show.start_time).filter(Show.start_time >= now).label('next_show_at')).\
+    filter(entity_column == entity_id)
+
+
+def keyset(query, now, upcoming, cursor):
+  # Keyset order over (start_time, id): upcoming shows soonest first, past
+  # shows most recent first, resuming after the row named by `cursor`.
+  key = db.tuple_(Show.start_time, Show.id)
+  if upcoming:
+    query = query.filter(Show.start_time >= now).order_by(Show.start_time, Show.id)
+    if cursor:
+      query = query.filter(key > db.tuple_(*decode_cursor(cursor)))
+  else:
+    query = query.filter(Show.start_time < now).order_by(Show.start_time.desc(), Show.id.desc())
+    if cursor:
+      query = query.filter(key < db.tuple_(*decode_cursor(cursor)))
+  return query
+
+
+def show_page(query, now, upcoming, cursor, limit):
+  # Returns one page of rows and the cursor of the next page.
+  return split_page(keyset(query, now, upcoming, cursor).limit(limit + 1).all(), limit)
+
+
+def split_page(rows, limit):
+  # Up to limit + 1 rows: the page, and the cursor of the next one if the
+  # extra row came back.
+  if len(rows) > limit:
+    return rows[:limit], encode_cursor(rows[limit - 1].start_time, rows[limit - 1].show_id)
+  return rows, None
+
+
+def search_query(term):
+  # Every word of the term must match the start of a word in the document,
+  # so "san fran" finds "San Francisco".
+  words = SEARCH_WORD.findall(term.lower())
+  if not words:
+    return None
+  # The configuration is inlined, not bound, so Postgres reads it as a
+  # regconfig whichever driver sends the statement.
+  return db.func.to_tsquery(db.literal_column("'simple'"), ' & '.join(word + ':*' for word in words))
+
+
+def search(model, term, limit=None):
+  return search_results(search_rows_query(model, term, limit).all())
+
+
+def search_rows_query(model, term, limit=None):
+  limit = limit or app.config['SEARCH_RESULT_LIMIT']
+  query = search_query(term)
+  if query is None:
+    return db.session.query(model.id, model.name, db.func.count().over().label('total')).\
+      order_by(model.name, model.id).limit(limit)
+  return db.session.query(model.id, model.name, db.func.count().over().label('total')).\
+    filter(model.search_vector.op('@@')(query)).\
+    order_by(db.func.ts_rank(model.search_vector, query).desc(), model.id).\
+    limit(limit)
+
+
+def search_results(rows):
+  return {'count': rows[0].total if rows else 0, 'data': rows}
+
+
+def suggest(term, limit):
+  query = suggest_query(term, limit)
+  return suggestions(query.all()) if query is not None else []
+
+
+def suggest_query(term, limit):
+  # Best prefix matches across venues and artists in one round-trip.
+  query = search_query(term)
+  if query is None:
+    return None
+  matches = db.union_all(*[db.select([
+      model.id, model.name, db.literal(kind).label('kind'),
+      db.func.ts_rank(model.search_vector, query).label('rank')]).
+    where(model.search_vector.op('@@')(query))
+    for model, kind in ((Venue, 'venue'), (Artist, 'artist'))]).alias('matches')
+  return db.session.query(matches).order_by(matches.c.rank.desc(), matches.c.name).limit(limit)
+
+
+def suggestions(rows):
+  return [{'id': row.id, 'name': row.name, 'kind': row.kind} for row in rows]
+
+
+class ShowTimes(object):
+  """Formats the start times of a page of show rows for display.
+
+  Each row becomes a dict with a `start_time_display` in its venue's
+  timezone (the row's `venue_timezone`, else `timezone`) and the request's
+  locale. A page repeats the same few times, so each distinct (time, zone)
+  is formatted once.
+  """
+
+  def __init__(self, timezone=None, format='full'):
+    self.timezone = timezone
+    self.format = format
+    self.locale = request_locale()
+    self.formatted = {}
+
+  def row(self, row):
+    show = row._asdict()
+    zone = show.get('venue_timezone') or self.timezone or 'UTC'
+    key = (show['start_time'], zone)
+    if key not in self.formatted:
+      self.formatted[key] = format_datetime(show['start_time'], self.format, self.locale, zone)
+    show['start_time_display'] = self.formatted[key]
+    return show
+
+  def rows(self, rows):
+    return [self.row(row) for row in rows]
+
+
+class ShowStream(object):
+  """A page of show rows fetched lazily from a server-side cursor.
+
+  `next_cursor` is only known once the rows have been iterated, so templates
+  read it after their loop.
+  """
+
+  def __init__(self, query, limit):
+    self.query = query.limit(limit + 1).yield_per(app.config['SHOWS_FETCH_SIZE'])
+    self.limit = limit
+    self.times = ShowTimes()
+    self.next_cursor = None
+
+  def __iter__(self):
+    last = None
+    for n, row in enumerate(self.query):
+      if n == self.limit:
+        self.next_cursor = encode_cursor(last.start_time, last.show_id)
+        break
+      last = row
+      yield self.times.row(row)
+
+
+def shows_query():
+  return db.session.query(
+      Show.id.label('show_id'), Show.start_time, Show.venue_id, Show.artist_id,
+      Venue.name.label('venue_name'), Venue.timezone.label('venue_timezone'),
+      Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')).\
+    join(Venue).join(Artist)
+
+
+def show_sections(entity, other, columns):
+  now = current_time()
+  limit = page_limit()
+  entity_column = show_column(type(entity))
+  counts = stored_counts(entity, now) or show_counts(entity_column, entity.id, now)._asdict()
+  query = section_query(entity_column, entity.id, other, columns)
+  times = ShowTimes(getattr(entity, 'timezone', None))
+  sections = {}
+  for name, upcoming in (('upcoming', True), ('past', False)):
+    shows, next_cursor = show_page(query, now, upcoming,
+                                   request.args.get(name + '_cursor'), limit)
+    sections[name] = {'count': counts[name], 'shows': times.rows(shows), 'next_cursor': next_cursor}
+  sections['next_show_at'] = counts['next_show_at']
+  return sections
+
+
+def stored_counts(entity, now):
+  # The entity's show counters, unless its next show has started since.
+  if entity.next_show_at is None or entity.next_show_at > now:
+    return {'past': entity.past_show_count, 'upcoming': entity.upcoming_show_count,
+            'next_show_at': entity.next_show_at}
+  return None
+
+
+def section_query(entity_column, entity_id, other, columns):
+  return db.session.query(Show.id.label('show_id'), Show.start_time, *columns).\
+    join(other).filter(entity_column == entity_id)
+
+
+# Exclusion constraints on Show, by the kind of double booking they refuse.
+BOOKING_CONSTRAINTS = {
+  'Show_venue_booking_excl': ('venue', Show.venue_id),
+  'Show_artist_booking_excl': ('artist', Show.artist_id),
+}
+
+
+def booking_constraint(error):
+  # The booking constraint an IntegrityError comes from, if it is one.
+  name = getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+  return name if name in BOOKING_CONSTRAINTS else None
+
+
+def booking_conflict(error, venue_id, artist_id, start_time, end_time):
+  # The kind of double booking behind `error` and a show already holding
+  # that time, found through the constraint's own GiST index.
+  name = booking_constraint(error)
+  if name is None:
+    return None, None
+  kind, column = BOOKING_CONSTRAINTS[name]
+  show = db.session.query(
+      Show.start_time, Show.end_time, Venue.name.label('venue_name'),
+      Venue.timezone.label('venue_timezone'), Artist.name.label('artist_name')).\
+    join(Venue).join(Artist).\
+    filter(column == (venue_id if kind == 'venue' else artist_id),
+           Show.booked.op('&&')(db.func.tstzrange(start_time, end_time))).first()
+  return kind, show
+
+
+def page_cache_key(kind, entity_id, related, etag):
+  # A detail page depends on its own entity and on the names and images of
+  # the `related` kind it lists, so both version counters go in the key.
+  # So does the page's ETag, which covers the path, query string and locale:
+  # it is worked out from the database on every request, so a body rendered
+  # from older data (in another worker's cache, or before a version bump ran)
+  # is never served under a newer ETag. Pages without one, carrying flashed
+  # messages or the SQL overlay, are never cached.
+  if not etag:
+    return None
+  return 'page:%s:%s:v%d:%d:%s' % (
+    kind, entity_id,
+    page_cache.counter('version:%s:%s' % (kind, entity_id)),
+    page_cache.counter('version:%s:*' % related), etag)
+
+
+def page_ttl(next_show_at):
+  # Never keep a page past the moment its next upcoming show becomes past.
+  ttl = app.config['PAGE_CACHE_TTL']
+  if g.get('db_replica') is not None:
+    # A lagging replica may have rendered data older than the version in the
+    # key; keep such pages no longer than the lag we tolerate anyway.
+    ttl = min(ttl, app.config['REPLICA_LAG_WINDOW'])
+  if next_show_at is not None:
+    ttl = min(ttl, (next_show_at - current_time()).total_seconds())
+  return int(ttl)
+
+
+def latest(model, *criteria):
+  # Newest updated_at of the matching rows, as a scalar subquery.
+  return db.select([db.func.max(model.updated_at)]).where(db.and_(True, *criteria)).as_scalar()
+
+
+def deletions(model):
+  # Statements that deleted rows from the model's table, as a scalar subquery.
+  return db.select([Deletions.c.count]).where(Deletions.c.table_name == model.__tablename__).as_scalar()
+
+
+def next_start(now, *criteria):
+  # Start of the next matching show, which moves as shows pass from upcoming
+  # to past; one probe of a start_time index.
+  return db.select([db.func.min(Show.start_time)]).\
+    where(db.and_(Show.start_time >= now, *criteria)).as_scalar()
+
+
+def validators(*state):
+  # An ETag and Last-Modified for a page built from `state`: the newest
+  # updated_at of everything the page reads, how many deletes its tables
+  # have seen, and the start of its next show, which moves as shows pass.
+  # Each is an index probe or a single-row read, fetched in one round-trip.
+  if not validators_enabled():
+    return None, None
+  return page_validators(db.session.query(*state).one())
+
+
+def validators_enabled():
+  # Pages carrying flashed messages or the SQL overlay get no validators.
+  return not (session.get('_flashes') or app.config['SQL_TRACE_OVERLAY'])
+
+
+def page_validators(values):
+  values = [validator_value(value) for value in values]
+  etag = hashlib.sha1(repr((request.full_path, request_locale()) + tuple(
+    value.isoformat() if isinstance(value, datetime) else value for value in values)).encode('utf-8')).hexdigest()
+  last_modified = max([value for value in values if isinstance(value, datetime)] or [None],
+                      key=lambda value: value or datetime.min.replace(tzinfo=timezone.utc))
+  return etag, last_modified
+
+
+def validator_value(value):
+  # Times as aware UTC, whichever driver read them: psycopg2 and asyncpg give
+  # the same instant different tzinfo classes, and updated_at is naive UTC.
+  if isinstance(value, datetime):
+    if value.tzinfo is None:
+      value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+  return value
+
+
+# What each cached page is built from, for validators(). Show inserts and
+# deletes also move the venue's and artist's updated_at, through the show
+# counters.
+
+def directory_state(now):
+  # The view's newest updated_at and venue count move with every refresh;
+  # a venue's upcoming-show count moves as its next show starts.
+  return (db.select([db.func.max(VenueDirectory.c.updated_at)]).as_scalar(),
+          db.select([db.func.sum(VenueDirectory.c.venue_count)]).as_scalar(),
+          next_start(now))
+
+
+def venue_state(venue_id, now):
+  return (latest(Venue, Venue.id == venue_id), latest(Show, Show.venue_id == venue_id),
+          deletions(Show), next_start(now, Show.venue_id == venue_id),
+          latest(Artist), deletions(Artist))
+
+
+def artists_state():
+  return latest(Artist), deletions(Artist)
+
+
+def artist_state(artist_id, now):
+  return (latest(Artist, Artist.id == artist_id), latest(Show, Show.artist_id == artist_id),
+          deletions(Show), next_start(now, Show.artist_id == artist_id),
+          latest(Venue), deletions(Venue))
+
+
+def shows_state(now):
+  return latest(Show), deletions(Show), next_start(now), latest(Venue), latest(Artist)
+
+
+def not_modified(etag):
+  if etag and etag in request.if_none_match:
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Language')
+    return response
+  return None
+
+
+def revalidated(response, etag, last_modified):
+  response = app.make_response(response)
+  # Dates are rendered in the negotiated locale.
+  response.vary.add('Accept-Language')
+  if etag:
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if last_modified:
+      response.last_modified = last_modified
+  return response
+
+
+def bump_versions(*entities):
+  for kind, entity_id in entities:
+    page_cache.incr('version:%s:%s' % (kind, entity_id))
+
+
+def venue_written(venue_id):
+  # Artist pages list venue names and images, hence the '*' version.
+  bump_versions(('venue', venue_id), ('venue', '*'))
+
+
+def artist_written(artist_id):
+  bump_versions(('artist', artist_id), ('artist', '*'))
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+# Queued by the write handlers once their transaction has committed.
+# Arguments are plain ids, so the same jobs run from the Redis queue. Only
+# work a reader can wait for is queued: the handlers bump page versions and
+# clear the suggest cache themselves, before they respond, so the page a
+# write redirects to is never the old one.
+
+@jobs.handler('show_created')
+def show_created(show_id, venue_id, artist_id):
+  directory_refresh.trigger()
+
+
+@jobs.handler('venue_changed')
+def venue_changed(venue_id):
+  directory_refresh.trigger()
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+# House style for US English; other locales use CLDR's own pattern for the
+# named width, so word order and day and month names follow the locale.
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=64)
+def datetime_pattern(format, locale):
+  # Parsing a Babel pattern and loading locale data cost far more than
+  # applying them, so both are done once per (format, locale).
+  locale = babel.Locale.parse(locale)
+  if format in DATETIME_FORMATS and str(locale) == 'en_US':
+    pattern = DATETIME_FORMATS[format]
+  elif format in locale.datetime_formats:
+    pattern = str(locale.datetime_formats[format]).\
+      replace('{0}', locale.time_formats[format].pattern).\
+      replace('{1}', locale.date_formats[format].pattern)
+  else:
+    pattern = format
+  return babel.dates.parse_pattern(pattern), locale
+
+
+def parse_datetime(value):
+  # Values from the database arrive as datetimes; strings are ISO in
+  # practice, so dateutil is only the fallback.
+  if isinstance(value, datetime):
+    return value
+  try:
+    return datetime.fromisoformat(value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+
+def render_datetime(value, format, locale, zone):
+  date = parse_datetime(value)
+  if date.tzinfo is None:
+    # As babel.dates.format_datetime does, read naive times as UTC.
+    date = date.replace(tzinfo=babel.dates.UTC)
+  # pytz zones convert from UTC correctly on either side of a DST change.
+  date = date.astimezone(venue_zone(zone))
+  pattern, locale = datetime_pattern(format, locale)
+  return pattern.apply(date, locale)
+
+
+if app.config['DATETIME_FORMAT_CACHE']:
+  # The same show times recur across tiles and pages; remember the output.
+  # Equal instants in different zones compare equal, so the zone is always
+  # part of the key.
+  render_datetime = lru_cache(maxsize=app.config['DATETIME_FORMAT_CACHE'])(render_datetime)
+
+
+def format_datetime(value, format='medium', locale=None, tz=None):
+  # The locale is resolved here, outside the memo, since it varies per request.
+  return render_datetime(value, format, locale or request_locale(), tz or 'UTC')
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Templates.
+#----------------------------------------------------------------------------#
+
+if not app.debug:
+  app.jinja_env.auto_reload = False
+if app.config['TEMPLATE_CACHE_DIR']:
+  os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+  app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+
+class TimedTemplate(app.jinja_env.template_class):
+  # Streamed pages (generate()) are not timed; their rendering is spread
+  # over the response.
+  def render(self, *args, **kwargs):
+    if not app.config['METRICS']:
+      return super(TimedTemplate, self).render(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+      return super(TimedTemplate, self).render(*args, **kwargs)
+    finally:
+      RENDER_TIME.observe(time.perf_counter() - start, self.name)
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+def warm_templates():
+  # Load every page, form and layout template into the environment's cache,
+  # compiling (and writing bytecode for) any not compiled yet.
+  names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+  for name in names:
+    app.jinja_env.get_template(name)
+  return names
+
+
+if app.config['TEMPLATE_PRELOAD']:
+  warm_templates()
+
+
+def stream_template(template_name, **context):
+  # Flask 1.1 has no stream_template; render through Jinja's generator so
+  # the first bytes go out before the last row is fetched.
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  return Response(stream_with_context(template.generate(context)))
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
+@query_budget(0)
 def index():
   return render_template('pages/home.html')
 
@@ -126,39 +1145,25 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+# Validators, the directory, and a recount of venues whose counters are stale.
+@query_budget(3)
 def venues():
 
-     venues_list = Venue.query.order_by(Venue.city, Venue.state).all()
-     data = []
-     citystate = ''
-     for venue in venues_list:
-         num_upcoming_shows = db.session.query(Venue).join(Show).\
-           filter (Venue.id == venue.id, Show.start_time > datetime.now()).count()
-         if citystate == venue.city + venue.state:
-             data[len(data) - 1]['venues'].append({
-                    'id': venue.id,
-                    'name': venue.name,
-                    'num_upcoming_shows': num_upcoming_shows
-             })
-         else:
-             data.append({
-                 'city': venue.city,
-                 'state': venue.state,
-                 'venues':[{'id': venue.id ,'name': venue.name, 'num_upcoming_shows': num_upcoming_shows }]
-             })
-             citystate = venue.city + venue.state
-     return render_template('pages/venues.html', areas=data)
+     etag, last_modified = validators(*directory_state(current_time()))
+     response = not_modified(etag)
+     if response:
+         return response
+
+     data = venue_directory()
+     return revalidated(render_template('pages/venues.html', areas=data), etag, last_modified)
 
 
 @app.route('/venues/search', methods=['POST'])
+@query_budget(1)
 def search_venues():
    response = {}
    try:
-       venues_list = Venue.query.with_entities(Venue.id, Venue.name).\
-            filter(Venue.name.ilike('%' + request.form.get('search_term', '') + '%')).all()
-
-       response['data'] = venues_list
-       response['count'] = len(venues_list)
+       response = search(Venue, request.form.get('search_term', ''))
 
    except Exception as e:
        print(e)
@@ -168,40 +1173,30 @@ def search_venues():
        return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
+# Validators, the venue, a recount when its counters are stale, and a page
+# of each section.
+@query_budget(5)
 def show_venue(venue_id):
 
-  venue = Venue.query.get(venue_id)
-  setattr(venue, 'past_shows', [])
-  setattr(venue, 'upcoming_shows', [])
-  current_time = datetime.now()
-  past_shows_count = 0
-  upcoming_shows_count = 0
- 
-  shows = db.session.query(Artist, Show.start_time).join(Show).filter(Show.venue_id == venue_id)
-  for artist, start_time in shows:
-
-      if start_time  <  current_time:
-       
-          venue.past_shows.append({
-            'artist_id': artist.id,
-            'artist_name': artist.name,
-            'artist_image_link': artist.image_link,
-            'start_time': str(start_time)
-          })
-          past_shows_count += 1
-
-      else:
-          venue.upcoming_shows.append({
-            'artist_id': artist.id,
-            'artist_name': artist.name,
-            'artist_image_link': artist.image_link,
-            'start_time': str(start_time)
-          })
-          upcoming_shows_count += 1
-
-      setattr(venue, 'past_shows_count', past_shows_count)
-      setattr(venue, 'upcoming_shows_count', upcoming_shows_count)
-  return render_template('pages/show_venue.html', venue=venue)
+  etag, last_modified = validators(*venue_state(venue_id, current_time()))
+  response = not_modified(etag)
+  if response:
+    return response
+
+  key = page_cache_key('venue', venue_id, 'artist', etag)
+  page = page_cache.get(key) if key else None
+  if page is None:
+    venue = Venue.query.get(venue_id)
+    if venue is None:
+      abort(404)
+    sections = show_sections(venue, Artist, (
+        Show.artist_id, Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link')))
+    page = render_template('pages/show_venue.html', venue=venue, **sections)
+    ttl = page_ttl(sections['next_show_at'])
+    if key and ttl > 0:
+      page_cache.set(key, page, ttl)
+  return revalidated(page, etag, last_modified)
 
 
 #  ----------------------------------------------------------------
@@ -218,11 +1213,15 @@ def create_venue_form():
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   error = False
+  if request.form.get('timezone', 'UTC') not in pytz.all_timezones_set:
+    flash('Oh, an error occurred. Venue ' + request.form['name'] + ' could not be listed: unknown timezone.')
+    return render_template('pages/home.html')
   try:
     name = request.form['name']
     city = request.form['city']
     state = request.form['state']
     address = request.form['address']
+    venue_timezone = request.form.get('timezone', 'UTC')
     phone = request.form['phone']
 
     genres = request.form.getlist('genres')
@@ -232,15 +1231,18 @@ def create_venue_submission():
     seeking_talent = True if 'seeking_talent' in request.form else False
     seeking_description = request.form['seeking_description']
 
-    venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website=website, seeking_talent=seeking_talent, seeking_description=seeking_description)
+    venue = Venue(name=name, city=city, state=state, address=address, timezone=venue_timezone, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website=website, seeking_talent=seeking_talent, seeking_description=seeking_description)
     db.session.add(venue)
+    db.session.flush()
+    venue_id = venue.id
     db.session.commit()
+    suggest_cache.clear()
+    venue_written(venue_id)
+    jobs.enqueue('venue_changed', venue_id, key='venue_created:%d' % venue_id)
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
-  finally:
-    db.session.close()
   if error:
     flash('Oh, an error occurred. Venue ' + request.form['name']+ ' could not be listed.')
   if not error:
@@ -259,13 +1261,14 @@ def delete_venues(venue_id):
 
         db.session.delete(venue)
         db.session.commit()
+        suggest_cache.clear()
+        venue_written(int(venue_id))
+        jobs.enqueue('venue_changed', int(venue_id))
 
         flash('Venue ' + venue_name + ' was deleted')
    except:
         flash('Oh!, an error occured and Venue ' + venue_name + ' was not deleted')
         db.session.rollback()
-   finally:
-        db.session.close()
 
    return redirect(url_for('index'))
 
@@ -280,13 +1283,13 @@ def delete_artist(artist_id):
 
            db.session.delete(artist)
            db.session.commit()
+           suggest_cache.clear()
+           artist_written(int(artist_id))
 
            flash('Artist ' + artist_name  + ' was deleted')
       except:
            flash('Oh!, an error occured and Artist ' + artist_name  + ' was not deleted')
            db.session.rollback()
-      finally:
-           db.session.close()
 
       return redirect(url_for('index'))
 
@@ -295,70 +1298,82 @@ def delete_artist(artist_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@query_budget(2)
 def artists():
-# TODO: replace with real data returned from querying the database
+  etag, last_modified = validators(*artists_state())
+  response = not_modified(etag)
+  if response:
+    return response
   data = Artist.query.with_entities(Artist.id, Artist.name).all()
-  return render_template('pages/artists.html', artists=data)
+  return revalidated(render_template('pages/artists.html', artists=data), etag, last_modified)
 
 
 @app.route('/artists/search', methods=['POST'])
+@query_budget(1)
 def search_artists():
   response = {}
   try:
-      artist_list = Artist.query.with_entities(Artist.id, Artist.name).\
-          filter(Artist.name.ilike('%' + request.form.get('search_term', '') + '%')).all()
-
-      response['data'] = artist_list
-      response['count'] = len(artist_list)
+      response = search(Artist, request.form.get('search_term', ''))
 
   except Exception as e:
       print(e)
-      flask('An error occurred for the search term' + request.form.get('search_term', ''))
+      flash('An error occurred for the search term' + request.form.get('search_term', ''))
 
   finally:
       return render_template ('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 
+@app.route('/search/suggest')
+@query_budget(1)
+def search_suggest():
+  term = ' '.join(SEARCH_WORD.findall(request.args.get('q', '').lower()))
+  limit = max(1, min(request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int),
+                     app.config['SUGGEST_LIMIT_MAX']))
+  key = (term, limit)
+  results = suggest_cache.get(key)
+  if results is None:
+    results = suggest(term, limit)
+    suggest_cache.set(key, results)
+  return jsonify({'term': term, 'results': results})
+
+
+@app.route('/search', methods=['GET', 'POST'])
+@query_budget(2)
+def search_all():
+  search_term = request.values.get('search_term', '')
+  return render_template('pages/search.html', search_term=search_term,
+                         venues=search(Venue, search_term), artists=search(Artist, search_term))
+
+
 @app.route('/artists/<int:artist_id>')
+@query_budget(5)
 def show_artist(artist_id):
-    current_time = datetime.now()
-    artist = Artist.query.get(artist_id)
-    setattr(artist, 'past_shows', [])
-    setattr(artist, 'upcoming_shows', [])
-    past_shows_count = 0
-    upcoming_shows_count = 0
- 
-    shows = db.session.query(Venue, Show.start_time).join(Show).filter(Show.artist_id == artist_id)
- 
-    for venue, start_time in shows:
-
-        if start_time < current_time:
-            artist.past_shows.append({
-               'venue_id': venue.id,
-               'venue_name': venue.name,
-               'venue_image_link': venue.image_link,
-               'start_time' : str(start_time)
-            })
-            past_shows_count += 1
-
-        else:
-            artist.upcoming_shows.append({
-               'venue_id': venue.id,
-               'venue_name': venue.name,
-               'venue_image_link': venue.image_link,
-               'start_time' : str(start_time)
-            })
-            upcoming_shows_count += 1
-
-    setattr(artist, 'past_shows_count', past_shows_count)
-    setattr(artist, 'upcoming_shows_count', upcoming_shows_count)
-
-    return render_template('pages/show_artist.html', artist=artist)
+    etag, last_modified = validators(*artist_state(artist_id, current_time()))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    key = page_cache_key('artist', artist_id, 'venue', etag)
+    page = page_cache.get(key) if key else None
+    if page is None:
+        artist = Artist.query.get(artist_id)
+        if artist is None:
+            abort(404)
+        sections = show_sections(artist, Venue, (
+            Show.venue_id, Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link'), Venue.timezone.label('venue_timezone')))
+        page = render_template('pages/show_artist.html', artist=artist, **sections)
+        ttl = page_ttl(sections['next_show_at'])
+        if key and ttl > 0:
+            page_cache.set(key, page, ttl)
+
+    return revalidated(page, etag, last_modified)
 
 #  ----------------------------------------------------------------
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_artist(artist_id):
   form = ArtistForm()
   artist = Artist.query.get(artist_id)
@@ -397,12 +1412,12 @@ def edit_artist_submission(artist_id):
     artist.seeking_description = request.form['seeking_description']
 
     db.session.commit()
+    suggest_cache.clear()
+    artist_written(artist_id)
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
-  finally:
-    db.session.close()
   if error:
     flash('Oh!, an error occurred. Artist could not be changed.')
   if not error:
@@ -410,6 +1425,7 @@ def edit_artist_submission(artist_id):
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_venue(venue_id):
   form = VenueForm()
   venue = Venue.query.get(venue_id)
@@ -420,6 +1436,7 @@ def edit_venue(venue_id):
     form.state.data = venue.state
     form.phone.data = venue.phone
     form.address.data = venue.address
+    form.timezone.data = venue.timezone
     form.genres.data = venue.genres
     form.facebook_link.data = venue.facebook_link
     form.image_link.data = venue.image_link
@@ -434,12 +1451,16 @@ def edit_venue_submission(venue_id):
 
   error = False
   venue = Venue.query.get(venue_id)
+  if request.form.get('timezone', venue.timezone) not in pytz.all_timezones_set:
+    flash('Oh!, an error occurred. Venue could not be changed: unknown timezone.')
+    return redirect(url_for('show_venue', venue_id=venue_id))
 
   try:
     venue.name = request.form['name']
     venue.city = request.form['city']
     venue.state = request.form['state']
     venue.address = request.form['address']
+    venue.timezone = request.form.get('timezone', venue.timezone)
     venue.phone = request.form['phone']
     venue.genres = request.form.getlist('genres')
     venue.image_link = request.form['image_link']
@@ -449,12 +1470,13 @@ def edit_venue_submission(venue_id):
     venue.seeking_description = request.form['seeking_description']
 
     db.session.commit()
+    suggest_cache.clear()
+    venue_written(venue_id)
+    jobs.enqueue('venue_changed', venue_id)
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
-  finally:
-    db.session.close()
   if error:
     flash(f'Oh!, an error occurred. Venue could not be changed.')
   if not error:
@@ -491,12 +1513,11 @@ def create_artist_submission():
     artist = Artist(name=name, city=city, state=state, phone=phone, genres=genres, facebook_link=facebook_link, image_link=image_link, website=website, seeking_venue=seeking_venue, seeking_description=seeking_description)
     db.session.add(artist)
     db.session.commit()
+    suggest_cache.clear()
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
-  finally:
-    db.session.close()
   if error:
     flash('Oh!, an error occurred. Artist ' + request.form['name']+ ' could not be listed.')
   if not error:
@@ -510,21 +1531,22 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@query_budget(2)
 def shows():
-    data = []
-    shows = db.session.query(Show, Venue.name, Artist).join(Venue, Artist)
-    for show, venue_name, artist in shows:
-        data.append({
-           'start_time': str(show.start_time),
-            'venue_id': show.venue_id,
-            'venue_name': venue_name,
-             'artist_id': show.artist_id,
-             'artist_name': artist.name,
-             'artist_image_link': artist.image_link
-       })
-        print('data: ', data[0]['start_time'])
-
-    return render_template('pages/shows.html', shows=data)
+    now = current_time()
+    etag, last_modified = validators(*shows_state(now))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    upcoming = request.args.get('when', 'upcoming') != 'past'
+    limit = page_limit('SHOWS_LIST_PAGE_SIZE', 'SHOWS_LIST_PAGE_MAX')
+    page = ShowStream(keyset(shows_query(), now, upcoming, request.args.get('cursor')), limit)
+
+    context = {'shows': page, 'when': 'upcoming' if upcoming else 'past'}
+    if limit > app.config['SHOWS_STREAM_THRESHOLD']:
+        return revalidated(stream_template('pages/shows.html', **context), etag, last_modified)
+    return revalidated(render_template('pages/shows.html', **context), etag, last_modified)
 
 @app.route('/shows/create')
 def create_shows():
@@ -532,26 +1554,54 @@ def create_shows():
    return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
+# The venue, the insert, and count_new_show's update of each counter.
+@query_budget(4)
 def create_show_submission():
    form = ShowForm()
    error = False
    try:
         if form.validate_on_submit():
+             # The form's time is wall-clock time at the venue.
+             venue = Venue.query.get(form.venue_id.data)
+             start_time = localize(form.start_time.data, venue.timezone if venue else None)
+             end_time = start_time + timedelta(
+                 minutes=form.duration.data or app.config['SHOW_DEFAULT_MINUTES'])
              show = Show(
-                 start_time=form.start_time.data,
+                 start_time=start_time,
+                 end_time=end_time,
                  venue_id=form.venue_id.data,
                  artist_id=form.artist_id.data
              )
              db.session.add(show)
+             db.session.flush()
+             show_id = show.id
              db.session.commit()
+             bump_versions(('venue', int(form.venue_id.data)), ('artist', int(form.artist_id.data)))
+             # Keyed on the new show, so its follow-up work runs once.
+             jobs.enqueue('show_created', show_id, int(form.venue_id.data), int(form.artist_id.data),
+                          key='show_created:%d' % show_id)
+   except IntegrityError as e:
+          db.session.rollback()
+          kind, existing = booking_conflict(e, form.venue_id.data, form.artist_id.data,
+                                            start_time, end_time)
+          if kind is None:
+               print('create_show_submission: ', e)
+               error = True
+          else:
+               # The overlap check is the database's; say what it collided with.
+               if existing is None:
+                    flash('Oh!, the %s is already booked at that time. Show could not be listed.' % kind)
+               else:
+                    flash('Oh!, %s is already booked from %s to %s. Show could not be listed.' % (
+                        existing.venue_name if kind == 'venue' else existing.artist_name,
+                        format_datetime(existing.start_time, 'full', tz=existing.venue_timezone),
+                        format_datetime(existing.end_time, 'full', tz=existing.venue_timezone)))
+               return render_template('forms/new_show.html', form=form), 409
    except Exception as e:
           print('create_show_submission: ', e)
           db.session.rollback()
           print(sys.exc_info())
           error = True
-   finally:
-         
-          db.session.close()
    if error:
  
       flash('Oh!, an error occurred. Show could not be listed.')
@@ -561,6 +1611,613 @@ def create_show_submission():
          return render_template('pages/home.html')
 
 
+#  ----------------------------------------------------------------
+#  Export
+#  ----------------------------------------------------------------
+
+EXPORT_COLUMNS = {
+  'venues': (Venue, ['id', 'name', 'city', 'state', 'address', 'timezone', 'phone', 'genres',
+                     'image_link', 'facebook_link', 'website', 'seeking_talent', 'seeking_description',
+                     'updated_at']),
+  'artists': (Artist, ['id', 'name', 'city', 'state', 'phone', 'genres', 'image_link',
+                       'facebook_link', 'website', 'seeking_venue', 'seeking_description', 'updated_at']),
+  'shows': (Show, ['id', 'venue_id', 'artist_id', 'start_time', 'end_time', 'updated_at']),
+}
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def export_value(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+
+def export_csv(rows, columns):
+  # Same shape `flask import` reads back: genres joined with semicolons.
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(columns)
+  for n, row in enumerate(rows, 1):
+    writer.writerow([';'.join(value) if isinstance(value, list) else export_value(value)
+                     for value in row])
+    if n % app.config['EXPORT_FETCH_SIZE'] == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  yield buffer.getvalue()
+
+
+def export_ndjson(rows, columns):
+  lines = []
+  for row in rows:
+    lines.append(json.dumps(dict(zip(columns, map(export_value, row)))))
+    if len(lines) == app.config['EXPORT_FETCH_SIZE']:
+      yield '\n'.join(lines) + '\n'
+      lines = []
+  if lines:
+    yield '\n'.join(lines) + '\n'
+
+
+def gzipped(chunks):
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    data = compressor.compress(chunk.encode('utf-8'))
+    if data:
+      yield data
+  yield compressor.flush()
+
+
+@app.route('/export/<kind>.<format>')
+def export(kind, format):
+  # Streams a whole table from a server-side cursor, so memory stays flat
+  # however large it is. `since` (ISO time, UTC unless it has an offset)
+  # limits it to rows changed at or after that time; deletions are not
+  # reported.
+  if kind not in EXPORT_COLUMNS or format not in EXPORT_MIMETYPES:
+    abort(404)
+  model, columns = EXPORT_COLUMNS[kind]
+  query = db.session.query(*[getattr(model, column) for column in columns]).\
+    order_by(model.updated_at, model.id)
+  if request.args.get('since'):
+    try:
+      since = dateutil.parser.parse(request.args['since'])
+    except (ValueError, OverflowError):
+      abort(400)
+    # updated_at is naive UTC; an aware `since` compared with it directly
+    # would be read in the session's TimeZone.
+    if since.tzinfo is not None:
+      since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    query = query.filter(model.updated_at >= since)
+  rows = query.yield_per(app.config['EXPORT_FETCH_SIZE'])
+
+  body = export_csv(rows, columns) if format == 'csv' else export_ndjson(rows, columns)
+  headers = {'Vary': 'Accept-Encoding'}
+  if 'gzip' in request.accept_encodings:
+    body = gzipped(body)
+    headers['Content-Encoding'] = 'gzip'
+  return Response(stream_with_context(body), mimetype=EXPORT_MIMETYPES[format], headers=headers)
+
+
+#  ----------------------------------------------------------------
+#  JSON API
+#  ----------------------------------------------------------------
+
+api = Blueprint('api', __name__)
+
+API_KINDS = {'venues': Show.venue_id, 'artists': Show.artist_id}
+
+
+def api_json(payload, status=200):
+  # orjson, when installed, is several times faster than json and handles
+  # datetimes itself.
+  if orjson is not None:
+    body = orjson.dumps(payload)
+  else:
+    body = json.dumps(payload, default=export_value)
+  return Response(body, status=status, mimetype='application/json')
+
+
+def api_error(status, message):
+  abort(api_json({'error': message}, status))
+
+
+def api_fields(columns, required=('id',)):
+  # `fields=a,b` selects only those columns; `required` ones are always read.
+  fields = [field for field in request.args.get('fields', '').split(',') if field] or columns
+  unknown = [field for field in fields if field not in columns]
+  if unknown:
+    api_error(400, 'unknown fields: ' + ', '.join(unknown))
+  selected = list(required) + [field for field in fields if field not in required]
+  return fields, selected
+
+
+def api_rows(rows, fields):
+  return [dict((field, getattr(row, field)) for field in fields) for row in rows]
+
+
+def api_includes():
+  includes = [name for name in request.args.get('include', '').split(',') if name]
+  if set(includes) - {'shows'}:
+    api_error(400, 'only include=shows is supported')
+  return includes
+
+
+def api_shows(kind, ids):
+  # Upcoming shows for a page of venues or artists in one IN query, at most
+  # API_INCLUDE_LIMIT per entity, instead of one lazy load per object.
+  if not ids:
+    return {}
+  column = API_KINDS[kind]
+  number = db.func.row_number().over(partition_by=column, order_by=(Show.start_time, Show.id)).label('n')
+  ranked = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, number).\
+    filter(column.in_(ids), Show.start_time >= current_time()).subquery()
+  rows = db.session.query(ranked.c.id, ranked.c.venue_id, ranked.c.artist_id, ranked.c.start_time).\
+    filter(ranked.c.n <= app.config['API_INCLUDE_LIMIT']).order_by(ranked.c.start_time, ranked.c.id)
+  shows = dict((entity_id, []) for entity_id in ids)
+  key = 'venue_id' if kind == 'venues' else 'artist_id'
+  for row in rows:
+    shows[getattr(row, key)].append(
+      {'id': row.id, 'venue_id': row.venue_id, 'artist_id': row.artist_id, 'start_time': row.start_time})
+  return shows
+
+
+@api.route('/venues', defaults={'kind': 'venues'})
+@api.route('/artists', defaults={'kind': 'artists'})
+@query_budget(2)
+def entities(kind):
+  model, columns = EXPORT_COLUMNS[kind]
+  fields, selected = api_fields(columns)
+  includes = api_includes()
+  limit = page_limit('API_PAGE_SIZE', 'API_PAGE_MAX')
+  query = db.session.query(*[getattr(model, column) for column in selected]).order_by(model.id)
+  cursor = request.args.get('cursor')
+  if cursor:
+    if not cursor.isdigit():
+      api_error(400, 'bad cursor')
+    query = query.filter(model.id > int(cursor))
+  rows = query.limit(limit + 1).all()
+  next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+  data = api_rows(rows[:limit], fields)
+  if 'shows' in includes:
+    shows = api_shows(kind, [row.id for row in rows[:limit]])
+    for row, item in zip(rows, data):
+      item['shows'] = shows[row.id]
+  return api_json({'data': data, 'next_cursor': next_cursor})
+
+
+@api.route('/venues/<int:entity_id>', defaults={'kind': 'venues'})
+@api.route('/artists/<int:entity_id>', defaults={'kind': 'artists'})
+@query_budget(2)
+def entity(kind, entity_id):
+  model, columns = EXPORT_COLUMNS[kind]
+  fields, selected = api_fields(columns)
+  includes = api_includes()
+  row = db.session.query(*[getattr(model, column) for column in selected]).\
+    filter(model.id == entity_id).first()
+  if row is None:
+    api_error(404, 'not found')
+  data = api_rows([row], fields)[0]
+  if 'shows' in includes:
+    data['shows'] = api_shows(kind, [entity_id])[entity_id]
+  return api_json({'data': data})
+
+
+@api.route('/shows')
+@query_budget(1)
+def show_list():
+  # Upcoming shows soonest first, or past ones latest first with when=past.
+  columns = EXPORT_COLUMNS['shows'][1]
+  fields, selected = api_fields(columns, required=('id', 'start_time'))
+  limit = page_limit('API_PAGE_SIZE', 'API_PAGE_MAX')
+  upcoming = request.args.get('when', 'upcoming') != 'past'
+  query = db.session.query(*[getattr(Show, column) for column in selected])
+  rows = keyset(query, current_time(), upcoming, request.args.get('cursor')).limit(limit + 1).all()
+  next_cursor = encode_cursor(rows[limit - 1].start_time, rows[limit - 1].id) if len(rows) > limit else None
+  return api_json({'data': api_rows(rows[:limit], fields), 'next_cursor': next_cursor})
+
+
+@api.route('/shows/<int:show_id>')
+@query_budget(1)
+def show_detail(show_id):
+  columns = EXPORT_COLUMNS['shows'][1]
+  fields, selected = api_fields(columns)
+  row = db.session.query(*[getattr(Show, column) for column in selected]).\
+    filter(Show.id == show_id).first()
+  if row is None:
+    api_error(404, 'not found')
+  return api_json({'data': api_rows([row], fields)[0]})
+
+
+app.register_blueprint(api, url_prefix='/api/v1')
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+  if not app.config['METRICS']:
+    abort(404)
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/status/pool')
+def pool_status():
+  status = pool_stats.snapshot(db.engine.pool)
+  status['replicas'] = len(replicas.engines)
+  status['healthy_replicas'] = len(replicas.healthy())
+  return jsonify(status)
+
+
+@app.route('/status/jobs')
+def jobs_status():
+  # Counts are this worker's; depth, delayed and dead_stored are shared when
+  # the queue is on Redis.
+  status = jobs.stats()
+  status['recent_dead'] = [{
+    'name': entry['name'], 'args': entry['args'], 'attempts': entry['attempts'],
+    'failed_at': entry['failed_at'], 'error': entry['error'].strip().splitlines()[-1],
+  } for entry in jobs.dead_jobs()[-20:]]
+  return jsonify(status)
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+ENTITY_COLUMNS = ['name', 'city', 'state', 'phone', 'image_link', 'genres',
+                  'facebook_link', 'website', 'seeking_description']
+TRUE_VALUES = (True, 'yes', 'true', 'y', '1')
+
+
+def import_formdata(row, flag=None):
+  # Shape a CSV or NDJSON row like a form post: empty cells dropped, genres
+  # as a list (comma or semicolon separated in CSV), the seeking flag as the
+  # Yes/No choice the forms offer.
+  data = MultiDict()
+  for key, value in row.items():
+    if key is None or value is None or value == '':
+      continue
+    if key == 'genres':
+      if isinstance(value, str):
+        value = [genre.strip() for genre in re.split('[;,]', value) if genre.strip()]
+      data.setlist(key, value)
+    elif key == flag:
+      data[key] = 'Yes' if str(value).lower() in TRUE_VALUES or value is True else 'No'
+    else:
+      data[key] = str(value)
+  return data
+
+
+def import_errors(form, columns):
+  # Only rules on fields the model stores apply; ArtistForm also has address.
+  form.validate()
+  return '; '.join('%s: %s' % (field, ', '.join(errors))
+                   for field, errors in sorted(form.errors.items()) if field in columns)
+
+
+def import_id(data):
+  return int(data['id']) if 'id' in data else None
+
+
+def prepare_entities(form_class, columns, flag):
+  def prepare(chunk):
+    records, rejected = [], []
+    for line, row in chunk:
+      data = import_formdata(row, flag)
+      form = form_class(formdata=data, meta={'csrf': False})
+      errors = import_errors(form, columns + [flag])
+      try:
+        entity_id = import_id(data)
+      except ValueError:
+        errors = errors or 'id: not a number'
+      if errors:
+        rejected.append((line, errors))
+        continue
+      record = dict((column, getattr(form, column).data or None) for column in columns)
+      record[flag] = form[flag].data == 'Yes'
+      record['id'] = entity_id
+      record['line'] = line
+      records.append(record)
+    return records, rejected
+  return prepare
+
+
+def resolve_ids(model, ids, names):
+  # Existing ids and unambiguous name -> id pairs, one query each per chunk.
+  known = set(row.id for row in db.session.query(model.id).filter(model.id.in_(ids))) if ids else set()
+  by_name = {}
+  if names:
+    for row in db.session.query(model.name, model.id).filter(model.name.in_(names)):
+      by_name[row.name] = None if row.name in by_name else row.id
+  return known, by_name
+
+
+def prepare_shows(chunk):
+  rows, rejected = [], []
+  for line, row in chunk:
+    data = import_formdata(row)
+    form = ShowForm(formdata=data, meta={'csrf': False})
+    # Without a start_time cell the field would fall back to its default.
+    errors = import_errors(form, ['start_time', 'duration']) if 'start_time' in data else 'start_time: This field is required.'
+    if errors:
+      rejected.append((line, errors))
+      continue
+    rows.append((line, data, form.start_time.data, form.duration.data))
+
+  refs = {}
+  for model, kind in ((Venue, 'venue'), (Artist, 'artist')):
+    ids = set(int(data[kind + '_id']) for _, data, _, _ in rows
+              if data.get(kind + '_id', '').isdigit())
+    names = set(data[kind + '_name'] for _, data, _, _ in rows if kind + '_name' in data)
+    refs[kind] = resolve_ids(model, ids, names)
+
+  records, venues = [], set()
+  for line, data, start_time, duration in rows:
+    record, errors = {'line': line, 'start_time': start_time,
+                      'duration': duration or app.config['SHOW_DEFAULT_MINUTES']}, []
+    for kind in ('venue', 'artist'):
+      known, by_name = refs[kind]
+      value = data.get(kind + '_id')
+      if value:
+        entity_id = int(value) if value.isdigit() and int(value) in known else None
+      else:
+        entity_id = by_name.get(data.get(kind + '_name'))
+      if entity_id is None:
+        errors.append('%s: no single %s matches %s' % (kind, kind, value or data.get(kind + '_name')))
+      record[kind + '_id'] = entity_id
+    try:
+      record['id'] = import_id(data)
+    except ValueError:
+      errors.append('id: not a number')
+    if errors:
+      rejected.append((line, '; '.join(errors)))
+    else:
+      records.append(record)
+      venues.add(record['venue_id'])
+
+  # Times in the file are wall-clock times at each venue.
+  zones = dict(db.session.query(Venue.id, Venue.timezone).filter(Venue.id.in_(venues))) if venues else {}
+  for record in records:
+    record['start_time'] = localize(record['start_time'], zones.get(record['venue_id']))
+    record['end_time'] = record['start_time'] + timedelta(minutes=record.pop('duration'))
+  return records, rejected
+
+
+def insert_rows(model, records, refusal, key=None):
+  # upsert() under a savepoint. When a row is refused (`refusal(error)` names
+  # why), the chunk is loaded again row by row, so that only those rows are
+  # rejected; any other IntegrityError propagates.
+  lines = [record.pop('line') for record in records]
+  try:
+    with db.session.begin_nested():
+      upsert(model, [dict(record) for record in records], key)
+    return records, []
+  except IntegrityError as error:
+    if refusal(error) is None:
+      raise
+  loaded, rejected = [], []
+  for line, record in zip(lines, records):
+    try:
+      with db.session.begin_nested():
+        upsert(model, [dict(record)], key)
+      loaded.append(record)
+    except IntegrityError as error:
+      message = refusal(error)
+      if message is None:
+        raise
+      rejected.append((line, message))
+  return loaded, rejected
+
+
+def booking_refusal(error):
+  # Rows overlapping a booking, in the table or earlier in the chunk.
+  name = booking_constraint(error)
+  return name and '%s: already booked at that time' % BOOKING_CONSTRAINTS[name][0]
+
+
+# Unique constraints an imported row can run into, by the column they cover.
+UNIQUE_CONSTRAINTS = {'Venue_phone_key': 'phone'}
+
+
+def unique_refusal(error):
+  # Rows whose id is updated to a value another row already holds.
+  column = UNIQUE_CONSTRAINTS.get(getattr(getattr(error.orig, 'diag', None), 'constraint_name', None))
+  return column and '%s: already used by another row' % column
+
+
+def insert_shows(records):
+  return insert_rows(Show, records, booking_refusal)
+
+
+def upsert(model, records, key=None):
+  # Multi-row INSERT; rows carrying an id (or `key`) update the row they
+  # match instead. Duplicates within one statement keep the last row.
+  now = datetime.utcnow()
+  for record in records:
+    record['updated_at'] = now
+  groups = {}
+  for record in records:
+    conflict = 'id' if record['id'] is not None else key if record.get(key) else None
+    if conflict is None:
+      groups.setdefault(None, []).append(record)
+    else:
+      groups.setdefault(conflict, {})[record[conflict]] = record
+  for conflict, group in groups.items():
+    rows = list(group.values()) if conflict else group
+    if conflict != 'id':
+      for row in rows:
+        del row['id']
+    statement = postgresql.insert(model.__table__).values(rows)
+    if conflict:
+      statement = statement.on_conflict_do_update(
+        index_elements=[conflict],
+        set_=dict((column, statement.excluded[column]) for column in rows[0] if column != conflict))
+    db.session.execute(statement)
+
+
+def reset_sequence(model):
+  # Rows imported with explicit ids do not advance the id sequence.
+  db.session.execute(
+    "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), GREATEST((SELECT MAX(id) FROM \"%s\"), 1))"
+    % (model.__tablename__, model.__tablename__))
+  db.session.commit()
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'ndjson']), help='Default: from the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an earlier run.')
+def import_command(kind, path, format, chunk_size, restart):
+  """Bulk-load venues, artists or shows from a CSV or NDJSON file.
+
+  Rows are validated with the same rules as the web forms; rejected rows are
+  written to PATH.errors.ndjson. An interrupted import resumes where it
+  stopped when run again.
+  """
+  if kind == 'venues':
+    model, prepare = Venue, prepare_entities(VenueForm, ENTITY_COLUMNS + ['address', 'timezone'], 'seeking_talent')
+  elif kind == 'artists':
+    model, prepare = Artist, prepare_entities(ArtistForm, ENTITY_COLUMNS, 'seeking_venue')
+  else:
+    model, prepare = Show, prepare_shows
+
+  def load(records):
+    rejected = []
+    if model is Show:
+      records, rejected = insert_shows(records)
+    else:
+      records, rejected = insert_rows(model, records, unique_refusal, key='phone' if model is Venue else None)
+    if model is Show:
+      # Core inserts skip the Show events, so recount the chunk's venues and
+      # artists in the same transaction.
+      now = current_time()
+      for owner in (Venue, Artist):
+        column = show_column(owner).key
+        db.session.execute(recount_statement(owner, now, ids=set(record[column] for record in records)))
+    db.session.commit()
+    if model is Show:
+      bump_versions(*[(kind, record[kind + '_id']) for record in records for kind in ('venue', 'artist')])
+    return rejected
+
+  report = run_import(path, prepare, load, format, chunk_size, restart, echo=click.echo)
+  reset_sequence(model)
+  if model is not Show:
+    suggest_cache.clear()
+    bump_versions(('venue' if model is Venue else 'artist', '*'))
+  if model is not Artist:
+    refresh_directory()
+  click.echo('Done: ' + report.summary())
+  if report.failed:
+    click.echo('Rejected rows are listed in %s' % report.errors_path)
+
+
+@app.cli.command('precompile-templates')
+def precompile_templates_command():
+  """Compile every template into the bytecode cache."""
+  start = time.perf_counter()
+  names = warm_templates()
+  click.echo('Compiled %d templates into %s in %.0f ms' % (
+    len(names), app.config['TEMPLATE_CACHE_DIR'], (time.perf_counter() - start) * 1000))
+
+
+@app.cli.command('roll-shows')
+def roll_shows_command():
+  """Move shows that have started from upcoming to past in the counters.
+
+  Run it every minute or so from cron; pages never show stale counts either
+  way, but they count shows on the fly until it has run.
+  """
+  roll_shows()
+  db.session.commit()
+  refresh_directory()
+
+
+def require_job_server():
+  # Without JOB_QUEUE_URL, jobs and dead jobs live inside each web worker;
+  # see /status/jobs.
+  if not hasattr(jobs, 'work'):
+    raise click.UsageError('JOB_QUEUE_URL is not set; jobs run inside the web workers.')
+
+
+@app.cli.command('work-jobs')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+def work_jobs_command(burst):
+  """Run queued jobs from JOB_QUEUE_URL until stopped."""
+  require_job_server()
+  jobs.work(burst=burst)
+  directory_refresh.flush()
+
+
+@app.cli.command('dead-jobs')
+@click.option('--retry', is_flag=True, help='Queue them again.')
+def dead_jobs_command(retry):
+  """List the jobs that failed every retry."""
+  require_job_server()
+  for entry in jobs.dead_jobs():
+    click.echo('%s%r after %d attempts at %s' % (
+      entry['name'], tuple(entry['args']), entry['attempts'],
+      datetime.utcfromtimestamp(entry['failed_at']).isoformat()))
+    click.echo('  ' + entry['error'].strip().splitlines()[-1])
+  if retry:
+    click.echo('Queued %d again.' % jobs.retry_dead())
+
+
+@app.cli.command('check-query-budgets')
+def check_query_budgets_command():
+  """Request every GET route with a @query_budget and check its statements.
+
+  Uses the first venue, artist and show in the database for route ids, so
+  run it against seeded data (see benchmarks/common.py).
+  """
+  app.config.update(TESTING=True, SQL_TRACE=True, SQL_TRACE_OVERLAY=False, SQL_QUERY_BUDGETS='raise')
+  samples = {
+    'venue_id': db.session.query(db.func.min(Venue.id)).scalar(),
+    'artist_id': db.session.query(db.func.min(Artist.id)).scalar(),
+    'show_id': db.session.query(db.func.min(Show.id)).scalar(),
+  }
+  db.session.remove()
+  client = app.test_client()
+  failed = 0
+  for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+    budget = getattr(app.view_functions[rule.endpoint], 'query_budget', None)
+    if budget is None or 'GET' not in rule.methods:
+      continue
+    def sample(match):
+      name = match.group(1)
+      if name == 'entity_id':
+        name = 'venue_id' if rule.defaults['kind'] == 'venues' else 'artist_id'
+      return str(samples[name])
+    path = re.sub(r'<(?:\w+:)?(\w+)>', sample, rule.rule)
+    try:
+      response = client.get(path)
+      click.echo('ok    %-40s %s (budget %d)' % (path, response.headers.get('Server-Timing'), budget))
+    except QueryBudgetExceeded as error:
+      failed += 1
+      click.echo('FAIL  %-40s %s' % (path, error))
+  if failed:
+    sys.exit(1)
+
+
+@app.cli.command('reconcile-show-counts')
+@click.option('--fix', is_flag=True, help='Recount every venue and artist afterwards.')
+def reconcile_show_counts_command(fix):
+  """Check the stored show counters against a full recount."""
+  now = current_time()
+  mismatched = 0
+  for model in (Venue, Artist):
+    ids = [row.id for row in show_count_mismatches(model, now)]
+    mismatched += len(ids)
+    click.echo('%s: %d with wrong counters%s' % (
+      model.__tablename__, len(ids), (' (%s)' % ', '.join(map(str, ids[:20]))) if ids else ''))
+  if fix and mismatched:
+    for model in (Venue, Artist):
+      db.session.execute(recount_statement(model, now))
+    db.session.commit()
+    click.echo('Recounted.')
+  elif mismatched:
+    sys.exit(1)
+
+
 #----------------------------------------------------------------------------#
 
 @app.errorhandler(404)
@@ -580,6 +2237,8 @@ if not app.debug:
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
+    sql_log.setLevel(logging.INFO)
+    sql_log.addHandler(file_handler)
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
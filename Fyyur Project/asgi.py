@@ -0,0 +1,421 @@
+"""ASGI entry point: the read routes on asyncpg, everything else on the Flask app.
+
+    $ pip install uvicorn asyncpg asgiref
+    $ uvicorn asgi:application --workers 4
+
+The directory, artist list, detail pages, /shows and search run as
+coroutines. While one waits on Postgres, its worker serves other requests.
+Their statements are built by the same query functions as the WSGI routes,
+compiled for asyncpg, and run on an asyncpg pool. Their pages are rendered
+from the same templates, with the same validators, page cache and
+after_request handlers (Server-Timing, metrics, the session cookie). Every
+other route is the Flask app, run on a thread through asgiref.
+
+Flask's request context is only ever entered between awaits, never across
+one, so requests sharing the event loop cannot see each other's context.
+"""
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+from flask import g, render_template, request as flask_request, abort, jsonify
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from werkzeug.exceptions import HTTPException
+
+from app import (
+  app, db, Venue, Artist, Show, current_time, show_column, keyset, split_page, stored_counts,
+  show_counts_query, section_query, shows_query, directory_query, stale_venues, upcoming_counts_query,
+  directory, search_rows_query, search_results, suggest_query, suggestions, suggest_cache,
+  directory_state, venue_state, artists_state, artist_state, shows_state, validators_enabled,
+  page_validators, not_modified, revalidated, page_cache, page_cache_key, page_ttl, page_limit,
+  ShowTimes, SEARCH_WORD)
+from sqltrace import RequestTrace
+
+# Numbered binds (:1, :2) are rewritten to asyncpg's $1, $2.
+DIALECT = PGDialect(paramstyle='numeric')
+NUMBERED_BIND = re.compile(r'(?<![:\w]):(\d+)')
+
+
+class Row(dict):
+  """A result row; columns read as keys or attributes, like the ORM's rows."""
+
+  def __getattr__(self, name):
+    try:
+      return self[name]
+    except KeyError:
+      raise AttributeError(name)
+
+  def _asdict(self):
+    return dict(self)
+
+
+class Database(object):
+  """SQLAlchemy statements run on an asyncpg connection pool."""
+
+  def __init__(self, url, min_size, max_size, statement_cache_size=100, command_timeout=None):
+    # asyncpg takes libpq URLs, without SQLAlchemy's +driver suffix.
+    self.url = re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', url)
+    self.min_size = min_size
+    self.max_size = max_size
+    self.statement_cache_size = statement_cache_size
+    self.command_timeout = command_timeout
+    self.pool = None
+    self._lock = None
+
+  async def connect(self):
+    # The lock is made here, on the server's event loop.
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    async with self._lock:
+      if self.pool is None:
+        self.pool = await asyncpg.create_pool(
+          self.url, min_size=self.min_size, max_size=self.max_size, init=self._init,
+          statement_cache_size=self.statement_cache_size, command_timeout=self.command_timeout)
+
+  async def close(self):
+    if self.pool is not None:
+      await self.pool.close()
+      self.pool = None
+
+  async def _init(self, connection):
+    # The directory view's venues column is JSON.
+    for name in ('json', 'jsonb'):
+      await connection.set_type_codec(name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+  def compile(self, statement):
+    compiled = getattr(statement, 'statement', statement).compile(dialect=DIALECT)
+    return NUMBERED_BIND.sub(r'$\1', compiled.string), [compiled.params[name] for name in compiled.positiontup]
+
+  async def fetch(self, statement, trace=None):
+    if self.pool is None:
+      await self.connect()
+    sql, args = self.compile(statement)
+    start = time.perf_counter()
+    records = await self.pool.fetch(sql, *args)
+    if trace is not None:
+      trace.record(sql, time.perf_counter() - start)
+    return [Row(record.items()) for record in records]
+
+  async def first(self, statement, trace=None):
+    rows = await self.fetch(statement, trace)
+    return rows[0] if rows else None
+
+
+class Request(object):
+  """One ASGI request, with a WSGI environ to enter Flask's request context with."""
+
+  def __init__(self, database, scope, body):
+    self.database = database
+    self.environ = wsgi_environ(scope, body)
+    self.trace = RequestTrace(app.config['SQL_TRACE_N_PLUS_ONE'])
+    self.started = time.perf_counter()
+
+  def context(self):
+    # Each context reads the form from the start of the body again.
+    self.environ['wsgi.input'].seek(0)
+    return app.request_context(self.environ)
+
+  async def fetch(self, statement):
+    return await self.database.fetch(statement, self.trace)
+
+  async def first(self, statement):
+    return await self.database.first(statement, self.trace)
+
+  async def validators(self, state):
+    # validators() with the query on the pool: (etag, last_modified).
+    with self.context():
+      if not validators_enabled():
+        return None, None
+    values = await self.first(db.select(list(state)))
+    with self.context():
+      return page_validators(list(values.values()))
+
+  def finish(self, response):
+    """The response as (status, headers, body), inside the request context.
+
+    Runs the app's after_request handlers, which save the session (and so
+    the flashes the page consumed) and record the trace and timings.
+    """
+    g.sql_trace = self.trace
+    g.request_started = self.started
+    response = app.process_response(app.make_response(response))
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.get_wsgi_headers(self.environ).items()]
+    body = b'' if self.environ['REQUEST_METHOD'] == 'HEAD' else response.get_data()
+    return response.status_code, headers, body
+
+
+def wsgi_environ(scope, body):
+  environ = {
+    'REQUEST_METHOD': scope['method'],
+    'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+    'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+    'QUERY_STRING': scope['query_string'].decode('latin-1'),
+    'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': scope.get('scheme', 'http'),
+    'wsgi.input': io.BytesIO(body),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+  }
+  server = scope.get('server') or ('localhost', 80)
+  environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1])
+  if scope.get('client'):
+    environ['REMOTE_ADDR'] = scope['client'][0]
+  for name, value in scope['headers']:
+    name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+    if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+      environ[name] = value
+    elif 'HTTP_' + name in environ:
+      environ['HTTP_' + name] += ',' + value
+    else:
+      environ['HTTP_' + name] = value
+  return environ
+
+
+#----------------------------------------------------------------------------#
+# Routes.
+#----------------------------------------------------------------------------#
+
+async def venues(request):
+  now = current_time()
+  etag, last_modified = await request.validators(directory_state(now))
+  with request.context():
+    response = not_modified(etag)
+    if response:
+      return request.finish(response)
+    query = directory_query()
+  areas = await request.fetch(query)
+  stale = stale_venues(areas, now)
+  recounted = {}
+  if stale:
+    with request.context():
+      query = upcoming_counts_query(stale, now)
+    recounted = dict(tuple(row.values()) for row in await request.fetch(query))
+  with request.context():
+    page = render_template('pages/venues.html', areas=directory(areas, stale, recounted))
+    return request.finish(revalidated(page, etag, last_modified))
+
+
+async def artists(request):
+  etag, last_modified = await request.validators(artists_state())
+  with request.context():
+    response = not_modified(etag)
+    if response:
+      return request.finish(response)
+  rows = await request.fetch(db.select([Artist.id, Artist.name]))
+  with request.context():
+    return request.finish(revalidated(render_template('pages/artists.html', artists=rows),
+                                      etag, last_modified))
+
+
+async def show_sections(request, model, entity_id, other, columns, now):
+  # show_sections() on the pool: the stale-counter recount, if needed, and
+  # both sections are fetched concurrently, on separate connections.
+  with request.context():
+    limit = page_limit()
+    entity_column = show_column(model)
+    counts_query = show_counts_query(entity_column, entity_id, now)
+    query = section_query(entity_column, entity_id, other, columns)
+    pages = [(name, keyset(query, now, upcoming, flask_request.args.get(name + '_cursor')).limit(limit + 1))
+             for name, upcoming in (('upcoming', True), ('past', False))]
+  entity = await request.first(db.select([column for column in model.__table__.c
+                                          if column.name != 'search_vector']).
+                               where(model.id == entity_id))
+  if entity is None:
+    abort(404)
+  counts = stored_counts(entity, now)
+  results = await asyncio.gather(
+    *[request.fetch(page) for name, page in pages] +
+    ([request.first(counts_query)] if counts is None else []))
+  counts = counts or results[2]
+  sections = {'next_show_at': counts['next_show_at']}
+  for (name, page), rows in zip(pages, results):
+    shows, next_cursor = split_page(rows, limit)
+    sections[name] = {'count': counts[name], 'shows': shows, 'next_cursor': next_cursor}
+  return entity, sections
+
+
+def format_sections(sections, timezone):
+  # Inside the request context: show times in the request's locale.
+  times = ShowTimes(timezone)
+  for name in ('upcoming', 'past'):
+    sections[name]['shows'] = times.rows(sections[name]['shows'])
+  return sections
+
+
+async def detail_page(request, kind, model, entity_id, state, related, other, columns, template):
+  now = current_time()
+  etag, last_modified = await request.validators(state)
+  with request.context():
+    response = not_modified(etag)
+    if response:
+      return request.finish(response)
+    key = page_cache_key(kind, entity_id, related, etag)
+  page = page_cache.get(key) if key else None
+  if page is not None:
+    with request.context():
+      return request.finish(revalidated(page, etag, last_modified))
+  entity, sections = await show_sections(request, model, entity_id, other, columns, now)
+  with request.context():
+    sections = format_sections(sections, entity.get('timezone'))
+    page = render_template(template, **dict(sections, **{kind: entity}))
+    ttl = page_ttl(sections['next_show_at'])
+    if key and ttl > 0:
+      page_cache.set(key, page, ttl)
+    return request.finish(revalidated(page, etag, last_modified))
+
+
+async def show_venue(request, venue_id):
+  return await detail_page(
+    request, 'venue', Venue, venue_id, venue_state(venue_id, current_time()), 'artist', Artist,
+    (Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')),
+    'pages/show_venue.html')
+
+
+async def show_artist(request, artist_id):
+  return await detail_page(
+    request, 'artist', Artist, artist_id, artist_state(artist_id, current_time()), 'venue', Venue,
+    (Show.venue_id, Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'),
+     Venue.timezone.label('venue_timezone')),
+    'pages/show_artist.html')
+
+
+class ShowPage(list):
+  # A page of /shows rows with the cursor of the next, as ShowStream gives.
+  next_cursor = None
+
+
+async def shows(request):
+  now = current_time()
+  etag, last_modified = await request.validators(shows_state(now))
+  with request.context():
+    response = not_modified(etag)
+    if response:
+      return request.finish(response)
+    upcoming = flask_request.args.get('when', 'upcoming') != 'past'
+    limit = page_limit('SHOWS_LIST_PAGE_SIZE', 'SHOWS_LIST_PAGE_MAX')
+    query = keyset(shows_query(), now, upcoming, flask_request.args.get('cursor')).limit(limit + 1)
+  rows, next_cursor = split_page(await request.fetch(query), limit)
+  with request.context():
+    page = ShowPage(ShowTimes().rows(rows))
+    page.next_cursor = next_cursor
+    page = render_template('pages/shows.html', shows=page, when='upcoming' if upcoming else 'past')
+    return request.finish(revalidated(page, etag, last_modified))
+
+
+async def search_page(request, models, template, names):
+  with request.context():
+    search_term = flask_request.values.get('search_term', '')
+    queries = [search_rows_query(model, search_term) for model in models]
+  results = await asyncio.gather(*[request.fetch(query) for query in queries])
+  with request.context():
+    context = dict(zip(names, map(search_results, results)))
+    return request.finish(render_template(template, search_term=search_term, **context))
+
+
+async def search_venues(request):
+  return await search_page(request, [Venue], 'pages/search_venues.html', ['results'])
+
+
+async def search_artists(request):
+  return await search_page(request, [Artist], 'pages/search_artists.html', ['results'])
+
+
+async def search_all(request):
+  return await search_page(request, [Venue, Artist], 'pages/search.html', ['venues', 'artists'])
+
+
+async def search_suggest(request):
+  with request.context():
+    term = ' '.join(SEARCH_WORD.findall(flask_request.args.get('q', '').lower()))
+    limit = max(1, min(flask_request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int),
+                       app.config['SUGGEST_LIMIT_MAX']))
+    results = suggest_cache.get((term, limit))
+    query = suggest_query(term, limit) if results is None else None
+  if results is None:
+    results = suggestions(await request.fetch(query)) if query is not None else []
+    suggest_cache.set((term, limit), results)
+  with request.context():
+    return request.finish(jsonify({'term': term, 'results': results}))
+
+
+# Endpoints served as coroutines; the rest go to the Flask app.
+ASYNC_ROUTES = {
+  'venues': venues, 'artists': artists, 'show_venue': show_venue, 'show_artist': show_artist,
+  'shows': shows, 'search_venues': search_venues, 'search_artists': search_artists,
+  'search_all': search_all, 'search_suggest': search_suggest,
+}
+
+
+#----------------------------------------------------------------------------#
+# Application.
+#----------------------------------------------------------------------------#
+
+class Application(object):
+  def __init__(self):
+    self.database = Database(
+      app.config['ASYNC_DATABASE_URL'], app.config['ASYNC_DB_POOL_MIN'], app.config['ASYNC_DB_POOL_MAX'],
+      # PgBouncer in transaction mode cannot keep prepared statements.
+      statement_cache_size=0 if app.config['DB_PGBOUNCER'] else 100,
+      command_timeout=app.config['DB_STATEMENT_TIMEOUT_MS'] / 1000.0)
+    self.wsgi = WsgiToAsgi(app)
+    self.urls = app.url_map.bind('localhost')
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      return await self.lifespan(receive, send)
+    try:
+      endpoint, arguments = self.urls.match(scope['path'], scope['method'])
+    except HTTPException:
+      endpoint, arguments = None, {}
+    handler = ASYNC_ROUTES.get(endpoint)
+    if handler is None:
+      return await self.wsgi(scope, receive, send)
+
+    request = Request(self.database, scope, await read_body(receive))
+    try:
+      status, headers, body = await handler(request, **arguments)
+    except Exception as error:
+      with request.context():
+        if isinstance(error, HTTPException):
+          response = app.handle_user_exception(error)
+        else:
+          response = app.handle_exception(error)
+        status, headers, body = request.finish(response)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        try:
+          await self.database.connect()
+        except Exception as error:
+          await send({'type': 'lifespan.startup.failed', 'message': repr(error)})
+          return
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        await self.database.close()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+
+async def read_body(receive):
+  chunks = []
+  while True:
+    message = await receive()
+    chunks.append(message.get('body', b''))
+    if not message.get('more_body'):
+      return b''.join(chunks)
+
+
+application = Application()
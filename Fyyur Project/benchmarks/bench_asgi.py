@@ -0,0 +1,103 @@
+"""Read-route latency and throughput, WSGI (gunicorn) against ASGI (uvicorn).
+
+Seeds the database, then starts each server in turn with the same number
+of worker processes and drives the read routes at rising concurrency over
+HTTP. gunicorn's workers serve one request per thread, on the psycopg2
+pool; uvicorn's serve every request on the event loop, on the asyncpg pool.
+
+    $ pip install gunicorn uvicorn asyncpg asgiref
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_asgi.py
+    $ DATABASE_URL=... python benchmarks/bench_asgi.py --workers 4 --concurrency 16 64 256 --output asgi.json
+
+The client is Python threads too; at the highest concurrency, check it is
+not the bottleneck (its CPU use) before reading much into the numbers.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import app, db, seed
+from loadtest import HTTPTarget, routes, run_route
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ['venues', 'artists', 'show_venue', 'show_artist', 'shows', 'search_all', 'search_suggest']
+SERVERS = {
+  'wsgi': lambda workers, threads, port: [
+    'gunicorn', '--workers', str(workers), '--threads', str(threads),
+    '--bind', '127.0.0.1:%d' % port, 'app:app'],
+  'asgi': lambda workers, threads, port: [
+    'uvicorn', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+    '--no-access-log', 'asgi:application'],
+}
+
+
+def start(mode, workers, threads, port):
+  env = dict(os.environ, FLASK_DEBUG='0', SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+             DB_POOL_SIZE=str(threads), ASYNC_DB_POOL_MAX=str(threads))
+  server = subprocess.Popen(SERVERS[mode](workers, threads, port), cwd=PROJECT, env=env,
+                            stdout=subprocess.DEVNULL)
+  deadline = time.monotonic() + 60
+  while time.monotonic() < deadline:
+    try:
+      urllib.request.urlopen('http://127.0.0.1:%d/' % port).read()
+      return server
+    except OSError:
+      if server.poll() is not None:
+        sys.exit('%s server exited with %d' % (mode, server.returncode))
+      time.sleep(0.2)
+  server.terminate()
+  sys.exit('%s server did not start' % mode)
+
+
+def main(args):
+  venues = max(50, args.shows // 50)
+  volumes = {'venues': venues, 'artists': venues // 2, 'shows': args.shows}
+  with app.app_context():
+    seed(venues, shows=args.shows)
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    db.session.remove()
+  scenarios = [route for route in routes(volumes) if route.name in ROUTES]
+
+  results = {}
+  for mode in ('wsgi', 'asgi'):
+    server = start(mode, args.workers, args.threads, args.port)
+    try:
+      target = HTTPTarget('http://127.0.0.1:%d' % args.port)
+      for concurrency in args.concurrency:
+        for route in scenarios:
+          results[mode, concurrency, route.name] = run_route(
+            target, route, args.requests, concurrency, 20, 42, {})
+    finally:
+      server.terminate()
+      server.wait()
+
+  print('%-16s %6s %11s %11s %9s %11s %11s %9s' % (
+    'route', 'conc.', 'wsgi p50', 'wsgi p99', 'wsgi r/s', 'asgi p50', 'asgi p99', 'asgi r/s'))
+  for concurrency in args.concurrency:
+    for route in scenarios:
+      wsgi, asgi = results['wsgi', concurrency, route.name], results['asgi', concurrency, route.name]
+      print('%-16s %6d %11.2f %11.2f %9.1f %11.2f %11.2f %9.1f' % (
+        route.name, concurrency, wsgi['p50_ms'], wsgi['p99_ms'], wsgi['throughput_rps'],
+        asgi['p50_ms'], asgi['p99_ms'], asgi['throughput_rps']))
+  if args.output:
+    with open(args.output, 'w') as stream:
+      json.dump([dict(result, mode=mode, concurrency=concurrency, route=name)
+                 for (mode, concurrency, name), result in sorted(results.items())], stream, indent=2)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--shows', type=int, default=100000)
+  parser.add_argument('--workers', type=int, default=2, help='Server worker processes, for both.')
+  parser.add_argument('--threads', type=int, default=8,
+                      help="gunicorn threads per worker; also each worker's pool size, for both.")
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+  parser.add_argument('--requests', type=int, default=500, help='Measured requests per route and level.')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--output', help='Write every result as JSON here.')
+  main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""Show insert throughput under concurrent, conflicting bookings.
+
+Each thread books random hour-long slots, with its own connection, in
+autocommit transactions. Slots are drawn from a small window, so many
+requests collide; the exclusion constraints refuse those. At the end no
+venue or artist may be double-booked.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_bookings.py
+    $ DATABASE_URL=... python benchmarks/bench_bookings.py --threads 1 2 4 8 --bookings 2000
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from common import app, db, Show, current_time, seed
+
+import app as fyyur
+
+
+def book(thread, bookings, venues, artists, window, now, results):
+  rnd = random.Random(thread)
+  inserted = refused = 0
+  with db.engine.connect() as connection:
+    for _ in range(bookings):
+      start_time = now + timedelta(minutes=30 * rnd.randrange(window))
+      try:
+        connection.execute(Show.__table__.insert(), {
+          'venue_id': rnd.randint(1, venues), 'artist_id': rnd.randint(1, artists),
+          'start_time': start_time, 'end_time': start_time + timedelta(hours=2)})
+        inserted += 1
+      except IntegrityError as error:
+        if fyyur.booking_constraint(error) is None:
+          raise
+        refused += 1
+  results[thread] = (inserted, refused)
+
+
+def double_bookings():
+  count = 0
+  for column in ('venue_id', 'artist_id'):
+    count += db.session.execute(
+      'SELECT count(*) FROM "Show" a JOIN "Show" b ON a.%s = b.%s '
+      'AND a.id < b.id AND a.booked && b.booked' % (column, column)).scalar()
+  return count
+
+
+def main(threads, bookings, venues, window):
+  print('%8s %10s %10s %12s %14s' % ('threads', 'inserted', 'refused', 'inserts/s', 'attempts/s'))
+  with app.app_context():
+    for count in threads:
+      seed(venues, shows=0)
+      now = current_time().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+      results = {}
+      workers = [threading.Thread(target=book, args=(n, bookings // count, venues, max(1, venues // 2),
+                                                     window, now, results))
+                 for n in range(count)]
+      start = time.perf_counter()
+      for worker in workers:
+        worker.start()
+      for worker in workers:
+        worker.join()
+      elapsed = time.perf_counter() - start
+      inserted = sum(result[0] for result in results.values())
+      refused = sum(result[1] for result in results.values())
+      print('%8d %10d %10d %12.0f %14.0f' % (count, inserted, refused, inserted / elapsed,
+                                             (inserted + refused) / elapsed))
+      assert double_bookings() == 0, 'double booking slipped through'
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+  parser.add_argument('--bookings', type=int, default=4000, help='Booking attempts per run.')
+  parser.add_argument('--venues', type=int, default=50)
+  parser.add_argument('--window', type=int, default=200, help='Half-hour start slots to choose from.')
+  args = parser.parse_args()
+  main(args.threads, args.bookings, args.venues, args.window)
@@ -0,0 +1,63 @@
+"""Micro-benchmark of the `datetime` template filter.
+
+Compares the old filter (dateutil on a str() of the time, then
+babel.dates.format_datetime) with the current one, with and without its memo
+cache, and with the one-pass ShowTimes formatting the show pages use, in
+each venue's timezone. No database is needed.
+
+    $ python benchmarks/bench_datetime.py [tiles]
+"""
+import os
+import random
+import sys
+import timeit
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import babel.dates
+import dateutil.parser
+
+import app
+
+Row = namedtuple('Row', 'start_time venue_timezone')
+ZONES = ['America/New_York', 'America/Chicago', 'America/Los_Angeles', 'Europe/London']
+
+
+def legacy_format_datetime(value, format='medium'):
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en_US')
+
+
+def main(tiles):
+  rnd = random.Random(1)
+  start = datetime(2026, 1, 1, 20, 0)
+  # A shows page: evening slots, so many tiles share a start time.
+  times = [start + timedelta(days=rnd.randint(0, 180), hours=rnd.choice([0, 1, 2])) for _ in range(tiles)]
+  strings = [str(value) for value in times]
+  rows = [Row(value, rnd.choice(ZONES)) for value in times]
+  uncached = getattr(app.render_datetime, '__wrapped__', app.render_datetime)
+  locale = 'en_US'
+
+  assert legacy_format_datetime(strings[0], 'full') == uncached(times[0], 'full', locale, 'UTC')
+
+  cases = [
+    ('legacy, str + dateutil', lambda: [legacy_format_datetime(value, 'full') for value in strings]),
+    ('datetime, compiled pattern', lambda: [uncached(value, 'full', locale, 'UTC') for value in times]),
+    ('ISO str, compiled pattern', lambda: [uncached(value, 'full', locale, 'UTC') for value in strings]),
+    ('datetime, memo cache', lambda: [app.format_datetime(value, 'full') for value in times]),
+    ('ShowTimes, venue zones', lambda: app.ShowTimes().rows(rows)),
+  ]
+  print('%d tiles per render' % tiles)
+  for label, fn in cases:
+    best = min(timeit.repeat(fn, number=1, repeat=5))
+    print('  %-28s %8.2f ms/render %8.2f us/tile' % (label, best * 1000, best * 1e6 / tiles))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,53 @@
+"""Overhead of the sampling profiler on the routes it is meant to diagnose.
+
+Runs the same load with the profiler off, sampling a share of requests, and
+profiling every request (the X-Fyyur-Profile header on all of them), and
+reports each mode's latency against "off".
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_profiler.py
+    $ DATABASE_URL=... python benchmarks/bench_profiler.py --shows 100000 --concurrency 4
+"""
+import argparse
+import tempfile
+
+from common import app, seed
+from loadtest import TestClientTarget, routes, run_route
+
+import app as fyyur
+
+ROUTES = ['show_artist', 'show_venue', 'shows', 'venues']
+TOKEN = 'bench'
+
+
+def main(shows, concurrency, requests, rate):
+  venues = max(50, shows // 50)
+  volumes = {'venues': venues, 'artists': venues // 2, 'shows': shows}
+  with app.app_context():
+    seed(venues, shows=shows)
+  app.config['PROFILE_TOKEN'] = TOKEN
+  fyyur.profiler.directory = tempfile.mkdtemp(prefix='fyyur-profiles-')
+  modes = [('off', 0, {}), ('sampled %g' % rate, rate, {}), ('every request', 0, {'X-Fyyur-Profile': TOKEN})]
+  target = TestClientTarget()
+  scenarios = [route for route in routes(volumes) if route.name in ROUTES]
+
+  print('%-14s %-14s %10s %10s %10s %10s' % ('route', 'mode', 'p50 (ms)', 'p95 (ms)', 'mean (ms)', 'overhead'))
+  for route in scenarios:
+    baseline = None
+    for label, sample_rate, headers in modes:
+      app.config['PROFILE_SAMPLE_RATE'] = sample_rate
+      result = run_route(target, route, requests, concurrency, 10, 42, headers)
+      baseline = baseline or result
+      print('%-14s %-14s %10.2f %10.2f %10.2f %9.1f%%' % (
+        route.name, label, result['p50_ms'], result['p95_ms'], result['mean_ms'],
+        (result['mean_ms'] / baseline['mean_ms'] - 1) * 100))
+  print('profiles written to %s' % fyyur.profiler.directory)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--shows', type=int, default=10000)
+  parser.add_argument('--concurrency', type=int, default=1)
+  parser.add_argument('--requests', type=int, default=300)
+  parser.add_argument('--rate', type=float, default=0.01, help='PROFILE_SAMPLE_RATE of the sampled mode.')
+  args = parser.parse_args()
+  main(args.shows, args.concurrency, args.requests, args.rate)
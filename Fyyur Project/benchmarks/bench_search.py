@@ -0,0 +1,33 @@
+"""Compare the old ILIKE search with the full-text search at 100k rows.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_search.py [rows]
+"""
+import sys
+
+from common import app, db, Venue, Artist, seed, timed
+from app import search
+
+TERMS = ['venue 1', 'artist 42', 'jazz', 'san fran', 'new york', 'nomatch']
+
+
+def ilike(model, term):
+  return db.session.query(model.id, model.name).\
+    filter(model.name.ilike('%' + term + '%')).all()
+
+
+def main(rows):
+  print('%-12s %-8s %12s %12s' % ('term', 'model', 'ilike (ms)', 'fts (ms)'))
+  with app.app_context():
+    seed(rows, artists=rows)
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    with app.test_request_context():
+      for term in TERMS:
+        for model in (Venue, Artist):
+          before, _ = timed(lambda: ilike(model, term))
+          after, _ = timed(lambda: search(model, term))
+          print('%-12s %-8s %12.2f %12.2f' % (term, model.__name__, before * 1000, after * 1000))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,62 @@
+"""Time-to-first-response of a fresh worker, with a cold and a warm template cache.
+
+Each run starts a new interpreter, as gunicorn does for a new worker, imports
+the app and requests the pages that need no database. Run it from anywhere;
+no database is touched.
+
+    $ python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PROJECT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['/', '/venues/create', '/artists/create', '/shows/create']
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+first = {}
+for page in %r:
+  t = time.perf_counter()
+  client.get(page)
+  first[page] = (time.perf_counter() - t) * 1000
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_ms': first}))
+''' % (PAGES,)
+
+
+def worker(cache_dir, preload):
+  env = dict(os.environ, TEMPLATE_CACHE_DIR=cache_dir, FLASK_DEBUG='0' if preload else '1')
+  output = subprocess.check_output([sys.executable, '-c', WORKER], cwd=PROJECT, env=env)
+  return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def report(label, results):
+  print('%-26s import %7.1f ms' % (label, min(r['import_ms'] for r in results)))
+  for page in PAGES:
+    print('    %-22s first response %7.1f ms' % (page, min(r['first_ms'][page] for r in results)))
+
+
+def main(runs):
+  cache_dir = tempfile.mkdtemp(prefix='fyyur-jinja-')
+  try:
+    cold = []
+    for _ in range(runs):
+      shutil.rmtree(cache_dir)
+      os.makedirs(cache_dir)
+      cold.append(worker(cache_dir, preload=False))
+    report('cold, lazy compile', cold)
+    report('bytecode cache, lazy', [worker(cache_dir, preload=False) for _ in range(runs)])
+    report('bytecode cache, preload', [worker(cache_dir, preload=True) for _ in range(runs)])
+  finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,31 @@
+"""Compare the old per-venue COUNT loop on /venues with the grouped query.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_venues.py
+"""
+import sys
+
+from common import app, db, Venue, Show, current_time, seed, timed
+
+SIZES = [1000, 10000, 100000]
+
+
+def legacy_venues():
+  # The N+1 loop /venues used to run: one COUNT per venue.
+  for venue in Venue.query.order_by(Venue.city, Venue.state).all():
+    db.session.query(Venue).join(Show).\
+      filter(Venue.id == venue.id, Show.start_time > current_time()).count()
+
+
+def main(sizes):
+  client = app.test_client()
+  print('%10s %12s %10s %12s %10s' % ('venues', 'before (s)', 'queries', 'after (s)', 'queries'))
+  with app.app_context():
+    for size in sizes:
+      seed(size)
+      before, before_queries = timed(legacy_venues, repeat=1)
+      after, after_queries = timed(lambda: client.get('/venues'))
+      print('%10d %12.3f %10d %12.3f %10d' % (size, before, before_queries, after, after_queries))
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or SIZES)
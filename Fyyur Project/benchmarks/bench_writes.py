@@ -0,0 +1,67 @@
+"""Show creation latency as follow-up work grows, with jobs inline or queued.
+
+Each step adds a simulated side effect (a sleep standing in for a
+notification or reindex) to the show_created job. Run inline, the POST
+pays for every one; queued, it should stay flat.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_writes.py
+"""
+import itertools
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import app, Show, seed
+
+import app as fyyur
+
+SIDE_EFFECTS = [0, 1, 4, 16]
+EFFECT_SECONDS = 0.005
+POSTS = 20
+
+# Every POST of every round books its own slot, after the seeded shows and
+# longer apart than a default booking, so none hits the booking constraints
+# and each one measures an insert plus its job.
+FIRST_SLOT = datetime(2030, 1, 1, 20, 0)
+SLOT = timedelta(hours=3)
+slots = itertools.count()
+
+
+def post_shows(client):
+  shows = Show.query.count()
+  start = time.perf_counter()
+  for n in range(POSTS):
+    client.post('/shows/create', data={
+      'venue_id': str(n % 50 + 1), 'artist_id': str(n % 25 + 1),
+      'start_time': (FIRST_SLOT + next(slots) * SLOT).strftime('%Y-%m-%d %H:%M:%S')})
+  elapsed = time.perf_counter() - start
+  created = Show.query.count() - shows
+  if created != POSTS:
+    raise SystemExit('only %d of %d POSTs created a show' % (created, POSTS))
+  return elapsed / POSTS
+
+
+def main(effects):
+  app.config['WTF_CSRF_ENABLED'] = False
+  client = app.test_client()
+  show_created = fyyur.jobs.handlers['show_created']
+  print('%12s %14s %14s' % ('side effects', 'inline (ms)', 'queued (ms)'))
+  with app.app_context():
+    seed(100)
+    for count in effects:
+      def slow_show_created(*args):
+        show_created(*args)
+        for _ in range(count):
+          time.sleep(EFFECT_SECONDS)
+      fyyur.jobs.handlers['show_created'] = slow_show_created
+      results = []
+      for workers in (0, 2):
+        fyyur.jobs.workers = workers
+        results.append(post_shows(client))
+        fyyur.jobs.drain()
+      print('%12d %14.2f %14.2f' % (count, results[0] * 1000, results[1] * 1000))
+  print(fyyur.jobs.stats())
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or SIDE_EFFECTS)
@@ -0,0 +1,160 @@
+"""Shared helpers for the Fyyur benchmarks.
+
+The benchmarks run against the database named by ``DATABASE_URL`` and wipe
+it while seeding, so point it at a scratch database, never at real data:
+
+    $ createdb fyyur_bench
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/bench_venues.py
+"""
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from app import app, db, Venue, Artist, Show, current_time, recount_statement
+
+# The benchmarks import the app through this module, which is what puts the
+# project directory on sys.path.
+__all__ = ['app', 'db', 'Venue', 'Artist', 'Show', 'current_time', 'recount_statement',
+           'CITIES', 'GENRES', 'QueryCounter', 'count_queries', 'reset_database',
+           'schedule', 'seed', 'timed']
+
+CITIES = [('San Francisco', 'CA', 'America/Los_Angeles'), ('New York', 'NY', 'America/New_York'),
+          ('Austin', 'TX', 'America/Chicago'), ('Seattle', 'WA', 'America/Los_Angeles'),
+          ('Chicago', 'IL', 'America/Chicago'), ('Boston', 'MA', 'America/New_York'),
+          ('Denver', 'CO', 'America/Denver'), ('Portland', 'OR', 'America/Los_Angeles'),
+          ('Nashville', 'TN', 'America/Chicago'), ('Miami', 'FL', 'America/New_York')]
+GENRES = ['Jazz', 'Blues', 'Rock n Roll', 'Folk', 'Hip-Hop', 'Classical',
+          'Electronic', 'Country', 'Soul', 'Punk']
+CHUNK = 5000
+
+
+class QueryCounter(object):
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, *args, **kwargs):
+    self.count += 1
+
+
+@contextmanager
+def count_queries():
+  counter = QueryCounter()
+  engine = db.engine
+  event.listen(engine, 'before_cursor_execute', counter)
+  try:
+    yield counter
+  finally:
+    event.remove(engine, 'before_cursor_execute', counter)
+
+
+def reset_database():
+  db.session.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+  db.session.commit()
+  db.drop_all()
+  db.create_all()
+
+
+def _insert(table, rows):
+  # Rows may be a generator, so a million shows never sit in memory at once.
+  rows = iter(rows)
+  chunk = list(islice(rows, CHUNK))
+  while chunk:
+    db.session.execute(table.insert(), chunk)
+    chunk = list(islice(rows, CHUNK))
+  db.session.commit()
+
+
+def schedule(rnd, venues, artists, shows, now):
+  """Yield `shows` hour-long bookings with no venue or artist booked twice."""
+  hours = 24 * 365 * 4
+  taken = set()
+  for _ in range(shows):
+    for attempt in range(100):
+      if attempt < 5:
+        venue_id = min(venues, int(rnd.paretovariate(1.2)))
+        artist_id = min(artists, int(rnd.paretovariate(1.2)))
+      else:
+        # The popular ones are fully booked; spread out.
+        venue_id, artist_id = rnd.randint(1, venues), rnd.randint(1, artists)
+      hour = rnd.randrange(hours)
+      if (venue_id, hour) not in taken and (-artist_id, hour) not in taken:
+        break
+    else:
+      raise ValueError('cannot fit %d shows into %d venues' % (shows, venues))
+    taken.add((venue_id, hour))
+    taken.add((-artist_id, hour))
+    start_time = now + timedelta(hours=hour - 24 * 365 * 3)
+    yield {'venue_id': venue_id, 'artist_id': artist_id,
+           'start_time': start_time, 'end_time': start_time + timedelta(hours=1)}
+
+
+def seed(venues, artists=None, shows=None, seed=42):
+  """Fill a fresh database with synthetic venues, artists and shows.
+
+  Show popularity is skewed: a few venues and artists get most bookings,
+  the same shape as the real catalogue. Shows last an hour and start on the
+  hour, and no venue or artist is double-booked, as the booking constraints
+  require.
+  """
+  rnd = random.Random(seed)
+  artists = artists or max(1, venues // 2)
+  shows = venues * 2 if shows is None else shows
+  reset_database()
+
+  _insert(Venue.__table__, [{
+      'id': i,
+      'name': 'Venue %d' % i,
+      'city': CITIES[i % len(CITIES)][0],
+      'state': CITIES[i % len(CITIES)][1],
+      'address': '%d Main Street' % i,
+      'timezone': CITIES[i % len(CITIES)][2],
+      'phone': '555-%07d' % i,
+      'genres': rnd.sample(GENRES, 2),
+      'seeking_talent': i % 3 == 0,
+  } for i in range(1, venues + 1)])
+
+  _insert(Artist.__table__, [{
+      'id': i,
+      'name': 'Artist %d' % i,
+      'city': CITIES[i % len(CITIES)][0],
+      'state': CITIES[i % len(CITIES)][1],
+      'phone': '555-%07d' % i,
+      'genres': rnd.sample(GENRES, 2),
+      'seeking_venue': i % 2 == 0,
+  } for i in range(1, artists + 1)])
+
+  now = current_time().replace(minute=0, second=0, microsecond=0)
+  _insert(Show.__table__, (dict(show, id=i) for i, show in
+                           enumerate(schedule(rnd, venues, artists, shows, now), 1)))
+
+  for table in ('Venue', 'Artist', 'Show'):
+    db.session.execute(
+      "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), "
+      "(SELECT MAX(id) FROM \"%s\"))" % (table, table))
+  # Bulk inserts bypass the Show events that keep the counters.
+  for model in (Venue, Artist):
+    db.session.execute(recount_statement(model, now))
+  db.session.execute('REFRESH MATERIALIZED VIEW "VenueDirectory"')
+  db.session.commit()
+
+
+def timed(fn, repeat=3):
+  """Return (best seconds, statements issued) over ``repeat`` runs of ``fn``."""
+  best, queries = None, 0
+  for _ in range(repeat):
+    with count_queries() as counter:
+      start = time.perf_counter()
+      fn()
+      elapsed = time.perf_counter() - start
+    db.session.remove()
+    if best is None or elapsed < best:
+      best, queries = elapsed, counter.count
+  return best, queries
@@ -0,0 +1,103 @@
+"""EXPLAIN the hot read queries and check they use the Show and search indexes.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/explain_hot_queries.py
+    $ DATABASE_URL=... python benchmarks/explain_hot_queries.py --seed 100000
+
+The queries are built by the same functions the routes use, so the check
+follows the routes when they change. On a small or empty database the
+planner rightly prefers sequential scans, so unless ``--natural`` is given
+they are disabled for the session; the check is then "can this query be
+served by the index at all". With ``--seed`` a representative volume is
+loaded and ANALYZEd first.
+"""
+import argparse
+import json
+import sys
+
+from common import app, db, Venue, Artist, Show, current_time, seed
+
+from app import (encode_cursor, keyset, section_query, shows_query, search_rows_query,
+                 suggest_query, upcoming_counts_query)
+
+
+def hot_queries():
+  now = current_time()
+  # A cursor from the middle of the table, as the second page would send.
+  cursor = encode_cursor(now, 1000)
+  venue_shows = section_query(Show.venue_id, 1, Artist, (
+    Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')))
+  artist_shows = section_query(Show.artist_id, 1, Venue, (
+    Show.venue_id, Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link')))
+  return [
+    ('show_venue', ['ix_Show_venue_id_start_time'],
+     keyset(venue_shows, now, True, None).limit(11)),
+    ('show_venue_past', ['ix_Show_venue_id_start_time'],
+     keyset(venue_shows, now, False, cursor).limit(11)),
+    ('show_artist', ['ix_Show_artist_id_start_time'],
+     keyset(artist_shows, now, True, None).limit(11)),
+    ('show_artist_past', ['ix_Show_artist_id_start_time'],
+     keyset(artist_shows, now, False, cursor).limit(11)),
+    ('venues_recount', ['ix_Show_venue_id_start_time'],
+     upcoming_counts_query([1, 2, 3], now)),
+    ('shows', ['ix_Show_start_time'],
+     keyset(shows_query(), now, True, None).limit(51)),
+    ('shows_next', ['ix_Show_start_time'],
+     keyset(shows_query(), now, True, cursor).limit(51)),
+    ('search_venues', ['ix_Venue_search_vector'],
+     search_rows_query(Venue, 'venue 12')),
+    ('search_artists', ['ix_Artist_search_vector'],
+     search_rows_query(Artist, 'artist 12')),
+    ('suggest', ['ix_Venue_search_vector', 'ix_Artist_search_vector'],
+     suggest_query('12', 10)),
+  ]
+
+
+def index_names(plan):
+  names = set()
+  if 'Index Name' in plan:
+    names.add(plan['Index Name'])
+  for child in plan.get('Plans', []):
+    names |= index_names(child)
+  return names
+
+
+def explain(cursor, query):
+  compiled = query.statement.compile(dialect=db.engine.dialect)
+  cursor.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params)
+  return cursor.fetchone()[0][0]['Plan']
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--seed', type=int, help='seed this many venues first')
+  parser.add_argument('--natural', action='store_true', help='leave sequential scans enabled')
+  parser.add_argument('--verbose', action='store_true', help='print every plan')
+  args = parser.parse_args()
+
+  failures = 0
+  with app.app_context():
+    if args.seed:
+      seed(args.seed, shows=args.seed * 10)
+      db.session.execute('ANALYZE')
+      db.session.commit()
+    connection = db.engine.raw_connection()
+    try:
+      cursor = connection.cursor()
+      if not args.natural:
+        cursor.execute('SET enable_seqscan = off')
+      for name, expected, query in hot_queries():
+        plan = explain(cursor, query)
+        used = index_names(plan)
+        # Every expected index, e.g. both sides of the suggest union.
+        ok = set(expected) <= used
+        failures += not ok
+        print('%-4s %-18s uses %s' % ('ok' if ok else 'FAIL', name, ', '.join(sorted(used)) or 'no index'))
+        if args.verbose or not ok:
+          print(json.dumps(plan, indent=2))
+    finally:
+      connection.close()
+  return 1 if failures else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,436 @@
+"""Drive every Fyyur route at fixed concurrency and report latency percentiles.
+
+Seeds the database named by DATABASE_URL (wiping it; see common.py) with
+synthetic venues, artists and shows, then sends each route the same number
+of requests from `--concurrency` threads. The JSON report has p50/p95/p99
+latency, throughput and statements per request for every route; compared
+with a baseline report it exits non-zero on a regression, so it can gate
+performance changes.
+
+    $ DATABASE_URL=postgresql://localhost/fyyur_bench python benchmarks/loadtest.py --shows 100000 --output baseline.json
+    $ DATABASE_URL=... python benchmarks/loadtest.py --shows 100000 --reuse --baseline baseline.json
+    $ python benchmarks/loadtest.py --check report.json --baseline baseline.json
+
+Requests go through Flask's test client, in this process, unless --url names
+a running server (gunicorn, say) on the same database; only then do several
+worker processes serve them. Seed before starting the server, or pass
+--reuse, so its caches hold no pages from an earlier dataset.
+
+Statement counts come from the Server-Timing header, so SQL_TRACE must be on
+(it is by default).
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from common import app, db, Venue, Artist, Show, current_time, recount_statement, seed, GENRES, CITIES
+
+REPORT_VERSION = 1
+TERMS = ['venue 1', 'artist 42', 'jazz', 'san francisco', 'new york', 'nomatch']
+PREFIXES = ['v', 've', 'ven', 'art', 'artist 1', 'ja', 'sa']
+QUERIES = re.compile(r'desc="(\d+) queries"')
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class Route(object):
+  """One scenario: how to build the n-th request to an endpoint.
+
+  `share` scales the request count, for routes too heavy to hit as often
+  as the rest (the full-table exports).
+  """
+
+  def __init__(self, name, endpoint, method, build, share=1.0):
+    self.name = name
+    self.endpoint = endpoint
+    self.method = method
+    self.build = build
+    self.share = share
+
+
+def popular(rnd, count):
+  # Mostly the few popular entities, as the seeded shows are.
+  if rnd.random() < 0.8:
+    return min(count, int(rnd.paretovariate(1.2)))
+  return rnd.randint(1, count)
+
+
+def venue_form(n, name=None):
+  city, state, zone = CITIES[n % len(CITIES)]
+  return {'name': name or 'Loadtest Venue %d' % n, 'city': city, 'state': state, 'timezone': zone,
+          'address': '%d Test Street' % n, 'phone': '555-000-%04d' % (n % 10000),
+          'genres': GENRES[n % len(GENRES)], 'image_link': '', 'facebook_link': '',
+          'website': '', 'seeking_description': ''}
+
+
+def artist_form(n, name=None):
+  city, state, _ = CITIES[n % len(CITIES)]
+  return {'name': name or 'Loadtest Artist %d' % n, 'city': city, 'state': state,
+          'phone': '555-000-%04d' % (n % 10000), 'genres': GENRES[n % len(GENRES)],
+          'image_link': '', 'facebook_link': '', 'website': '', 'seeking_description': ''}
+
+
+def edit(path, count, form, name):
+  # Edits keep the seeded name, city and timezone, so the next run finds
+  # the same rows.
+  def build(rnd, n):
+    entity_id = rnd.randint(1, count)
+    return path % entity_id, form(entity_id, name % entity_id)
+  return build
+
+
+def created(path, model, seeded):
+  # The rows this run's create requests added, looked up once they exist.
+  ids = []
+  def build(rnd, n):
+    if not ids:
+      with app.app_context():
+        ids.extend(row.id for row in db.session.query(model.id).filter(model.id > seeded).order_by(model.id))
+        db.session.remove()
+    return path % (ids[n] if n < len(ids) else 0), None
+  return build
+
+
+def routes(volumes):
+  """Every route in app.py, each with requests shaped like real traffic."""
+  venues, artists, shows = volumes['venues'], volumes['artists'], volumes['shows']
+  # Shows booked by this run start past the seeded ones, six hours apart so
+  # venue timezones cannot make two of them overlap.
+  first_slot = current_time().replace(minute=0, second=0, microsecond=0) + timedelta(days=2 * 365)
+
+  return [
+    Route('index', 'index', 'GET', lambda rnd, n: ('/', None)),
+    Route('venues', 'venues', 'GET', lambda rnd, n: ('/venues', None)),
+    Route('search_venues', 'search_venues', 'POST',
+          lambda rnd, n: ('/venues/search', {'search_term': rnd.choice(TERMS)})),
+    Route('show_venue', 'show_venue', 'GET',
+          lambda rnd, n: ('/venues/%d' % popular(rnd, venues), None)),
+    Route('edit_venue', 'edit_venue', 'GET',
+          lambda rnd, n: ('/venues/%d/edit' % rnd.randint(1, venues), None)),
+    Route('edit_venue_submission', 'edit_venue_submission', 'POST', edit('/venues/%d/edit', venues,
+                                                                         venue_form, 'Venue %d')),
+    Route('create_venue_form', 'create_venue_form', 'GET', lambda rnd, n: ('/venues/create', None)),
+    Route('create_venue_submission', 'create_venue_submission', 'POST',
+          lambda rnd, n: ('/venues/create', venue_form(n))),
+    Route('artists', 'artists', 'GET', lambda rnd, n: ('/artists', None)),
+    Route('search_artists', 'search_artists', 'POST',
+          lambda rnd, n: ('/artists/search', {'search_term': rnd.choice(TERMS)})),
+    Route('search_suggest', 'search_suggest', 'GET',
+          lambda rnd, n: ('/search/suggest?q=' + urllib.parse.quote(rnd.choice(PREFIXES)), None)),
+    Route('search_all', 'search_all', 'GET',
+          lambda rnd, n: ('/search?search_term=' + urllib.parse.quote(rnd.choice(TERMS)), None)),
+    Route('show_artist', 'show_artist', 'GET',
+          lambda rnd, n: ('/artists/%d' % popular(rnd, artists), None)),
+    Route('edit_artist', 'edit_artist', 'GET',
+          lambda rnd, n: ('/artists/%d/edit' % rnd.randint(1, artists), None)),
+    Route('edit_artist_submission', 'edit_artist_submission', 'POST', edit('/artists/%d/edit', artists,
+                                                                           artist_form, 'Artist %d')),
+    Route('create_artist_form', 'create_artist_form', 'GET', lambda rnd, n: ('/artists/create', None)),
+    Route('create_artist_submission', 'create_artist_submission', 'POST',
+          lambda rnd, n: ('/artists/create', artist_form(n))),
+    Route('shows', 'shows', 'GET', lambda rnd, n: ('/shows', None)),
+    Route('shows_past', 'shows', 'GET', lambda rnd, n: ('/shows?when=past', None)),
+    Route('create_shows', 'create_shows', 'GET', lambda rnd, n: ('/shows/create', None)),
+    Route('create_show_submission', 'create_show_submission', 'POST', lambda rnd, n: ('/shows/create', {
+      'venue_id': str(popular(rnd, venues)), 'artist_id': str(popular(rnd, artists)),
+      'start_time': (first_slot + timedelta(hours=6 * n)).strftime('%Y-%m-%d %H:%M:%S')})),
+    Route('export_venues', 'export', 'GET', lambda rnd, n: ('/export/venues.csv', None), share=0.05),
+    Route('export_shows', 'export', 'GET', lambda rnd, n: ('/export/shows.ndjson', None), share=0.05),
+    Route('api_venues', 'api.entities', 'GET', lambda rnd, n: ('/api/v1/venues?include=shows', None)),
+    Route('api_artists', 'api.entities', 'GET', lambda rnd, n: ('/api/v1/artists', None)),
+    Route('api_venue', 'api.entity', 'GET',
+          lambda rnd, n: ('/api/v1/venues/%d?include=shows' % popular(rnd, venues), None)),
+    Route('api_artist', 'api.entity', 'GET',
+          lambda rnd, n: ('/api/v1/artists/%d' % popular(rnd, artists), None)),
+    Route('api_shows', 'api.show_list', 'GET', lambda rnd, n: ('/api/v1/shows', None)),
+    Route('api_show', 'api.show_detail', 'GET',
+          lambda rnd, n: ('/api/v1/shows/%d' % rnd.randint(1, max(1, shows)), None)),
+    Route('metrics', 'metrics_endpoint', 'GET', lambda rnd, n: ('/metrics', None)),
+    Route('status_pool', 'pool_status', 'GET', lambda rnd, n: ('/status/pool', None)),
+    Route('status_jobs', 'jobs_status', 'GET', lambda rnd, n: ('/status/jobs', None)),
+    # Last, once the create routes above have made something to delete.
+    Route('delete_venues', 'delete_venues', 'DELETE', created('/venues/%d', Venue, venues)),
+    Route('delete_artist', 'delete_artist', 'DELETE', created('/artists/%d', Artist, artists)),
+  ]
+
+
+def uncovered(scenarios):
+  endpoints = set(rule.endpoint for rule in app.url_map.iter_rules()) - {'static'}
+  return sorted(endpoints - set(route.endpoint for route in scenarios))
+
+
+class TestClientTarget(object):
+  """Requests through Flask's test client; one client (and cookie jar) per thread."""
+
+  def __init__(self):
+    app.config['WTF_CSRF_ENABLED'] = False
+    self._local = threading.local()
+
+  def request(self, method, path, data, headers):
+    client = getattr(self._local, 'client', None)
+    if client is None:
+      client = self._local.client = app.test_client()
+    response = client.open(path, method=method, data=data, headers=headers)
+    response.get_data()
+    return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+  def redirect_request(self, *args, **kwargs):
+    return None
+
+
+class HTTPTarget(object):
+  """Requests over HTTP to a running server; one cookie jar per thread."""
+
+  def __init__(self, url):
+    self.url = url.rstrip('/')
+    self._local = threading.local()
+
+  def request(self, method, path, data, headers):
+    opener = getattr(self._local, 'opener', None)
+    if opener is None:
+      opener = self._local.opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+    if data is not None and method == 'POST':
+      # Forms posted to a real server need the session's CSRF token.
+      data = dict(data, csrf_token=self._csrf_token(opener))
+    body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(self.url + path, data=body, method=method, headers=headers)
+    try:
+      response = opener.open(request)
+    except urllib.error.HTTPError as error:
+      # Redirects and error statuses are answers too.
+      response = error
+    with response:
+      response.read()
+      return response.getcode(), response.headers.get('Server-Timing', '')
+
+  def _csrf_token(self, opener):
+    if not hasattr(self._local, 'csrf_token'):
+      with opener.open(self.url + '/shows/create') as response:
+        match = CSRF_TOKEN.search(response.read().decode('utf-8'))
+      self._local.csrf_token = match.group(1) if match else ''
+    return self._local.csrf_token
+
+
+def percentile(values, p):
+  # Nearest rank, on sorted values.
+  return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def run_route(target, route, requests, concurrency, warmup, seed, headers):
+  rnd = random.Random('%s:%d' % (route.name, seed))
+  count = max(1, int(requests * route.share))
+  specs = [route.build(rnd, n) for n in range(count + warmup)]
+  for path, data in specs[:warmup]:
+    target.request(route.method, path, data, headers)
+
+  def one(spec):
+    start = time.perf_counter()
+    try:
+      status, timing = target.request(route.method, spec[0], spec[1], headers)
+    except Exception as error:
+      return time.perf_counter() - start, 'error', None, repr(error)
+    match = QUERIES.search(timing)
+    return time.perf_counter() - start, status, int(match.group(1)) if match else None, None
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    results = list(pool.map(one, specs[warmup:]))
+  wall = time.perf_counter() - start
+
+  latencies = sorted(result[0] * 1000 for result in results)
+  queries = sorted(result[2] for result in results if result[2] is not None)
+  statuses = {}
+  for result in results:
+    statuses[str(result[1])] = statuses.get(str(result[1]), 0) + 1
+  failures = [result[3] for result in results if result[3]]
+  return {
+    'endpoint': route.endpoint,
+    'method': route.method,
+    'requests': len(results),
+    'errors': sum(1 for result in results if result[1] == 'error' or result[1] >= 500),
+    'statuses': statuses,
+    'p50_ms': round(percentile(latencies, 50), 3),
+    'p95_ms': round(percentile(latencies, 95), 3),
+    'p99_ms': round(percentile(latencies, 99), 3),
+    'mean_ms': round(sum(latencies) / len(latencies), 3),
+    'max_ms': round(latencies[-1], 3),
+    'throughput_rps': round(len(results) / wall, 1),
+    'queries_p50': percentile(queries, 50) if queries else None,
+    'queries_max': queries[-1] if queries else None,
+    'first_error': failures[0] if failures else None,
+  }
+
+
+def restore(volumes):
+  # Remove what this run's create requests added, so --reuse finds the
+  # seeded volumes next time.
+  with app.app_context():
+    for model in (Show, Venue, Artist):
+      model.query.filter(model.id > volumes[model.__tablename__.lower() + 's']).delete(synchronize_session=False)
+    # Bulk deletes bypass the Show events that keep the counters.
+    now = current_time()
+    for model in (Venue, Artist):
+      db.session.execute(recount_statement(model, now))
+    db.session.execute('REFRESH MATERIALIZED VIEW "VenueDirectory"')
+    db.session.commit()
+    db.session.remove()
+
+
+def volumes_in_database():
+  return {'venues': Venue.query.count(), 'artists': Artist.query.count(), 'shows': Show.query.count()}
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def run(args):
+  volumes = {'venues': args.venues or max(50, args.shows // 50), 'shows': args.shows}
+  volumes['artists'] = args.artists or max(1, volumes['venues'] // 2)
+  with app.app_context():
+    if not (args.reuse and volumes_in_database() == volumes):
+      print('seeding %(venues)d venues, %(artists)d artists, %(shows)d shows' % volumes, file=sys.stderr)
+      seed(volumes['venues'], volumes['artists'], volumes['shows'], seed=args.seed)
+      db.session.execute('ANALYZE')
+      db.session.commit()
+    db.session.remove()
+
+  scenarios = routes(volumes)
+  missing = uncovered(scenarios)
+  if missing:
+    print('warning: no scenario for %s' % ', '.join(missing), file=sys.stderr)
+  if args.routes:
+    scenarios = [route for route in scenarios if route.name in args.routes or route.endpoint in args.routes]
+
+  target = HTTPTarget(args.url) if args.url else TestClientTarget()
+  headers = dict(header.split(':', 1) for header in args.header)
+  headers = dict((key.strip(), value.strip()) for key, value in headers.items())
+  report = {
+    'version': REPORT_VERSION,
+    'meta': {
+      'started': current_time().isoformat(),
+      'git': git_revision(),
+      'python': platform.python_version(),
+      'mode': 'http' if args.url else 'test-client',
+      'url': args.url,
+      'concurrency': args.concurrency,
+      'requests': args.requests,
+      'warmup': args.warmup,
+      'seed': args.seed,
+      'headers': headers,
+      'volumes': volumes,
+    },
+    'routes': {},
+    'uncovered': missing,
+  }
+  print('%-26s %8s %6s %10s %10s %10s %10s %8s' % (
+    'route', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'req/s', 'queries'), file=sys.stderr)
+  for route in scenarios:
+    result = report['routes'][route.name] = run_route(
+      target, route, args.requests, args.concurrency, args.warmup, args.seed, headers)
+    print('%-26s %8d %6d %10.2f %10.2f %10.2f %10.1f %8s' % (
+      route.name, result['requests'], result['errors'], result['p50_ms'], result['p95_ms'],
+      result['p99_ms'], result['throughput_rps'], result['queries_max']), file=sys.stderr)
+  restore(volumes)
+  return report
+
+
+# Report fields that must match for two reports to be comparable.
+COMPARABLE = ('mode', 'concurrency', 'volumes', 'headers')
+
+
+def compare(report, baseline, threshold, metric='p95_ms', floor_ms=1.0):
+  """Regressions of `report` against `baseline`, as lines of text.
+
+  A route regresses when `metric` grows by more than `threshold` (a
+  fraction) and by more than `floor_ms`, which keeps sub-millisecond
+  routes from failing on noise; when it runs more statements; or when it
+  fails more requests.
+  """
+  for field in COMPARABLE:
+    if report['meta'].get(field) != baseline['meta'].get(field):
+      raise ValueError('reports differ in %s: %r, baseline %r' % (
+        field, report['meta'].get(field), baseline['meta'].get(field)))
+  regressions = []
+  for name, result in sorted(report['routes'].items()):
+    base = baseline['routes'].get(name)
+    if base is None:
+      continue
+    if result[metric] > base[metric] * (1 + threshold) and result[metric] - base[metric] > floor_ms:
+      regressions.append('%s: %s %.2f ms, baseline %.2f ms' % (name, metric, result[metric], base[metric]))
+    if result['queries_max'] is not None and base['queries_max'] is not None and \
+        result['queries_max'] > base['queries_max']:
+      regressions.append('%s: %d statements, baseline %d' % (name, result['queries_max'], base['queries_max']))
+    if result['errors'] > base['errors']:
+      regressions.append('%s: %d errors, baseline %d' % (name, result['errors'], base['errors']))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--shows', type=int, default=10000, help='Shows to seed (1000 to 1000000).')
+  parser.add_argument('--venues', type=int, help='Venues to seed; default one per 50 shows, at least 50.')
+  parser.add_argument('--artists', type=int, help='Artists to seed; default half the venues.')
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--reuse', action='store_true',
+                      help='Skip seeding when the database already holds these volumes.')
+  parser.add_argument('--url', help='Base URL of a running server; default the in-process test client.')
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--requests', type=int, default=200, help='Measured requests per route.')
+  parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per route first.')
+  parser.add_argument('--routes', nargs='+', help='Only these scenarios or endpoints.')
+  parser.add_argument('--header', action='append', default=[], metavar='NAME:VALUE',
+                      help='Send this header with every request.')
+  parser.add_argument('--output', help='Write the JSON report here.')
+  parser.add_argument('--check', metavar='REPORT', help='Compare an existing report instead of running.')
+  parser.add_argument('--baseline', help='Report to compare against; exit 1 on a regression.')
+  parser.add_argument('--threshold', type=float, default=0.2,
+                      help='Allowed growth of the compared latency, as a fraction.')
+  parser.add_argument('--metric', default='p95_ms', choices=['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'])
+  args = parser.parse_args()
+
+  if args.check:
+    with open(args.check) as stream:
+      report = json.load(stream)
+  else:
+    report = run(args)
+    if args.output:
+      with open(args.output, 'w') as stream:
+        json.dump(report, stream, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as stream:
+      baseline = json.load(stream)
+    try:
+      regressions = compare(report, baseline, args.threshold, args.metric)
+    except ValueError as error:
+      sys.exit('cannot compare: %s' % error)
+    for line in regressions:
+      print('REGRESSION ' + line, file=sys.stderr)
+    if regressions:
+      sys.exit(1)
+    print('no regressions against %s' % args.baseline, file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+  """A bounded, thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+  The cache lives in one worker process. Entries written by other workers are
+  never seen here, so `ttl` bounds how long a value can go stale after another
+  worker changes the data behind it.
+  """
+
+  def __init__(self, maxsize=1024, ttl=60):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._data = OrderedDict()
+    self._counters = {}
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None or entry[1] <= time.monotonic():
+        if entry is not None:
+          del self._data[key]
+        self.misses += 1
+        return default
+      self._data.move_to_end(key)
+      self.hits += 1
+      return entry[0]
+
+  def set(self, key, value, ttl=None):
+    expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+    with self._lock:
+      self._data[key] = (value, expires)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def incr(self, key):
+    # Counters are kept apart from cached values so that they are never
+    # evicted or expired; a counter going back would revive stale entries.
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + 1
+      return self._counters[key]
+
+  def counter(self, key):
+    return self._counters.get(key, 0)
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def __len__(self):
+    return len(self._data)
+
+
+class RedisCache(object):
+  """The LRUCache interface on a Redis-compatible server shared by all workers.
+
+  Needs the optional `redis` package. Values are stored as text.
+  """
+
+  def __init__(self, url, ttl=60, prefix='fyyur:'):
+    import redis
+    self.ttl = ttl
+    self.prefix = prefix
+    self.hits = 0
+    self.misses = 0
+    self._redis = redis.Redis.from_url(url)
+
+  def get(self, key, default=None):
+    value = self._redis.get(self.prefix + key)
+    if value is None:
+      self.misses += 1
+      return default
+    self.hits += 1
+    return value.decode('utf-8')
+
+  def set(self, key, value, ttl=None):
+    ttl = int(self.ttl if ttl is None else ttl)
+    if ttl > 0:
+      self._redis.setex(self.prefix + key, ttl, value)
+
+  def incr(self, key):
+    return self._redis.incr(self.prefix + key)
+
+  def counter(self, key):
+    return int(self._redis.get(self.prefix + key) or 0)
+
+  def delete(self, key):
+    self._redis.delete(self.prefix + key)
+
+  def clear(self):
+    keys = list(self._redis.scan_iter(self.prefix + '*'))
+    if keys:
+      self._redis.delete(*keys)
+
+
+def make_cache(url=None, maxsize=1024, ttl=60):
+  """An in-process LRUCache, or a RedisCache when `url` names a server."""
+  if url:
+    return RedisCache(url, ttl=ttl)
+  return LRUCache(maxsize, ttl)
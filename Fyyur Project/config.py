@@ -1,14 +1,151 @@
 import os
-SECRET_KEY = os.urandom(32)
+from sqlalchemy.pool import NullPool
+from dbpool import InstrumentedQueuePool
+# Set SECRET_KEY when running several workers, so that they all accept each
+# other's session cookies.
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Enable debug mode.
-DEBUG = True
+DEBUG = os.environ.get('FLASK_DEBUG', '1') == '1'
+
+# Templates: compiled bytecode is kept on disk so new workers skip the Jinja
+# compiler (`flask precompile-templates` fills it at build time). Outside
+# debug, templates are never re-checked on disk and are all loaded at startup.
+TEMPLATES_AUTO_RELOAD = DEBUG
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, '.jinja_cache'))
+TEMPLATE_PRELOAD = not DEBUG
 
 # Connect to the database
 
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgres://tadhi_ibrahim@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres://tadhi_ibrahim@localhost:5432/fyyur')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Read replicas, as a comma-separated DATABASE_REPLICA_URLS. Read-only routes
+# are spread over them round-robin, except for a client that wrote within the
+# last REPLICA_LAG_WINDOW seconds, whose reads stay on the primary.
+REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+SQLALCHEMY_BINDS = dict(('replica%d' % n, url) for n, url in enumerate(REPLICA_URLS))
+REPLICA_LAG_WINDOW = int(os.environ.get('REPLICA_LAG_WINDOW', 10))
+REPLICA_RETRY_AFTER = int(os.environ.get('REPLICA_RETRY_AFTER', 30))
+
+# Connection pool, per worker process. With DB_PGBOUNCER=1 the app expects a
+# local PgBouncer in transaction mode: it keeps no pool of its own and sets
+# the statement timeout per transaction instead of per connection.
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '0') == '1'
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+if DB_PGBOUNCER:
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': NullPool,
+    }
+else:
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'connect_args': {'options': '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT_MS},
+    }
+
+# How long a show is booked for when no duration or end time is given.
+SHOW_DEFAULT_MINUTES = 120
+
+# Show lists on venue and artist pages are paged by (start_time, id).
+SHOWS_PAGE_SIZE = 24
+SHOWS_PAGE_MAX = 100
+
+# The /shows listing; pages larger than SHOWS_STREAM_THRESHOLD are streamed.
+SHOWS_LIST_PAGE_SIZE = 60
+SHOWS_LIST_PAGE_MAX = 5000
+SHOWS_STREAM_THRESHOLD = 500
+SHOWS_FETCH_SIZE = 500
+
+# Most results a search route returns, best ranked first.
+SEARCH_RESULT_LIMIT = 50
+
+# Search-as-you-type: /search/suggest?q=<prefix>
+SUGGEST_LIMIT = 10
+SUGGEST_LIMIT_MAX = 25
+SUGGEST_CACHE_SIZE = 2048
+SUGGEST_CACHE_TTL = 60
+
+# Rendered venue/artist pages. Set PAGE_CACHE_URL (e.g. redis://localhost:6379/0)
+# to share the cache between workers; otherwise each worker keeps its own.
+PAGE_CACHE_URL = os.environ.get('PAGE_CACHE_URL')
+PAGE_CACHE_SIZE = 1024
+PAGE_CACHE_TTL = 300
+
+# Rows fetched per round-trip, and per streamed chunk, by the /export routes.
+EXPORT_FETCH_SIZE = 1000
+
+# /api/v1 list pages, and shows per entity with include=shows.
+API_PAGE_SIZE = 50
+API_PAGE_MAX = 500
+API_INCLUDE_LIMIT = 100
+
+# Seconds a burst of venue/show writes is collected before the /venues
+# directory view is refreshed.
+DIRECTORY_REFRESH_DELAY = 2
+
+# Formatted show times remembered by the datetime filter; 0 turns it off.
+DATETIME_FORMAT_CACHE = 4096
+
+# Locales dates are rendered in, chosen per request from Accept-Language.
+LOCALES = os.environ.get('LOCALES', 'en_US,en_GB,fr,de,es').split(',')
+DEFAULT_LOCALE = LOCALES[0]
+
+# Background jobs for the slow work writes trigger (the directory refresh).
+# Jobs run on JOB_WORKERS threads in each web process, or, with
+# JOB_QUEUE_URL (e.g. redis://localhost:6379/1), in `flask work-jobs`
+# processes. 0 workers runs jobs inline.
+JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_RETRIES = 3
+JOB_RETRY_BACKOFF = 0.5
+JOB_DEAD_LETTER_SIZE = 1000
+JOB_KEY_TTL = 3600
+
+# Per-request SQL tracing: statement count and DB time in a Server-Timing
+# header and in the fyyur.sql log, with likely N+1 queries flagged.
+SQL_TRACE = os.environ.get('SQL_TRACE', '1') == '1'
+# A statement fingerprint repeated this often in one request is flagged.
+SQL_TRACE_N_PLUS_ONE = 5
+# Requests spending longer than this in the database are logged as warnings.
+SQL_TRACE_SLOW_MS = 200
+# Show the statements of each page in an overlay (debug only).
+SQL_TRACE_OVERLAY = DEBUG
+# What a route running more statements than its @query_budget does: 'off',
+# 'warn' (log it) or 'raise' (fail the request; for tests and CI).
+SQL_QUERY_BUDGETS = os.environ.get('SQL_QUERY_BUDGETS', 'warn')
+
+# Prometheus metrics at /metrics. Under gunicorn, point METRICS_DIR at an
+# empty directory (cleared on every restart) that all workers can write, so
+# each scrape reports every worker, not just the one that answered.
+METRICS = os.environ.get('METRICS', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Sampling profiler. A request is profiled when its X-Fyyur-Profile header
+# matches PROFILE_TOKEN, or at random, PROFILE_SAMPLE_RATE (0 to 1) of the
+# time; both are off by default. Stack samples are taken every
+# PROFILE_INTERVAL_MS, capped at PROFILE_MAX_SAMPLES per request and at
+# PROFILE_MAX_ACTIVE requests at once, and written to PROFILE_DIR, which
+# keeps the newest PROFILE_KEEP.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+PROFILE_INTERVAL_MS = 5
+PROFILE_MAX_SAMPLES = 2000
+PROFILE_MAX_ACTIVE = 2
+PROFILE_KEEP = 200
+
+# ASGI mode (asgi.py): the read routes run on an asyncpg pool of this size in
+# each worker process, on ASYNC_DATABASE_URL (by default the primary).
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL', SQLALCHEMY_DATABASE_URI)
+ASYNC_DB_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', 2))
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', 10))
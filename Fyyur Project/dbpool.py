@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats(object):
+  """Connection pool gauges for one worker process."""
+
+  def __init__(self):
+    self.in_use = 0
+    self.peak_in_use = 0
+    self.checkouts = 0
+    self.wait_count = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+    self.timeouts = 0
+    self.connect_errors = 0
+    self._lock = threading.Lock()
+
+  def checked_out(self):
+    with self._lock:
+      self.in_use += 1
+      self.checkouts += 1
+      self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+  def checked_in(self):
+    with self._lock:
+      self.in_use -= 1
+
+  def waited(self, seconds, timed_out=False):
+    with self._lock:
+      self.wait_count += 1
+      self.wait_total += seconds
+      self.wait_max = max(self.wait_max, seconds)
+      self.timeouts += timed_out
+
+  def connect_failed(self):
+    with self._lock:
+      self.connect_errors += 1
+
+  def snapshot(self, pool=None):
+    with self._lock:
+      data = {
+        'pid': os.getpid(),
+        'in_use': self.in_use,
+        'peak_in_use': self.peak_in_use,
+        'checkouts': self.checkouts,
+        'wait_seconds_total': self.wait_total,
+        'wait_seconds_max': self.wait_max,
+        'wait_seconds_avg': self.wait_total / self.wait_count if self.wait_count else 0.0,
+        'timeouts': self.timeouts,
+        'connect_errors': self.connect_errors,
+      }
+    if isinstance(pool, QueuePool):
+      data.update(size=pool.size(), idle=pool.checkedin(), overflow=pool.overflow())
+    return data
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+  """A QueuePool that records how long each checkout waits for a connection."""
+
+  def _do_get(self):
+    # Only a full pool times out; a host that refuses the connection is a
+    # connect error, not a sign that the pool is too small.
+    start = time.perf_counter()
+    try:
+      connection = super(InstrumentedQueuePool, self)._do_get()
+    except exc.TimeoutError:
+      pool_stats.waited(time.perf_counter() - start, timed_out=True)
+      raise
+    except Exception:
+      pool_stats.connect_failed()
+      raise
+    pool_stats.waited(time.perf_counter() - start)
+    return connection
+
+
+def instrument(engine, statement_timeout=None):
+  """Track in-use connections on `engine`.
+
+  With `statement_timeout` (milliseconds) every transaction starts with
+  SET LOCAL statement_timeout, which is safe behind PgBouncer in transaction
+  mode where session-level settings would leak between clients.
+  """
+  event.listen(engine.pool, 'checkout', lambda *args: pool_stats.checked_out())
+  event.listen(engine.pool, 'checkin', lambda *args: pool_stats.checked_in())
+  if statement_timeout:
+    @event.listens_for(engine, 'begin')
+    def set_statement_timeout(conn):
+      conn.execute('SET LOCAL statement_timeout = %d' % statement_timeout)
@@ -0,0 +1,39 @@
+import threading
+
+
+class Debouncer(object):
+  """Runs `fn` once, `delay` seconds after the first of a burst of triggers.
+
+  Triggers arriving while a run is pending are absorbed into it; one arriving
+  while `fn` is running schedules a single follow-up run, so the last change
+  of a burst is always picked up.
+  """
+
+  def __init__(self, delay, fn):
+    self.delay = delay
+    self.fn = fn
+    self.runs = 0
+    self._timer = None
+    self._lock = threading.Lock()
+
+  def trigger(self):
+    with self._lock:
+      if self._timer is None:
+        self._timer = threading.Timer(self.delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+  def _run(self):
+    with self._lock:
+      self._timer = None
+    self.runs += 1
+    self.fn()
+
+  def flush(self):
+    # Run now instead of waiting, if a run is pending.
+    with self._lock:
+      timer, self._timer = self._timer, None
+    if timer is not None:
+      timer.cancel()
+      self.runs += 1
+      self.fn()
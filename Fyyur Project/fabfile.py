@@ -1,3 +1,5 @@
+import os
+
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
@@ -114,3 +116,21 @@ def deploy():
 
 def rollback():
     local("heroku rollback")
+
+# performance gate: fails when a route got slower than the saved baseline
+# the baseline is machine-specific, so each machine records its own with `fab baseline`
+
+
+def baseline():
+    local(
+        "python benchmarks/loadtest.py --reuse --output benchmarks/baseline.json"
+    )
+
+
+def benchmark():
+    if not os.path.exists("benchmarks/baseline.json"):
+        abort("No benchmarks/baseline.json: run `fab baseline` on this machine first.")
+    local(
+        "python benchmarks/loadtest.py --reuse --output benchmarks/report.json"
+        " --baseline benchmarks/baseline.json"
+    )
@@ -1,8 +1,9 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, ValidationError
-from wtforms.validators import DataRequired, AnyOf, URL, Optional, Regexp
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField, ValidationError
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, Regexp, NumberRange
 import re
+import pytz
 
 class ShowForm(FlaskForm):
     artist_id = StringField(
@@ -16,6 +17,11 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # Minutes; left empty, the show is booked for SHOW_DEFAULT_MINUTES.
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)]
+    )
 
 
 state_choices=[
@@ -95,6 +101,8 @@ genres_choices=[
                  ('Other', 'Other'),
         ]
 
+timezone_choices = [(zone, zone) for zone in pytz.common_timezones]
+
 
 class VenueForm(FlaskForm):
     def validate_facebook_link(form, field):
@@ -121,6 +129,10 @@ class VenueForm(FlaskForm):
     address = StringField(
         'address', validators=[DataRequired()]
     )
+    timezone = SelectField(
+        'timezone', validators=[DataRequired()],
+        choices = timezone_choices, default='UTC'
+    )
     phone = StringField(
         'phone'
     )
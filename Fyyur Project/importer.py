@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+import os
+import time
+
+
+def read_rows(path, format=None):
+  """Yield (line number, row dict) from a CSV file with a header, or NDJSON.
+
+  Rows are read one at a time, so memory does not grow with the file.
+  """
+  format = format or ('csv' if path.endswith('.csv') else 'ndjson')
+  with io.open(path, encoding='utf-8', newline='') as stream:
+    if format == 'csv':
+      reader = csv.DictReader(stream)
+      for row in reader:
+        yield reader.line_num, row
+    else:
+      for line, text in enumerate(stream, 1):
+        if text.strip():
+          yield line, json.loads(text)
+
+
+def chunked(rows, size):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+class Checkpoint(object):
+  """The last input line of `path` that has been committed, kept beside it."""
+
+  def __init__(self, path):
+    self.path = path + '.checkpoint'
+
+  def load(self):
+    try:
+      with open(self.path) as stream:
+        return int(stream.read().strip() or 0)
+    except (IOError, ValueError):
+      return 0
+
+  def save(self, line):
+    with open(self.path + '.tmp', 'w') as stream:
+      stream.write(str(line))
+    os.replace(self.path + '.tmp', self.path)
+
+  def clear(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+class Report(object):
+  def __init__(self, errors_path):
+    self.started = time.perf_counter()
+    self.read = 0
+    self.loaded = 0
+    self.failed = 0
+    self.errors_path = errors_path
+    self._errors = None
+
+  def error(self, line, message):
+    self.failed += 1
+    if self._errors is None:
+      self._errors = io.open(self.errors_path, 'a', encoding='utf-8')
+    self._errors.write(json.dumps({'line': line, 'error': message}) + '\n')
+
+  def rate(self):
+    elapsed = time.perf_counter() - self.started
+    return self.read / elapsed if elapsed else 0.0
+
+  def summary(self):
+    return '%d rows read, %d loaded, %d rejected, %.0f rows/sec' % (
+      self.read, self.loaded, self.failed, self.rate())
+
+  def close(self):
+    if self._errors is not None:
+      self._errors.close()
+
+
+def run_import(path, prepare, load, format=None, chunk_size=1000, restart=False, echo=print):
+  """Stream `path` through `prepare` and `load` one chunk at a time.
+
+  `prepare(rows)` takes a list of (line, row) pairs and returns the records
+  to load and a list of (line, message) rejections. `load(records)` writes
+  and commits them, and may return more rejections for records the
+  database refused. The checkpoint moves only after a commit, so a failed
+  run resumes after its last committed chunk. Rejected rows are written to
+  `<path>.errors.ndjson` as their chunk is committed.
+  """
+  checkpoint = Checkpoint(path)
+  if restart:
+    checkpoint.clear()
+  resume_after = checkpoint.load()
+  if resume_after:
+    echo('Resuming after line %d' % resume_after)
+
+  report = Report(path + '.errors.ndjson')
+  rows = ((line, row) for line, row in read_rows(path, format) if line > resume_after)
+  try:
+    for chunk in chunked(rows, chunk_size):
+      records, rejected = prepare(chunk)
+      refused = []
+      if records:
+        refused = load(records) or []
+      # Only once the chunk is committed: a resumed run reads it again.
+      for line, message in rejected + refused:
+        report.error(line, message)
+      report.read += len(chunk)
+      report.loaded += len(records) - len(refused)
+      checkpoint.save(chunk[-1][0])
+      echo(report.summary())
+  finally:
+    report.close()
+  checkpoint.clear()
+  return report
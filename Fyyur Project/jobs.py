@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+  def __init__(self, name, args, key=None, attempts=0, enqueued_at=None):
+    self.name = name
+    self.args = list(args)
+    self.key = key
+    self.attempts = attempts
+    self.enqueued_at = enqueued_at or time.time()
+
+  def to_json(self):
+    return json.dumps({'name': self.name, 'args': self.args, 'key': self.key,
+                       'attempts': self.attempts, 'enqueued_at': self.enqueued_at})
+
+  @classmethod
+  def from_json(cls, text):
+    return cls(**json.loads(text))
+
+
+class JobQueue(object):
+  """Background jobs run by a pool of worker threads in this process.
+
+  Handlers are registered by name with `handler()` and run inside
+  `context()` (an app context, say). A job whose handler raises is retried
+  `retries` times with exponential backoff, then kept in the dead-letter
+  store. Jobs enqueued with a `key` already seen in the last `key_ttl`
+  seconds are dropped, so a double-submitted form does its work once.
+
+  With `workers=0` jobs run inline in enqueue(), which is handy in shells
+  and scripts.
+  """
+
+  def __init__(self, workers=2, retries=3, backoff=0.5, dead_size=1000, key_ttl=3600,
+               context=None):
+    self.workers = workers
+    self.retries = retries
+    self.backoff = backoff
+    self.key_ttl = key_ttl
+    self.context = context
+    self.handlers = {}
+    self.dead = deque(maxlen=dead_size)
+    self.counts = dict.fromkeys(('enqueued', 'duplicates', 'succeeded', 'retried', 'dead'), 0)
+    self.in_flight = 0
+    self.delayed = 0
+    self._queue = queue.Queue()
+    self._seen = LRUCache(100000, key_ttl)
+    self._lock = threading.Lock()
+    self._pid = None
+
+  def handler(self, name):
+    def register(fn):
+      self.handlers[name] = fn
+      return fn
+    return register
+
+  def enqueue(self, name, *args, key=None):
+    """Queue `name(*args)`; False when `key` shows it was already queued."""
+    if key is not None and not self._claim(key):
+      self._count('duplicates')
+      return False
+    self._count('enqueued')
+    job = Job(name, args, key)
+    if self.workers:
+      self._put(job)
+    else:
+      self.run(job)
+    return True
+
+  def run(self, job):
+    with self._lock:
+      self.in_flight += 1
+    try:
+      fn = self.handlers.get(job.name)
+      if fn is None:
+        raise LookupError('no handler for job %r' % job.name)
+      if self.context is not None:
+        with self.context():
+          fn(*job.args)
+      else:
+        fn(*job.args)
+    except Exception:
+      self._failed(job, traceback.format_exc())
+    else:
+      self._count('succeeded')
+    finally:
+      with self._lock:
+        self.in_flight -= 1
+
+  def depth(self):
+    return self._queue.qsize() + self.delayed
+
+  def stats(self):
+    with self._lock:
+      data = dict(self.counts)
+      data.update(pid=os.getpid(), depth=self.depth(), in_flight=self.in_flight,
+                  delayed=self.delayed, dead_stored=len(self.dead))
+    return data
+
+  def drain(self, timeout=None):
+    """Wait until nothing is queued, delayed or running; False on timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while self._pending():
+      if deadline is not None and time.monotonic() > deadline:
+        return False
+      time.sleep(0.01)
+    return True
+
+  def dead_jobs(self):
+    return list(self.dead)
+
+  def retry_dead(self):
+    """Queue every dead job again, with a fresh set of retries."""
+    jobs, count = self._take_dead(), 0
+    for entry in jobs:
+      self._put(Job(entry['name'], entry['args'], entry['key']))
+      count += 1
+    return count
+
+  def _pending(self):
+    # unfinished_tasks also covers a job taken off the queue but not yet
+    # counted as in flight.
+    return self._queue.unfinished_tasks or self.delayed or self.in_flight
+
+  def _count(self, name):
+    with self._lock:
+      self.counts[name] += 1
+
+  def _claim(self, key):
+    with self._lock:
+      if self._seen.get(key):
+        return False
+      self._seen.set(key, True)
+      return True
+
+  def _put(self, job):
+    self._start()
+    self._queue.put(job)
+
+  def _start(self):
+    # Threads do not survive a fork, so a worker process forked from a
+    # preloaded app starts its own on first use.
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      self._queue = queue.Queue()
+    for n in range(self.workers):
+      thread = threading.Thread(target=self._work, name='jobs-%d' % n)
+      thread.daemon = True
+      thread.start()
+
+  def _work(self):
+    while True:
+      job = self._queue.get()
+      try:
+        self.run(job)
+      finally:
+        self._queue.task_done()
+
+  def _failed(self, job, error):
+    job.attempts += 1
+    if job.attempts <= self.retries:
+      self._count('retried')
+      self._retry_later(job, self.backoff * 2 ** (job.attempts - 1))
+    else:
+      self._count('dead')
+      logger.error('Job %s%r failed %d times:\n%s', job.name, tuple(job.args), job.attempts, error)
+      self._bury({'name': job.name, 'args': job.args, 'key': job.key, 'attempts': job.attempts,
+                  'error': error, 'failed_at': time.time()})
+
+  def _retry_later(self, job, delay):
+    with self._lock:
+      self.delayed += 1
+
+    def put():
+      with self._lock:
+        self.delayed -= 1
+      self._put(job)
+
+    timer = threading.Timer(delay, put)
+    timer.daemon = True
+    timer.start()
+
+  def _bury(self, entry):
+    self.dead.append(entry)
+
+  def _take_dead(self):
+    with self._lock:
+      jobs = list(self.dead)
+      self.dead.clear()
+    return jobs
+
+
+class RedisJobQueue(JobQueue):
+  """A JobQueue kept on a Redis-compatible server.
+
+  Web workers only enqueue; `work()`, run by `flask work-jobs` in one or
+  more separate processes, takes jobs off the list. Retries wait in a
+  sorted set scored by when they are due, and dead jobs stay in a capped
+  list, so both survive restarts. Needs the optional `redis` package, and
+  job arguments must be JSON.
+  """
+
+  def __init__(self, url, prefix='fyyur:jobs:', dead_size=1000, **options):
+    import redis
+    super(RedisJobQueue, self).__init__(dead_size=dead_size, **options)
+    self.prefix = prefix
+    self.dead_size = dead_size
+    self._redis = redis.Redis.from_url(url)
+
+  def depth(self):
+    return self._redis.llen(self.prefix + 'ready') + self._redis.zcard(self.prefix + 'delayed')
+
+  def stats(self):
+    data = super(RedisJobQueue, self).stats()
+    data['delayed'] = self._redis.zcard(self.prefix + 'delayed')
+    data['dead_stored'] = self._redis.llen(self.prefix + 'dead')
+    return data
+
+  def dead_jobs(self):
+    return [json.loads(entry) for entry in self._redis.lrange(self.prefix + 'dead', 0, -1)]
+
+  def _pending(self):
+    return self.depth() or self.in_flight
+
+  def work(self, burst=False, poll=1):
+    """Run jobs as they arrive; with `burst`, stop once none are left."""
+    while True:
+      self._promote()
+      item = self._redis.brpop(self.prefix + 'ready', timeout=poll)
+      if item is not None:
+        self.run(Job.from_json(item[1]))
+      elif burst and not self._redis.zcard(self.prefix + 'delayed'):
+        return
+
+  def _claim(self, key):
+    return bool(self._redis.set(self.prefix + 'key:' + key, 1, nx=True, ex=self.key_ttl))
+
+  def _put(self, job):
+    self._redis.lpush(self.prefix + 'ready', job.to_json())
+
+  def _retry_later(self, job, delay):
+    self._redis.zadd(self.prefix + 'delayed', {job.to_json(): time.time() + delay})
+
+  def _promote(self):
+    # Move retries that are due back onto the ready list. ZREM decides which
+    # worker moves a job, so each is moved once.
+    for entry in self._redis.zrangebyscore(self.prefix + 'delayed', 0, time.time()):
+      if self._redis.zrem(self.prefix + 'delayed', entry):
+        self._redis.lpush(self.prefix + 'ready', entry)
+
+  def _bury(self, entry):
+    pipe = self._redis.pipeline()
+    pipe.lpush(self.prefix + 'dead', json.dumps(entry))
+    pipe.ltrim(self.prefix + 'dead', 0, self.dead_size - 1)
+    pipe.execute()
+
+  def _take_dead(self):
+    pipe = self._redis.pipeline()
+    pipe.lrange(self.prefix + 'dead', 0, -1)
+    pipe.delete(self.prefix + 'dead')
+    entries, _ = pipe.execute()
+    return [json.loads(entry) for entry in entries]
+
+
+def make_queue(url=None, **options):
+  """An in-process JobQueue, or a RedisJobQueue when `url` names a server."""
+  if url:
+    return RedisJobQueue(url, **options)
+  return JobQueue(**options)
@@ -0,0 +1,217 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Request and render latencies, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(object):
+  def __init__(self, registry, kind, name, help, labels=(), buckets=None, parts=None):
+    self.registry = registry
+    self.kind = kind
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self.buckets = tuple(buckets) if buckets else None
+    self.parts = parts
+
+  def inc(self, *labels, amount=1):
+    self.registry._add(self.name, labels, amount)
+
+  def set(self, value, *labels):
+    # For gauges, and for counters mirroring a total kept elsewhere.
+    self.registry._set(self.name, labels, value)
+
+  def observe(self, value, *labels):
+    self.registry._observe(self.name, labels, bisect.bisect_left(self.buckets, value),
+                           len(self.buckets), value)
+
+
+class Registry(object):
+  """Counters, gauges and histograms in Prometheus' text format.
+
+  Updates only touch a dict in this process. With `directory`, each worker
+  process also writes its values to `<directory>/<pid>.json`, at most every
+  `flush_interval` seconds, and render() adds up the files of every worker,
+  so any worker can answer a scrape for all of them. Counters and
+  histograms of exited workers keep counting; their gauges are dropped.
+  The directory must be emptied when the server (re)starts.
+  """
+
+  def __init__(self, directory=None, flush_interval=1.0):
+    self.directory = directory
+    self.flush_interval = flush_interval
+    self.metrics = {}
+    self.collectors = []
+    self._values = {}
+    self._lock = threading.Lock()
+    self._flushed = 0.0
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+
+  def counter(self, name, help, labels=()):
+    return self._define('counter', name, help, labels)
+
+  def gauge(self, name, help, labels=()):
+    return self._define('gauge', name, help, labels)
+
+  def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return self._define('histogram', name, help, labels, buckets)
+
+  def ratio(self, name, help, numerator, denominator):
+    """A gauge worked out at scrape time as numerator / (numerator + denominator).
+
+    Both are counters with the same labels; the ratio is taken over their
+    totals from every worker, so it never averages per-worker ratios.
+    """
+    return self._define('gauge', name, help, self.metrics[numerator].labels,
+                        parts=(numerator, denominator))
+
+  def collector(self, fn):
+    """Register `fn` to refresh values kept elsewhere before each flush and scrape."""
+    self.collectors.append(fn)
+    return fn
+
+  def flush(self, force=False):
+    if not self.directory:
+      return
+    now = time.monotonic()
+    if not force and now - self._flushed < self.flush_interval:
+      return
+    self._flushed = now
+    self._collect()
+    path = os.path.join(self.directory, '%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as stream:
+      json.dump(self._snapshot(), stream)
+    os.replace(path + '.tmp', path)
+
+  def render(self):
+    self._collect()
+    values = self._merged()
+    for metric in self.metrics.values():
+      if metric.parts:
+        values.update(_ratios(metric, values))
+    lines = []
+    for metric in self.metrics.values():
+      lines.append('# HELP %s %s' % (metric.name, metric.help))
+      lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+      for (name, labels), value in sorted(values.items()):
+        if name != metric.name:
+          continue
+        pairs = list(zip(metric.labels, labels))
+        if metric.kind != 'histogram':
+          lines.append('%s%s %s' % (name, _labels(pairs), _number(value)))
+          continue
+        cumulative = 0
+        for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+          cumulative += count
+          lines.append('%s_bucket%s %s' % (name, _labels(pairs + [('le', _number(bound))]), _number(cumulative)))
+        lines.append('%s_sum%s %s' % (name, _labels(pairs), _number(value[-2])))
+        lines.append('%s_count%s %s' % (name, _labels(pairs), _number(value[-1])))
+    return '\n'.join(lines) + '\n'
+
+  def totals(self, name):
+    """{labels: value} of one counter or gauge over every worker."""
+    self._collect()
+    return dict((labels, value) for (metric, labels), value in self._merged().items() if metric == name)
+
+  def _define(self, kind, name, help, labels, buckets=None, parts=None):
+    metric = self.metrics[name] = Metric(self, kind, name, help, labels, buckets, parts)
+    return metric
+
+  def _add(self, name, labels, amount):
+    key = (name, tuple(str(label) for label in labels))
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def _set(self, name, labels, value):
+    key = (name, tuple(str(label) for label in labels))
+    with self._lock:
+      self._values[key] = value
+
+  def _observe(self, name, labels, bucket, buckets, value):
+    # Per-bucket counts (made cumulative on output), then sum and count.
+    key = (name, tuple(str(label) for label in labels))
+    with self._lock:
+      entry = self._values.get(key)
+      if entry is None:
+        entry = self._values[key] = [0] * (buckets + 3)
+      entry[bucket] += 1
+      entry[-2] += value
+      entry[-1] += 1
+
+  def _collect(self):
+    for fn in self.collectors:
+      fn()
+
+  def _snapshot(self):
+    with self._lock:
+      return [[name, list(labels), value] for (name, labels), value in self._values.items()]
+
+  def _merged(self):
+    with self._lock:
+      merged = dict((key, list(value) if isinstance(value, list) else value)
+                    for key, value in self._values.items())
+    if not self.directory:
+      return merged
+    for path in glob.glob(os.path.join(self.directory, '*.json')):
+      pid = int(os.path.basename(path).split('.')[0])
+      if pid == os.getpid():
+        continue
+      try:
+        with open(path) as stream:
+          entries = json.load(stream)
+      except (IOError, ValueError):
+        continue
+      alive = _alive(pid)
+      for name, labels, value in entries:
+        metric = self.metrics.get(name)
+        if metric is None or (metric.kind == 'gauge' and not alive):
+          continue
+        key = (name, tuple(labels))
+        if isinstance(value, list):
+          current = merged.setdefault(key, [0] * len(value))
+          for n, item in enumerate(value):
+            current[n] += item
+        else:
+          merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _ratios(metric, values):
+  numerator, denominator = metric.parts
+  ratios = {}
+  for (name, labels), value in values.items():
+    if name == numerator:
+      total = value + values.get((denominator, labels), 0)
+      ratios[(metric.name, labels)] = value / total if total else 0.0
+  return ratios
+
+
+def _alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+def _labels(pairs):
+  if not pairs:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                           for key, value in pairs)
+
+
+def _number(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float) and not value.is_integer():
+    return repr(value)
+  return str(int(value))
@@ -0,0 +1,54 @@
+"""full-text search vectors for venues and artists
+
+Revision ID: 3f6d2a8c1b4e
+Revises: 9b1e4f7a2c3d
+Create Date: 2026-10-18 10:02:17.884106
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6d2a8c1b4e'
+down_revision = '9b1e4f7a2c3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.add_column('Artist', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    op.execute('''
+    CREATE OR REPLACE FUNCTION fyyur_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+      NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+      RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''')
+    for table in ('Venue', 'Artist'):
+        op.execute('''
+        CREATE TRIGGER "{0}_search_vector" BEFORE INSERT OR UPDATE OF name, city, state, genres
+        ON "{0}" FOR EACH ROW EXECUTE PROCEDURE fyyur_search_vector_update()
+        '''.format(table))
+        # Fire the trigger once for every existing row.
+        op.execute('UPDATE "{0}" SET name = name'.format(table))
+
+    op.create_index('ix_Venue_search_vector', 'Venue', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_search_vector', 'Artist', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_Artist_search_vector', table_name='Artist')
+    op.drop_index('ix_Venue_search_vector', table_name='Venue')
+    op.execute('DROP TRIGGER "Artist_search_vector" ON "Artist"')
+    op.execute('DROP TRIGGER "Venue_search_vector" ON "Venue"')
+    op.execute('DROP FUNCTION fyyur_search_vector_update()')
+    op.drop_column('Artist', 'search_vector')
+    op.drop_column('Venue', 'search_vector')
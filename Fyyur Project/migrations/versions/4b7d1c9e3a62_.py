@@ -0,0 +1,58 @@
+"""timezone-aware show times and venue timezones
+
+Revision ID: 4b7d1c9e3a62
+Revises: e61f0a3b9d27
+Create Date: 2026-10-18 16:12:08.734215
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7d1c9e3a62'
+down_revision = 'e61f0a3b9d27'
+branch_labels = None
+depends_on = None
+
+# Existing naive times are wall-clock times of the zone the app ran in.
+LEGACY_TIMEZONE = os.environ.get('FYYUR_LEGACY_TIMEZONE', 'UTC')
+
+COLUMNS = (('Show', 'start_time', False), ('Venue', 'next_show_at', True),
+           ('Artist', 'next_show_at', True))
+
+DIRECTORY = '''
+    CREATE MATERIALIZED VIEW "VenueDirectory" AS
+    SELECT city, state,
+           json_agg(json_build_object('id', id, 'name', name,
+                                      'upcoming_show_count', upcoming_show_count,
+                                      'next_show_at', next_show_at) ORDER BY id) AS venues,
+           count(*) AS venue_count,
+           max(updated_at) AS updated_at
+    FROM "Venue" GROUP BY city, state
+    '''
+
+
+def retype(type_, timezone):
+    # The directory view reads next_show_at, so it is rebuilt around the change.
+    op.execute('DROP MATERIALIZED VIEW "VenueDirectory"')
+    for table, column, nullable in COLUMNS:
+        op.alter_column(table, column, type_=type_, existing_nullable=nullable,
+                        postgresql_using='"%s" AT TIME ZONE \'%s\'' % (column, timezone))
+    op.execute(DIRECTORY)
+    op.execute('CREATE UNIQUE INDEX "ix_VenueDirectory_area" ON "VenueDirectory" (city, state)')
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('timezone', sa.String(length=64), nullable=False,
+                                     server_default='UTC'))
+    # Existing venues keep showing the times they were entered with.
+    op.execute(sa.text('UPDATE "Venue" SET timezone = :zone').bindparams(zone=LEGACY_TIMEZONE))
+    retype(sa.DateTime(timezone=True), LEGACY_TIMEZONE)
+
+
+def downgrade():
+    retype(sa.DateTime(), LEGACY_TIMEZONE)
+    op.drop_column('Venue', 'timezone')
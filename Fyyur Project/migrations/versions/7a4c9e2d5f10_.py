@@ -0,0 +1,29 @@
+"""updated_at on venues, artists and shows
+
+Revision ID: 7a4c9e2d5f10
+Revises: 3f6d2a8c1b4e
+Create Date: 2026-10-18 11:24:05.310472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4c9e2d5f10'
+down_revision = '3f6d2a8c1b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                       server_default=sa.text("timezone('utc', now())")))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,58 @@
+"""show end times and booking exclusion constraints
+
+Revision ID: 8e3f5a1d6c04
+Revises: 4b7d1c9e3a62
+Create Date: 2026-10-18 17:40:51.208337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3f5a1d6c04'
+down_revision = '4b7d1c9e3a62'
+branch_labels = None
+depends_on = None
+
+# Kept in step with SHOW_DEFAULT_MINUTES; existing shows are booked this long.
+DEFAULT_MINUTES = 120
+
+OVERLAPS = '''
+    SELECT a.id, b.id FROM "Show" a JOIN "Show" b
+      ON a.%s = b.%s AND a.id < b.id AND a.booked && b.booked
+    LIMIT 20
+    '''
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+    op.execute('UPDATE "Show" SET end_time = start_time + interval \'%d minutes\'' % DEFAULT_MINUTES)
+    op.alter_column('Show', 'end_time', nullable=False)
+    op.create_check_constraint('Show_end_after_start', 'Show', 'end_time > start_time')
+    # Generated columns need Postgres 12.
+    op.execute('ALTER TABLE "Show" ADD COLUMN booked tstzrange '
+               'GENERATED ALWAYS AS (tstzrange(start_time, end_time)) STORED')
+
+    # Exclusion constraints cannot be added NOT VALID, so existing double
+    # bookings have to be resolved first.
+    connection = op.get_bind()
+    for column in ('venue_id', 'artist_id'):
+        pairs = connection.execute(sa.text(OVERLAPS % (column, column))).fetchall()
+        if pairs:
+            raise RuntimeError('Shows overlapping on %s, e.g. (%s); move or shorten them and upgrade again'
+                               % (column, '), ('.join('%d, %d' % tuple(pair) for pair in pairs)))
+
+    op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_venue_booking_excl" '
+               'EXCLUDE USING gist (venue_id WITH =, booked WITH &&)')
+    op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_artist_booking_excl" '
+               'EXCLUDE USING gist (artist_id WITH =, booked WITH &&)')
+
+
+def downgrade():
+    op.drop_constraint('Show_artist_booking_excl', 'Show')
+    op.drop_constraint('Show_venue_booking_excl', 'Show')
+    op.drop_column('Show', 'booked')
+    op.drop_constraint('Show_end_after_start', 'Show')
+    op.drop_column('Show', 'end_time')
@@ -0,0 +1,30 @@
+"""drop the trigram name indexes
+
+Revision ID: b5d0e7c3f812
+Revises: 8e3f5a1d6c04
+Create Date: 2026-10-19 10:06:27.514902
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d0e7c3f812'
+down_revision = '8e3f5a1d6c04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Search matches search_vector since full-text search; nothing runs
+    # `name ILIKE` any more, and the indexes only slowed down writes.
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
+
+
+def downgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
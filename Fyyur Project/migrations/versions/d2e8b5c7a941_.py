@@ -0,0 +1,38 @@
+"""show counters on venues and artists
+
+Revision ID: d2e8b5c7a941
+Revises: 7a4c9e2d5f10
+Create Date: 2026-10-18 13:40:52.076318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2e8b5c7a941'
+down_revision = '7a4c9e2d5f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_show_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_show_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('next_show_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f('ix_{}_next_show_at'.format(table)), table, ['next_show_at'], unique=False)
+        op.execute('''
+        UPDATE "{0}" SET
+          upcoming_show_count = (SELECT count(*) FROM "Show" WHERE "Show".{1} = "{0}".id AND start_time >= now()),
+          past_show_count = (SELECT count(*) FROM "Show" WHERE "Show".{1} = "{0}".id AND start_time < now()),
+          next_show_at = (SELECT min(start_time) FROM "Show" WHERE "Show".{1} = "{0}".id AND start_time >= now())
+        '''.format(table, column))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index(op.f('ix_{}_next_show_at'.format(table)), table_name=table)
+        op.drop_column(table, 'next_show_at')
+        op.drop_column(table, 'past_show_count')
+        op.drop_column(table, 'upcoming_show_count')
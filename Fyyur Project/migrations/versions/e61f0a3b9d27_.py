@@ -0,0 +1,35 @@
+"""materialized venue directory
+
+Revision ID: e61f0a3b9d27
+Revises: d2e8b5c7a941
+Create Date: 2026-10-18 14:55:30.418962
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61f0a3b9d27'
+down_revision = 'd2e8b5c7a941'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+    CREATE MATERIALIZED VIEW "VenueDirectory" AS
+    SELECT city, state,
+           json_agg(json_build_object('id', id, 'name', name,
+                                      'upcoming_show_count', upcoming_show_count,
+                                      'next_show_at', next_show_at) ORDER BY id) AS venues,
+           count(*) AS venue_count,
+           max(updated_at) AS updated_at
+    FROM "Venue" GROUP BY city, state
+    ''')
+    # A unique index is what allows REFRESH ... CONCURRENTLY.
+    op.execute('CREATE UNIQUE INDEX "ix_VenueDirectory_area" ON "VenueDirectory" (city, state)')
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW "VenueDirectory"')
@@ -0,0 +1,44 @@
+"""deletion counters for the page validators
+
+Revision ID: f4a9c2e6d815
+Revises: b5d0e7c3f812
+Create Date: 2026-10-19 11:32:50.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a9c2e6d815'
+down_revision = 'b5d0e7c3f812'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    op.create_table('Deletions',
+                    sa.Column('table_name', sa.String(length=64), nullable=False),
+                    sa.Column('count', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('table_name'))
+    op.execute('''
+        CREATE OR REPLACE FUNCTION fyyur_count_deletions() RETURNS trigger AS $$
+        BEGIN
+          INSERT INTO "Deletions" (table_name, count) VALUES (TG_TABLE_NAME, 1)
+          ON CONFLICT (table_name) DO UPDATE SET count = "Deletions".count + 1;
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''')
+    for table in TABLES:
+        op.execute('CREATE TRIGGER "%s_deletions" AFTER DELETE OR TRUNCATE ON "%s" '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE fyyur_count_deletions()' % (table, table))
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute('DROP TRIGGER "%s_deletions" ON "%s"' % (table, table))
+    op.execute('DROP FUNCTION fyyur_count_deletions()')
+    op.drop_table('Deletions')
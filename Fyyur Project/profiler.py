@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class Profile(object):
+  """Stack samples of one request's thread, in the collapsed-stack format.
+
+  Each line of the output is a stack, outermost frame first and frames
+  joined by ';', followed by how many samples found it. flamegraph.pl,
+  speedscope and inferno all read it.
+  """
+
+  def __init__(self, thread_id, name, max_samples):
+    self.thread_id = thread_id
+    self.name = name
+    self.max_samples = max_samples
+    self.samples = 0
+    self.stacks = Counter()
+    self.started = time.perf_counter()
+
+  def sample(self, frame):
+    if self.samples >= self.max_samples:
+      return
+    self.samples += 1
+    self.stacks[stack(frame)] += 1
+
+  def collapsed(self):
+    return ''.join('%s %d\n' % (line, count) for line, count in self.stacks.most_common())
+
+
+def stack(frame):
+  frames = []
+  while frame is not None:
+    code = frame.f_code
+    # The function's first line, not the current one, so one function is
+    # one frame however far into it the sample landed.
+    frames.append('%s (%s:%d)' % (code.co_name, short_path(code.co_filename), code.co_firstlineno))
+    frame = frame.f_back
+  return ';'.join(reversed(frames))
+
+
+def short_path(path):
+  # site-packages/sqlalchemy/orm/loading.py reads better as sqlalchemy/orm/loading.py.
+  for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+    if marker in path:
+      return path.split(marker, 1)[1]
+  return os.path.basename(path)
+
+
+class Sampler(object):
+  """Samples the stacks of profiled request threads from one background thread.
+
+  The requests themselves run no profiling code between start() and
+  stop(); the cost is this thread waking every `interval` seconds while a
+  profile is open, and at most `max_active` profiles are open at once.
+  """
+
+  def __init__(self, directory, interval=0.005, max_samples=2000, max_active=2, keep=200):
+    self.directory = directory
+    self.interval = interval
+    self.max_samples = max_samples
+    self.max_active = max_active
+    self.keep = keep
+    self._active = {}
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._thread = None
+    self._pid = None
+
+  def start(self, name):
+    """Profile the calling thread; None when max_active profiles are open."""
+    profile = Profile(threading.get_ident(), name, self.max_samples)
+    with self._lock:
+      if len(self._active) >= self.max_active:
+        return None
+      self._active[profile.thread_id] = profile
+      self._ensure_thread()
+    self._wake.set()
+    return profile
+
+  def stop(self, profile):
+    """Stop sampling and write the profile; returns the file's path."""
+    with self._lock:
+      self._active.pop(profile.thread_id, None)
+    if not profile.samples:
+      return None
+    os.makedirs(self.directory, exist_ok=True)
+    path = os.path.join(self.directory, '%s-%d-%s.folded' % (
+      time.strftime('%Y%m%dT%H%M%S'), os.getpid(), profile.name))
+    with open(path, 'w') as stream:
+      stream.write(profile.collapsed())
+    self._prune()
+    return path
+
+  def _ensure_thread(self):
+    # After a fork (gunicorn workers) the parent's thread is gone.
+    if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+      self._pid = os.getpid()
+      self._thread = threading.Thread(target=self._run, name='fyyur-profiler', daemon=True)
+      self._thread.start()
+
+  def _run(self):
+    while True:
+      with self._lock:
+        idle = not self._active
+        if idle:
+          self._wake.clear()
+      if idle:
+        self._wake.wait()
+        continue
+      time.sleep(self.interval)
+      frames = sys._current_frames()
+      with self._lock:
+        for thread_id, profile in self._active.items():
+          frame = frames.get(thread_id)
+          if frame is not None:
+            profile.sample(frame)
+
+  def _prune(self):
+    # Keep only the newest `keep` profiles.
+    names = sorted(name for name in os.listdir(self.directory) if name.endswith('.folded'))
+    for name in names[:-self.keep]:
+      try:
+        os.remove(os.path.join(self.directory, name))
+      except OSError:
+        pass
@@ -0,0 +1,90 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+
+
+class ReplicaSet(object):
+  """Round-robin over read replicas, skipping ones that recently failed.
+
+  A replica is taken out of rotation when connecting to it fails or its
+  connection drops, and is probed with SELECT 1 again once `retry_after`
+  seconds have passed. A statement that fails on a live connection (a
+  statement timeout, say) leaves the replica in rotation. `choose()` returns
+  None when no replica is healthy, and callers fall back to the primary.
+  """
+
+  def __init__(self, engines, retry_after=30):
+    self.engines = list(engines)
+    self.retry_after = retry_after
+    self._down = {}
+    self._turn = itertools.count()
+    self._lock = threading.Lock()
+    for engine in self.engines:
+      event.listen(engine, 'handle_error', self._handle_error)
+
+  def choose(self):
+    for _ in range(len(self.engines)):
+      engine = self.engines[next(self._turn) % len(self.engines)]
+      with self._lock:
+        down_since = self._down.get(engine)
+      if down_since is None:
+        return engine
+      if time.monotonic() - down_since >= self.retry_after and self.ping(engine):
+        return engine
+    return None
+
+  def ping(self, engine):
+    try:
+      with engine.connect() as connection:
+        connection.execute('SELECT 1')
+    except exc.DBAPIError:
+      self.mark_down(engine)
+      return False
+    with self._lock:
+      self._down.pop(engine, None)
+    return True
+
+  def mark_down(self, engine):
+    with self._lock:
+      self._down[engine] = time.monotonic()
+
+  def is_down(self, engine):
+    with self._lock:
+      return engine in self._down
+
+  def healthy(self):
+    with self._lock:
+      return [engine for engine in self.engines if engine not in self._down]
+
+  def _handle_error(self, context):
+    if connection_error(context):
+      self.mark_down(context.engine)
+
+
+def connection_error(context):
+  # A dropped connection, or one that could not be made: errors raised while
+  # connecting come without a connection.
+  return context.is_disconnect or context.connection is None
+
+
+class RoutingSession(SignallingSession):
+  """Sends a request's statements to the replica in `g.db_replica`, if any.
+
+  Flushes always go to the primary.
+  """
+
+  def get_bind(self, mapper=None, clause=None):
+    if not self._flushing and has_app_context():
+      replica = g.get('db_replica')
+      if replica is not None:
+        return replica
+    return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
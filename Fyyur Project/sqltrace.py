@@ -0,0 +1,117 @@
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+from sqlalchemy import event
+
+# Literals and placeholders collapse to "?", and IN lists to one element, so
+# the same statement with different values shares a fingerprint.
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\?")
+IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+  text = LITERALS.sub('?', statement)
+  text = IN_LISTS.sub('(?)', text)
+  return SPACES.sub(' ', text).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+
+class RequestTrace(object):
+  """The statements one request ran: how many, how long, and which repeat.
+
+  A fingerprint run `n_plus_one` times or more in one request is reported
+  as a likely N+1: the same query issued per row of an earlier one.
+  """
+
+  def __init__(self, n_plus_one=5):
+    self.n_plus_one_threshold = n_plus_one
+    self.started = time.perf_counter()
+    self.statements = []
+    self.db_time = 0.0
+    self.fingerprints = Counter()
+
+  def record(self, statement, seconds):
+    self.statements.append((seconds, statement))
+    self.db_time += seconds
+    self.fingerprints[fingerprint(statement)] += 1
+
+  @property
+  def count(self):
+    return len(self.statements)
+
+  def elapsed(self):
+    return time.perf_counter() - self.started
+
+  def slowest(self, n=3):
+    return sorted(self.statements, key=lambda entry: entry[0], reverse=True)[:n]
+
+  def repeated(self):
+    return [(text, count) for text, count in self.fingerprints.most_common() if count > 1]
+
+  def n_plus_one(self):
+    return [(text, count) for text, count in self.repeated() if count >= self.n_plus_one_threshold]
+
+  def server_timing(self):
+    return 'db;dur=%.1f;desc="%d queries", app;dur=%.1f' % (
+      self.db_time * 1000, self.count, self.elapsed() * 1000)
+
+  def summary(self, slowest=3, text_length=200):
+    return {
+      'statements': self.count,
+      'db_ms': round(self.db_time * 1000, 2),
+      'total_ms': round(self.elapsed() * 1000, 2),
+      'slowest': [{'ms': round(seconds * 1000, 2), 'statement': statement[:text_length]}
+                  for seconds, statement in self.slowest(slowest)],
+      'repeated': [{'fingerprint': text[:text_length], 'count': count}
+                   for text, count in self.repeated()],
+      'n_plus_one': [{'fingerprint': text[:text_length], 'count': count}
+                     for text, count in self.n_plus_one()],
+    }
+
+  def check_budget(self, budget, name):
+    if budget is not None and self.count > budget:
+      raise QueryBudgetExceeded('%s ran %d statements, over its budget of %d:\n%s' % (
+        name, self.count, budget, '\n'.join(
+          '  %dx %s' % (count, text) for text, count in self.fingerprints.most_common())))
+
+
+def trace_engine(engine, current):
+  """Record every statement on `engine` into the trace `current()` returns.
+
+  Statements run while `current()` is None (outside a request, in jobs) are
+  not recorded. Transaction-local SET statements are connection setup, not
+  queries, and are skipped.
+  """
+
+  @event.listens_for(engine, 'before_cursor_execute')
+  def start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('sql_trace_start', []).append(time.perf_counter())
+
+  @event.listens_for(engine, 'after_cursor_execute')
+  def stop(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['sql_trace_start'].pop()
+    trace = current()
+    if trace is not None and not statement.startswith('SET '):
+      trace.record(statement, seconds)
+
+  @event.listens_for(engine, 'handle_error')
+  def failed(context):
+    # A failed statement never reaches after_cursor_execute.
+    starts = context.connection.info.get('sql_trace_start') if context.connection is not None else None
+    if starts:
+      starts.pop()
+
+
+def query_budget(budget):
+  """Declare the most statements a view may run per request."""
+  def declare(view):
+    view.query_budget = budget
+    return view
+  return declare
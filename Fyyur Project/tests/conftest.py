@@ -0,0 +1,120 @@
+"""Fixtures for the Fyyur tests.
+
+Tests using the `app` fixture run against the scratch Postgres database
+named by ``FYYUR_TEST_DATABASE_URL``, which they empty, and are skipped
+without it. The database needs the btree_gist extension available:
+
+    $ createdb fyyur_test
+    $ FYYUR_TEST_DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+TEST_DATABASE_URL = os.environ.get('FYYUR_TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+  os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+# Jobs run inline, so a response is only sent once its follow-up work is done.
+os.environ.setdefault('JOB_WORKERS', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+
+from app import app as fyyur, db, Venue, Artist, page_cache, suggest_cache
+
+
+@pytest.fixture(scope='session')
+def database():
+  if not TEST_DATABASE_URL:
+    pytest.skip('FYYUR_TEST_DATABASE_URL is not set')
+  with fyyur.app_context():
+    db.session.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    db.session.commit()
+    db.drop_all()
+    db.create_all()
+  return db
+
+
+@pytest.fixture
+def app(database):
+  fyyur.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+  with fyyur.app_context():
+    yield fyyur
+    db.session.remove()
+    db.session.execute('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY CASCADE')
+    db.session.execute('REFRESH MATERIALIZED VIEW "VenueDirectory"')
+    db.session.commit()
+  page_cache.clear()
+  suggest_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+
+@pytest.fixture
+def venue(app):
+  venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                phone='123-123-1234', genres=['Jazz'], seeking_talent=False,
+                timezone='America/Los_Angeles')
+  db.session.add(venue)
+  db.session.commit()
+  return venue
+
+
+@pytest.fixture
+def artist(app):
+  artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', phone='326-123-5000',
+                  genres=['Rock n Roll'], seeking_venue=True)
+  db.session.add(artist)
+  db.session.commit()
+  return artist
+
+
+@pytest.fixture
+def session_timezone(app):
+  # Connections whose TimeZone is far from UTC, as a server's might be.
+  def set_timezone(connection, record):
+    cursor = connection.cursor()
+    cursor.execute("SET TIME ZONE 'Pacific/Auckland'")
+    cursor.close()
+
+  event.listen(db.engine, 'connect', set_timezone)
+  db.engine.dispose()
+  yield
+  event.remove(db.engine, 'connect', set_timezone)
+  db.engine.dispose()
+
+
+def asgi_get(path, headers=()):
+  # One GET through asgi.py's application, on a pool opened for it:
+  # (status, headers, body).
+  from asgi import Application
+
+  async def run():
+    application = Application()
+    messages = []
+
+    async def receive():
+      return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+      messages.append(message)
+
+    await application.database.connect()
+    try:
+      await application({'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': path,
+                         'raw_path': path.encode(), 'root_path': '', 'scheme': 'http',
+                         'query_string': b'', 'headers': [(name.lower().encode(), value.encode())
+                                                          for name, value in headers],
+                         'server': ('localhost', 80), 'client': ('127.0.0.1', 1234)}, receive, send)
+    finally:
+      await application.database.close()
+    start, body = messages
+    return (start['status'], dict((name.decode(), value.decode()) for name, value in start['headers']),
+            body['body'])
+
+  return asyncio.run(run())
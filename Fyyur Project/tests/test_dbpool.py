@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from dbpool import InstrumentedQueuePool, pool_stats
+
+
+def counts():
+  snapshot = pool_stats.snapshot()
+  return snapshot['timeouts'], snapshot['connect_errors']
+
+
+def test_a_full_pool_times_out(tmp_path):
+  engine = create_engine('sqlite:///%s' % (tmp_path / 'pool.db'), poolclass=InstrumentedQueuePool,
+                         pool_size=1, max_overflow=0, pool_timeout=0.05)
+  timeouts, connect_errors = counts()
+  with engine.connect():
+    with pytest.raises(exc.TimeoutError):
+      engine.connect()
+  assert counts() == (timeouts + 1, connect_errors)
+
+
+def test_a_refused_connection_is_not_a_timeout():
+  engine = create_engine('sqlite:////nonexistent/directory/pool.db', poolclass=InstrumentedQueuePool)
+  timeouts, connect_errors = counts()
+  with pytest.raises(exc.OperationalError):
+    engine.connect()
+  assert counts() == (timeouts, connect_errors + 1)
@@ -0,0 +1,29 @@
+import json
+from datetime import datetime
+
+from app import db, Artist
+
+
+def exported(client, since):
+  response = client.get('/export/artists.ndjson', query_string={'since': since})
+  assert response.status_code == 200
+  return [json.loads(line)['name'] for line in response.data.decode('utf-8').splitlines()]
+
+
+def test_since_with_an_offset_is_compared_in_utc(client, artist, session_timezone):
+  db.session.execute(Artist.__table__.update().values(updated_at=datetime(2026, 1, 1, 12, 0)))
+  db.session.commit()
+  # 11:30 and 13:30 UTC.
+  assert exported(client, '2026-01-01T13:30:00+02:00') == ['Guns N Petals']
+  assert exported(client, '2026-01-01T11:30:00-02:00') == []
+
+
+def test_since_without_an_offset_is_utc(client, artist, session_timezone):
+  db.session.execute(Artist.__table__.update().values(updated_at=datetime(2026, 1, 1, 12, 0)))
+  db.session.commit()
+  assert exported(client, '2026-01-01T11:59:00') == ['Guns N Petals']
+  assert exported(client, '2026-01-01T12:01:00') == []
+
+
+def test_since_must_be_a_time(client):
+  assert client.get('/export/artists.csv?since=yesterday-ish').status_code == 400
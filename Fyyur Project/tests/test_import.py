@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from app import db, Venue
+from importer import run_import
+
+
+def venue_row(**values):
+  row = dict(name='The Dueling Pianos Bar', city='New York', state='NY', address='335 Delancey Street',
+             phone='914-003-1132', genres=['Jazz'], timezone='America/New_York', seeking_talent='No')
+  row.update(values)
+  return row
+
+
+def write_rows(path, rows):
+  path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+  return str(path)
+
+
+def errors(path):
+  with open(path + '.errors.ndjson') as stream:
+    return [json.loads(line) for line in stream]
+
+
+def test_a_row_taking_another_venues_phone_is_rejected_alone(app, venue, tmp_path):
+  other = Venue(name='Park Square Live Music & Coffee', city='San Francisco', state='CA',
+                address='34 Whiskey Moore Ave', phone='415-000-1234', genres=['Rock n Roll'],
+                seeking_talent=False, timezone='America/Los_Angeles')
+  db.session.add(other)
+  db.session.commit()
+  path = write_rows(tmp_path / 'venues.ndjson', [
+    venue_row(id=other.id, name='Park Square', phone=venue.phone),
+    venue_row()])
+  result = app.test_cli_runner().invoke(args=['import', 'venues', path])
+  assert result.exit_code == 0, result.output
+  assert '2 rows read, 1 loaded, 1 rejected' in result.output
+  assert [error['line'] for error in errors(path)] == [1]
+  db.session.expire_all()
+  assert sorted(venue.name for venue in Venue.query) == [
+    'Park Square Live Music & Coffee', 'The Dueling Pianos Bar', 'The Musical Hop']
+
+
+def test_a_resumed_import_reports_each_rejection_once(tmp_path):
+  path = write_rows(tmp_path / 'rows.ndjson', [{'ok': False}, {'ok': True}])
+  calls = []
+
+  def prepare(chunk):
+    return ([row for line, row in chunk if row['ok']],
+            [(line, 'not ok') for line, row in chunk if not row['ok']])
+
+  def load(records):
+    calls.append(records)
+    if len(calls) == 1:
+      raise RuntimeError('connection lost')
+
+  with pytest.raises(RuntimeError):
+    run_import(path, prepare, load, echo=lambda message: None)
+  run_import(path, prepare, load, echo=lambda message: None)
+  assert errors(path) == [{'line': 1, 'error': 'not ok'}]
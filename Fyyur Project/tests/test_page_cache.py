@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+import pytest
+
+import app as fyyur
+from app import db, Show, current_time, page_cache
+
+
+@pytest.fixture
+def queued_jobs(monkeypatch):
+  # A queue whose jobs have not run yet, as with a busy JOB_QUEUE_URL worker.
+  queued = []
+  monkeypatch.setattr(fyyur.jobs, 'enqueue', lambda name, *args, **kwargs: queued.append(name))
+  return queued
+
+
+def edit_venue(client, venue, **changes):
+  form = dict(name=venue.name, city=venue.city, state=venue.state, address=venue.address,
+              phone=venue.phone, genres=venue.genres, image_link='', facebook_link='', website='',
+              seeking_description='')
+  form.update(changes)
+  return client.post('/venues/%d/edit' % venue.id, data=form)
+
+
+def versions(venue):
+  return [page_cache.counter('version:venue:%s' % key) for key in (venue.id, '*')]
+
+
+def test_an_edit_bumps_page_versions_before_responding(client, venue, queued_jobs):
+  before = versions(venue)
+  edit_venue(client, venue, name='The Dueling Pianos Bar')
+  assert queued_jobs == ['venue_changed']
+  assert [version - 1 for version in versions(venue)] == before
+
+
+def test_an_edited_venue_page_is_not_served_from_the_cache(client, venue, queued_jobs):
+  assert b'The Musical Hop' in client.get('/venues/%d' % venue.id).data
+  assert edit_venue(client, venue, name='The Dueling Pianos Bar').status_code == 302
+  for _ in range(2):
+    page = client.get('/venues/%d' % venue.id).data
+    assert b'The Dueling Pianos Bar' in page
+    assert b'The Musical Hop' not in page
+
+
+def test_artist_pages_show_an_edited_venue_name(client, venue, artist, queued_jobs):
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=current_time() + timedelta(days=1)))
+  db.session.commit()
+  assert b'The Musical Hop' in client.get('/artists/%d' % artist.id).data
+  edit_venue(client, venue, name='The Dueling Pianos Bar')
+  assert b'The Dueling Pianos Bar' in client.get('/artists/%d' % artist.id).data
@@ -0,0 +1,24 @@
+import re
+from datetime import timedelta
+
+import pytest
+
+from app import db, Show, current_time
+
+
+@pytest.fixture
+def shows(venue, artist):
+  for day in range(1, 4):
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=current_time() + timedelta(days=day)))
+  db.session.commit()
+
+
+def load_more(page):
+  return re.findall(r'href="([^"]*cursor=[^"]*)"', page.decode('utf-8'))
+
+
+@pytest.mark.parametrize('path', ['/venues/1', '/artists/1', '/shows'])
+def test_load_more_keeps_the_page_size(client, shows, path):
+  links = load_more(client.get(path, query_string={'limit': 1}).data)
+  assert links and all('limit=1' in link for link in links)
+  assert all('limit' not in link for link in load_more(client.get(path).data))
@@ -0,0 +1,22 @@
+import pytest
+
+import app as fyyur
+
+
+@pytest.fixture
+def profiled(app, monkeypatch, tmp_path):
+  monkeypatch.setitem(app.config, 'PROFILE_TOKEN', 'bench')
+  monkeypatch.setitem(app.config, 'PROFILE_SAMPLE_RATE', 0)
+  monkeypatch.setattr(fyyur.profiler, 'directory', str(tmp_path))
+
+
+def test_the_token_asks_for_a_profile(client, profiled):
+  response = client.get('/', headers={'X-Fyyur-Profile': 'bench'})
+  assert response.status_code == 200
+  assert 'X-Fyyur-Profile' in response.headers
+
+
+def test_a_non_ascii_token_is_only_a_wrong_token(client, profiled):
+  response = client.get('/', headers={'X-Fyyur-Profile': 'b\xe9nch'})
+  assert response.status_code == 200
+  assert 'X-Fyyur-Profile' not in response.headers
@@ -0,0 +1,136 @@
+import pytest
+from sqlalchemy import create_engine, event, exc
+
+import app as fyyur
+from conftest import TEST_DATABASE_URL
+from routing import ReplicaSet
+
+
+class Statements(object):
+  """Counts the statements run on one engine."""
+
+  def __init__(self, engine):
+    self.engine = engine
+    self.count = 0
+    event.listen(engine, 'before_cursor_execute', self)
+
+  def __call__(self, *args, **kwargs):
+    self.count += 1
+
+
+# SQLite stand-ins: the replica set only needs engines that connect or fail.
+
+def sqlite_replica():
+  return create_engine('sqlite://')
+
+
+def unreachable_replica():
+  return create_engine('sqlite:////nonexistent/directory/replica.db')
+
+
+def test_replicas_take_turns():
+  first, second = sqlite_replica(), sqlite_replica()
+  replicas = ReplicaSet([first, second])
+  assert [replicas.choose() for _ in range(4)] == [first, second, first, second]
+
+
+def test_no_replicas_means_the_primary():
+  assert ReplicaSet([]).choose() is None
+
+
+def test_failed_connection_takes_a_replica_out():
+  healthy, broken = sqlite_replica(), unreachable_replica()
+  replicas = ReplicaSet([healthy, broken], retry_after=60)
+  with pytest.raises(exc.OperationalError):
+    broken.connect()
+  assert replicas.is_down(broken)
+  assert [replicas.choose() for _ in range(3)] == [healthy] * 3
+
+
+def test_failed_statement_keeps_a_replica_in():
+  replica = sqlite_replica()
+  replicas = ReplicaSet([replica])
+  # SQLite reports a missing table as an OperationalError, like a statement
+  # timeout on Postgres: the connection itself is fine.
+  with pytest.raises(exc.OperationalError):
+    replica.execute('SELECT * FROM missing')
+  assert not replicas.is_down(replica)
+  assert replicas.choose() is replica
+
+
+def test_falls_back_to_the_primary_when_every_replica_is_down():
+  broken = unreachable_replica()
+  replicas = ReplicaSet([broken], retry_after=60)
+  with pytest.raises(exc.OperationalError):
+    broken.connect()
+  assert replicas.choose() is None
+
+
+def test_a_replica_is_probed_again_after_retry_after():
+  replica = sqlite_replica()
+  replicas = ReplicaSet([replica], retry_after=0)
+  replicas.mark_down(replica)
+  assert replicas.choose() is replica
+  assert replicas.healthy() == [replica]
+
+
+# The app against Postgres, with replicas that are other engines on the test
+# database.
+
+@pytest.fixture
+def replicas(app, monkeypatch):
+  replicas = ReplicaSet([create_engine(TEST_DATABASE_URL) for _ in range(2)])
+  monkeypatch.setattr(fyyur, 'replicas', replicas)
+  yield replicas
+  for engine in replicas.engines:
+    engine.dispose()
+
+
+def test_reads_are_spread_over_the_replicas(client, replicas):
+  first, second = [Statements(engine) for engine in replicas.engines]
+  client.get('/artists')
+  assert (first.count > 0, second.count) == (True, 0)
+  client.get('/artists')
+  assert second.count > 0
+
+
+def test_a_client_reads_its_own_writes_from_the_primary(client, app, replicas):
+  used = [Statements(engine) for engine in replicas.engines]
+
+  def replica_statements():
+    return sum(statements.count for statements in used)
+
+  client.post('/artists/create', data={
+    'name': 'The Wild Sax Band', 'city': 'San Francisco', 'state': 'CA', 'phone': '432-325-5432',
+    'genres': 'Jazz', 'facebook_link': '', 'image_link': '', 'website': '', 'seeking_description': ''})
+  client.get('/artists')
+  assert replica_statements() == 0
+  # Other clients are not held to the primary.
+  app.test_client().get('/artists')
+  other = replica_statements()
+  assert other > 0
+  # Once the lag window has passed, neither is the writer.
+  with client.session_transaction() as session:
+    session['primary_until'] = 0
+  client.get('/artists')
+  assert replica_statements() > other
+
+
+def test_a_read_whose_replica_fails_runs_on_the_primary(client, artist, monkeypatch):
+  replicas = ReplicaSet([create_engine('postgresql://localhost:1/fyyur')], retry_after=60)
+  monkeypatch.setattr(fyyur, 'replicas', replicas)
+  response = client.get('/artists')
+  assert response.status_code == 200
+  assert b'Guns N Petals' in response.data
+  assert replicas.healthy() == []
+
+
+def test_a_statement_timeout_leaves_the_replica_in(app):
+  replica = create_engine(TEST_DATABASE_URL)
+  replicas = ReplicaSet([replica])
+  with replica.connect() as connection:
+    connection.execute('SET statement_timeout = 1')
+    with pytest.raises(exc.OperationalError):
+      connection.execute('SELECT pg_sleep(1)')
+  assert not replicas.is_down(replica)
+  replica.dispose()
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+import pytest
+
+from app import db, Venue, Artist, Show, current_time
+from conftest import asgi_get
+
+
+@pytest.fixture
+def started_show(venue, artist):
+  # A show that began an hour ago, before `flask roll-shows` has moved it to
+  # the past: the stored counters still call it upcoming.
+  start_time = current_time() - timedelta(hours=1)
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=start_time,
+                      end_time=start_time + timedelta(hours=2)))
+  for model in (Venue, Artist):
+    db.session.execute(model.__table__.update().values(
+      past_show_count=0, upcoming_show_count=1, next_show_at=start_time))
+  db.session.commit()
+
+
+@pytest.mark.parametrize('kind', ['venues', 'artists'])
+def test_stale_counters_are_recounted(client, venue, artist, started_show, kind):
+  entity = venue if kind == 'venues' else artist
+  response = client.get('/%s/%d' % (kind, entity.id))
+  assert response.status_code == 200
+  assert b'1 Past Show' in response.data
+
+
+@pytest.mark.parametrize('kind', ['venues', 'artists'])
+def test_stale_counters_are_recounted_on_the_event_loop(venue, artist, started_show, kind):
+  # asgi.py's packages are optional; see the README.
+  pytest.importorskip('asyncpg')
+  pytest.importorskip('asgiref')
+  entity = venue if kind == 'venues' else artist
+  status, headers, body = asgi_get('/%s/%d' % (kind, entity.id))
+  assert status == 200
+  assert b'1 Past Show' in body
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from app import db, Venue, Show, current_time
+
+
+def venue_form(**changes):
+  form = dict(name='The Dueling Pianos Bar', city='New York', state='NY', address='335 Delancey Street',
+              phone='914-003-1132', genres='Jazz', timezone='America/New_York', image_link='',
+              facebook_link='', website='', seeking_description='')
+  form.update(changes)
+  return form
+
+
+def test_a_new_venue_needs_a_known_timezone(client):
+  client.post('/venues/create', data=venue_form(timezone='Mars/Olympus'))
+  assert Venue.query.count() == 0
+  client.post('/venues/create', data=venue_form())
+  assert [venue.timezone for venue in Venue.query] == ['America/New_York']
+
+
+def test_an_edit_keeps_a_known_timezone(client, venue):
+  client.post('/venues/%d/edit' % venue.id, data=venue_form(timezone='Mars/Olympus'))
+  db.session.expire_all()
+  assert Venue.query.get(venue.id).timezone == 'America/Los_Angeles'
+
+
+def test_an_unknown_stored_timezone_reads_as_utc(client, venue, artist):
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=current_time() + timedelta(days=1)))
+  db.session.execute(Venue.__table__.update().values(timezone='Mars/Olympus'))
+  db.session.commit()
+  for path in ('/venues/%d' % venue.id, '/artists/%d' % artist.id, '/shows'):
+    assert client.get(path).status_code == 200
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+import pytest
+
+from app import db, Show, current_time
+from conftest import asgi_get
+
+
+def test_both_servers_give_a_page_the_same_etag(app, client, venue, artist, session_timezone, monkeypatch):
+  # asgi.py's packages are optional; see the README.
+  pytest.importorskip('asyncpg')
+  pytest.importorskip('asgiref')
+  # Pages with the SQL overlay (on with DEBUG) carry no validators.
+  monkeypatch.setitem(app.config, 'SQL_TRACE_OVERLAY', False)
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=current_time() + timedelta(days=1)))
+  db.session.commit()
+  # psycopg2 reads times in the session's zone; asyncpg always in UTC.
+  for path in ('/venues', '/venues/%d' % venue.id, '/artists', '/artists/%d' % artist.id, '/shows'):
+    etag = client.get(path).headers['ETag']
+    status, headers, body = asgi_get(path, [('If-None-Match', etag)])
+    assert (path, status) == (path, 304)